@@ -1,13 +1,17 @@
+import numpy as np
 from util_display import Displayable
 from util_class import ClassInitial,ErrorInitial,NullInitial
+from util_record import TrajectoryRecorder,ColumnsFromRow
+from util_store import TrajectoryWriter
+from util_snapshot import Forkable
 
-class Agent(Displayable):
+class Agent(Displayable,Forkable):
   def SelectAction(self,perception)->ErrorInitial:
     raise NotImplementedError("Go") # abstract method
   def InitialAction(self,perception)->ErrorInitial:
     return self.SelectAction(perception) # abstract method
   
-class Environment(Displayable):
+class Environment(Displayable,Forkable):
   def InitialPerception(self)->ErrorInitial:
     """
     returns the initial perception
@@ -20,21 +24,145 @@ class Environment(Displayable):
     raise NotImplementedError("Environment.Do") # abstract method
 
 # The simulator lets the agent and the environment take turns in updating their states and returning the action and the percept.
-class Simulate(Displayable):
+class Simulate(Displayable,Forkable):
   """
   simulate the interaction between the agent and the environment
   returns a pair of the agent state and the environment state
+  with a storePath every step (the step number, the action as "action.<key>" and the resulting perception) is appended to a trajectory file
+  the first record holds the initial perception with zero actions; the file is flushed at the end of every Go
+  Snapshot/Restore/Fork cover the agent, the environment and the histories (see util_snapshot); a fork does not write to the store
+  """
+  stateFields = ("agent","environment","steps","perception","perceptionHistory","actionHistory")
+  def __init__(self,agent:ClassInitial,environment:ClassInitial,storePath:str|None=None)->ClassInitial:
+    self.agent = agent
+    self.environment = environment
+    self.storePath = storePath
+    self.store = None # created once the first action shows the action fields
+    self.steps = 0
+    self.perception = self.environment.InitialPerception()
+    self.perceptionHistory = TrajectoryRecorder.FromRow(self.perception)
+    self.perceptionHistory.AppendRow(self.perception)
+    self.actionHistory = None # declared from the first action
+  def Go(self,n:int)->None|NullInitial:
+    self.Steps(n)
+    if self.store is not None:
+      self.store.Flush()
+    profiler = self.profiler
+    if profiler is not None:
+      profiler.Count("simulate.steps",n)
+      self.display(1,profiler.Report())
+  def Steps(self,n:int)->dict|None:
+    """
+    the loop of Go: n steps of the agent and the environment, recorded, without the flush and the profiler report at the end
+    returns the last action (None for no steps)
+    """
+    verbose = self.Displaying(2)
+    profiler = self.profiler
+    every = profiler.every if profiler is not None else 0
+    action = None
+    for idx in range(n):
+      timed = every and idx%every == 0
+      if timed:
+        start = profiler.clock()
+      action = self.agent.SelectAction(self.perception)
+      if timed:
+        start = profiler.Add("simulate.agent",start,every)
+      if self.actionHistory is None:
+        self.actionHistory = TrajectoryRecorder.FromRow(action)
+        if self.storePath is not None:
+          self.OpenStore(action)
+      self.actionHistory.AppendRow(action)
+      if verbose:
+        self.Event(2,"action",count=idx,action=action)
+      if timed:
+        start = profiler.Add("simulate.record",start,every)
+      self.perception = self.environment.Do(action)
+      if timed:
+        start = profiler.Add("simulate.environment",start,every)
+      self.steps += 1
+      self.perceptionHistory.AppendRow(self.perception)
+      if self.store is not None:
+        self.store.Append(self.steps,*self.perception.values(),*action.values())
+      if verbose:
+        self.display(2,"\t Perception:",self.perception)
+      if timed:
+        profiler.Add("simulate.record",start,every)
+    return action
+  def Apply(self,actions:list)->None|NullInitial:
+    """
+    steps the environment with the given actions instead of the agent's (an outside controller acting for it)
+    the histories and the store are filled as in Go; the agent's own state is left as it was
+    an action the environment rejects raises before anything of its step is recorded
+    """
+    for action in actions:
+      perception = self.environment.Do(action)
+      if self.actionHistory is None:
+        self.actionHistory = TrajectoryRecorder.FromRow(action)
+        if self.storePath is not None:
+          self.OpenStore(action)
+      self.actionHistory.AppendRow(action)
+      self.perception = perception
+      self.steps += 1
+      self.perceptionHistory.AppendRow(self.perception)
+      if self.store is not None:
+        self.store.Append(self.steps,*self.perception.values(),*action.values())
+    if self.store is not None:
+      self.store.Flush()
+  def Fork(self)->ClassInitial:
+    clone = Forkable.Fork(self)
+    clone.storePath,clone.store = None,None # the trajectory file stays with the original
+    return clone
+  def OpenStore(self,action:dict)->None|NullInitial:
+    fields = {"step":np.int64}
+    fields.update(ColumnsFromRow(self.perception))
+    fields.update({"action."+name:spec for name,spec in ColumnsFromRow(action).items()})
+    self.store = TrajectoryWriter(self.storePath,fields)
+    initial = self.perceptionHistory.View()
+    self.store.Append(0,*(initial[name][0] for name in self.perception),*(0 for name in action))
+
+"""
+# Batched Simulation
+- The batched interfaces step N independent agent/environment pairs in lockstep.
+- Perceptions and actions are dictionaries of NumPy arrays of length N, one entry per instance.
+- Environments return the same perception dictionary on every step and update its arrays in place, so the loop allocates no per-step dictionaries.
+"""
+class BatchAgent(Displayable):
+  def SelectAction(self,perception)->ErrorInitial:
+    """
+    returns a dictionary of action arrays, one entry per instance
+    """
+    raise NotImplementedError("BatchAgent.SelectAction") # abstract method
+  def InitialAction(self,perception)->ErrorInitial:
+    return self.SelectAction(perception) # abstract method
+
+class BatchEnvironment(Displayable):
+  size:ClassInitial|int = 1 # number of instances stepped per call
+  def InitialPerception(self)->ErrorInitial:
+    """
+    returns the initial perception arrays
+    """
+    raise NotImplementedError("BatchEnvironment.InitialPerception") # abstract method
+  def Do(self,action)->ErrorInitial:
+    """
+    returns the next perception arrays
+    """
+    raise NotImplementedError("BatchEnvironment.Do") # abstract method
+
+class BatchSimulate(Displayable):
+  """
+  simulate N agent-environment pairs at once
+  each call to Go advances every instance by the same number of steps
   """
   def __init__(self,agent:ClassInitial,environment:ClassInitial)->ClassInitial:
     self.agent = agent
     self.environment = environment
     self.perception = self.environment.InitialPerception()
-    self.perceptionHistory = [self.perception]
-    self.actionHistory = []
   def Go(self,n:int)->None|NullInitial:
+    verbose = self.Displaying(2)
     for idx in range(n):
       action = self.agent.SelectAction(self.perception)
-      self.display(2,f"Count: {idx} [::] Action: {action}")
+      if verbose:
+        self.Event(2,"action",count=idx,action=action)
       self.perception = self.environment.Do(action)
-      self.display(2,f"\t Perception: {self.perception}")
-  
\ No newline at end of file
+      if verbose:
+        self.display(2,"\t Perception:",self.perception)
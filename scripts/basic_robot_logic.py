@@ -1,5 +1,5 @@
-import math,time,os
-import matplotlib.pyplot as plt
+import math,os
+from util_render import TraceBuffer,Renderer,FinalFrameRenderer
 
 """
 simple robotic navigation without obstacle detection
@@ -31,14 +31,17 @@ class SimpleRobot:
   
 
 class VisualRobot:
-  def __init__(self,x:int=0,y:int=0,direction:int=90):
+  def __init__(self,x:int=0,y:int=0,direction:int=90,renderer=None):
     self.x = x
     self.y = y
     self.direction = direction
-    self.figure,self.axs = plt.subplots()
-    self.axs.set_aspect("equal","box")
-    self.axs.grid(True)
-    self.axs.plot(self.x,self.y,"go") # Initial position
+    self.trace = TraceBuffer(("path",))
+    self.renderer = renderer if renderer is not None else Renderer()
+    self.renderer.Begin(self.trace,self.PlotStart)
+  def PlotStart(self,axs):
+    axs.set_aspect("equal","box")
+    axs.grid(True)
+    axs.plot(self.x,self.y,"go") # Initial position
   def Turn(self,angle:int|float):
     """
     Turn the robot by a certain angle (degrees)
@@ -46,11 +49,10 @@ class VisualRobot:
     self.direction = (self.direction+angle)%360
   def UpdatePlot(self):
     """
-    Update the plot with the robot's current position
+    Record the robot's current position for the renderer
     """
-    self.axs.plot(self.x,self.y,"ro")
-    plt.draw()
-    plt.pause(0.4)
+    self.trace.Add("path",self.x,self.y)
+    self.renderer.Step()
   def MoveForward(self,distance:int|float):
     radian = math.radians(self.direction)
     self.x += distance*math.cos(radian)
@@ -59,11 +61,11 @@ class VisualRobot:
   def GetPosition(self):
     return self.x,self.y,self.direction
   
-robot = VisualRobot()
-movements = [(10,0),(10,-10),(10,90),(5,90)]
-for distance,angle in movements:
-  robot.MoveForward(distance)
-  robot.Turn(angle)
-  time.sleep(0.7)
-plt.savefig(os.path.join(os.getcwd(),"basic_robot_simulation.png"))
-plt.show()
\ No newline at end of file
+if __name__ == "__main__":
+  renderer = FinalFrameRenderer(path=os.path.join(os.getcwd(),"basic_robot_simulation.png"),styles={"path":("ro",{})})
+  robot = VisualRobot(renderer=renderer)
+  movements = [(10,0),(10,-10),(10,90),(5,90)]
+  for distance,angle in movements:
+    robot.MoveForward(distance)
+    robot.Turn(angle)
+  renderer.Finish()
@@ -0,0 +1,282 @@
+import json,math,os,platform,random,statistics,sys,time
+import numpy as np
+import matplotlib
+matplotlib.use("Agg") # the cases never draw, but the modules import pyplot
+from util_class import ClassInitial,NullInitial
+from util_display import Displayable
+from util_project import ArgMax,ArgMaxArray,ArgMaxRows,SelectFromDistribution,DiscreteDistribution
+from agent_configuration import Simulate
+from event_scheduler import EventSimulate
+from buying_simulation import PSEnvironment,PSAgent
+from fuel_simulation import FuelEnvironment,FuelAgent,FuelSimulation
+from garden_simulation import Garden,LawnMower
+from coverage_planner import CoveragePlanner
+from wall_environment import LineSegmentInterception,WallEnvironment,BodyEnvironment,Lidar
+
+"""
+# Benchmark Suite
+- Headless, seeded and parameterized benchmarks of the simulation and geometry hot paths.
+- A case is a function (seed,**parameters) -> (units,unit,run): it builds its inputs, and run() does the timed work of `units` units.
+  Every repeat builds the case again, so runs that change their state (a robot that moved, a mown garden) start from the same state.
+- The best of the repeats is reported (the least disturbed run) with the median next to it, as seconds and units per second.
+- Results are a JSON document (Save/Load); Compare matches them against a baseline by case and parameters (not by work size, as rates
+  are per unit) and gives the speedup of each, flagging the ones slower than the baseline by more than a tolerance.
+- Run it as a script: python benchmark_suite.py [--quick] [--only name,...] [--output results.json] [--baseline baseline.json]
+"""
+
+def SegmentCase(seed:int,pairs:int=20000)->tuple:
+  rng = np.random.default_rng(seed)
+  segments = [(((a,b),(c,d)),((e,f),(g,h))) for a,b,c,d,e,f,g,h in rng.uniform(0,10,size=(pairs,8)).tolist()]
+  def Run()->None|NullInitial:
+    for lineA,lineB in segments:
+      LineSegmentInterception(lineA,lineB)
+  return pairs,"pairs",Run
+
+def RandomWalls(count:int,seed:int,extent:int|float=60,length:int|float=5,keepOut:int|float=12)->set:
+  """
+  count walls of the given length scattered over [-extent,extent]^2, none closer than keepOut to the origin
+  """
+  rng = random.Random(seed)
+  walls = set()
+  while len(walls) < count:
+    x,y = rng.uniform(-extent,extent),rng.uniform(-extent,extent)
+    angle = rng.uniform(0,2*math.pi)
+    wall = ((x,y),(x+length*math.cos(angle),y+length*math.sin(angle)))
+    if min(math.hypot(*end) for end in wall) > keepOut:
+      walls.add(wall)
+  return walls
+
+def BodyCase(seed:int,walls:int=64,steps:int=20000)->tuple:
+  """
+  the body circles the origin (always steering left), so it never crashes and every step runs the collision and whisker tests
+  """
+  body = BodyEnvironment(WallEnvironment(RandomWalls(walls,seed)),initPosition=(0,0,90))
+  action = {"steer":"left"}
+  def Run()->None|NullInitial:
+    for idx in range(steps):
+      body.Do(action)
+  return steps,"steps",Run
+
+def SensorCase(seed:int,walls:int=64,sensor:str="lidar",calls:int=20000)->tuple:
+  """
+  one sensor reading (the whisker, or a default Lidar scan) per call, at the poses of one lap of the circling body
+  the lap revisits its poses, so this is the steady state; a lidar's first scan from a new cell and heading also builds its tables
+  """
+  body = BodyEnvironment(WallEnvironment(RandomWalls(walls,seed)),initPosition=(0,0,90))
+  poses = []
+  for idx in range(round(360/body.turningAngle)):
+    poses.append((body.xPos,body.yPos,body.direction))
+    body.Do({"steer":"left"})
+  lidar = Lidar()
+  def Run()->None|NullInitial:
+    for idx in range(calls):
+      body.xPos,body.yPos,body.direction = poses[idx%len(poses)]
+      if sensor == "lidar":
+        lidar.Scan(body.environment,body.xPos,body.yPos,body.direction)
+      else:
+        body.Whisker()
+  return calls,"calls",Run
+
+def SimulateCase(seed:int,steps:int=20000)->tuple:
+  random.seed(seed)
+  environment = PSEnvironment()
+  simulation = Simulate(PSAgent(environment),environment)
+  return steps,"steps",lambda:simulation.Go(steps)
+
+def FuelCase(seed:int,steps:int=20000)->tuple:
+  random.seed(seed)
+  environment = FuelEnvironment()
+  simulation = FuelSimulation(FuelAgent(environment),environment)
+  return steps,"steps",lambda:simulation.Run(steps)
+
+def EventSimulateCase(seed:int,domain:str="paper",event:bool=True,seeded:bool=False,steps:int=20000)->tuple:
+  """
+  the default paper or fuel configuration run by EventSimulate, or by Simulate (event=False) to compare with
+  the environment draws from the random module, or from a BlockRandom seeded with the seed (seeded=True)
+  """
+  random.seed(seed)
+  rng = seed if seeded else None
+  environment,agentClass = (PSEnvironment(rng),PSAgent) if domain == "paper" else (FuelEnvironment(rng),FuelAgent)
+  simulation = (EventSimulate if event else Simulate)(agentClass(environment),environment)
+  return steps,"steps",lambda:simulation.Go(steps)
+
+def LawnMowerCase(seed:int,size:int=50,steps:int=20000,obstacleShare:float=0.05)->tuple:
+  random.seed(seed)
+  rng = np.random.default_rng(seed)
+  obstacles = [tuple(point) for point in rng.integers(1,size,size=(int(obstacleShare*size*size),2)).tolist()]
+  mower = LawnMower(Garden(size,size,obstacles))
+  return steps,"steps",lambda:mower.StartMoving(steps)
+
+def CoveragePlanCase(seed:int,size:int=1000,obstacleShare:float=0.02)->tuple:
+  rng = np.random.default_rng(seed)
+  garden = Garden(size,size,rng.integers(1,size,size=(int(obstacleShare*size*size),2)))
+  return garden.FreeCells(),"cells",lambda:CoveragePlanner(garden).Plan((0,0))
+
+def ArgMaxCase(seed:int,length:int=10,calls:int=20000)->tuple:
+  random.seed(seed)
+  rng = np.random.default_rng(seed)
+  lists = rng.integers(0,5,size=(calls,length)).tolist()
+  def Run()->None|NullInitial:
+    for values in lists:
+      ArgMax(values)
+  return calls,"calls",Run
+
+def ArgMaxArrayCase(seed:int,length:int=10,calls:int=20000)->tuple:
+  random.seed(seed)
+  arrays = list(np.random.default_rng(seed).integers(0,5,size=(calls,length)))
+  def Run()->None|NullInitial:
+    for values in arrays:
+      ArgMaxArray(values)
+  return calls,"calls",Run
+
+def ArgMaxRowsCase(seed:int,rows:int=1000,columns:int=8,calls:int=200)->tuple:
+  rng = np.random.default_rng(seed)
+  table = rng.integers(0,5,size=(rows,columns)).astype(float)
+  return calls*rows,"rows",lambda:[ArgMaxRows(table,rng) for idx in range(calls)]
+
+def DistributionCase(seed:int,items:int=8,draws:int=20000)->tuple:
+  random.seed(seed)
+  distribution = {item:1/items for item in range(items)}
+  def Run()->None|NullInitial:
+    for idx in range(draws):
+      SelectFromDistribution(distribution)
+  return draws,"draws",Run
+
+def AliasCase(seed:int,items:int=8,draws:int=20000)->tuple:
+  random.seed(seed)
+  distribution = DiscreteDistribution({item:1/items for item in range(items)})
+  def Run()->None|NullInitial:
+    for idx in range(draws):
+      distribution.Sample()
+  return draws,"draws",Run
+
+cases = {
+  # name -> (case,list of parameter dictionaries)
+  "segmentIntersection":(SegmentCase,[{}]),
+  "bodySteps":(BodyCase,[{"walls":walls} for walls in (0,16,64,256,1024)]),
+  "sensors":(SensorCase,[{"walls":walls,"sensor":sensor} for walls in (0,16,64,256,1024) for sensor in ("whisker","lidar")]),
+  "simulatePS":(SimulateCase,[{}]),
+  "fuelRun":(FuelCase,[{}]),
+  "eventSimulate":(EventSimulateCase,[{"domain":domain,"seeded":seeded,"event":event}
+    for domain in ("paper","fuel") for seeded in (False,True) for event in (False,True)]),
+  "lawnMower":(LawnMowerCase,[{"size":size} for size in (20,100,400)]),
+  "coveragePlan":(CoveragePlanCase,[{"size":size} for size in (200,1000)]),
+  "argMax":(ArgMaxCase,[{"length":length} for length in (4,32)]),
+  "argMaxArray":(ArgMaxArrayCase,[{"length":length} for length in (4,32)]),
+  "argMaxRows":(ArgMaxRowsCase,[{}]),
+  "selectFromDistribution":(DistributionCase,[{"items":items} for items in (4,64)]),
+  "discreteDistribution":(AliasCase,[{"items":items} for items in (4,64)])
+}
+
+def Measure(case:ClassInitial,parameters:dict,seed:int=0,repeat:int=5,scale:float=1)->dict:
+  """
+  times the case repeat times; scale multiplies its work sizes (the parameters named steps, pairs, calls or draws)
+  """
+  sizes = {name:max(1,int(value*scale)) for name,value in Defaults(case).items() if name in ("steps","pairs","calls","draws") and name not in parameters}
+  seconds = []
+  for idx in range(repeat):
+    units,unit,run = case(seed,**parameters,**sizes)
+    start = time.perf_counter()
+    run()
+    seconds.append(time.perf_counter()-start)
+  best = min(seconds)
+  return {
+    "parameters":parameters,
+    "sizes":sizes,
+    "unit":unit,
+    "units":units,
+    "seconds":best,
+    "medianSeconds":statistics.median(seconds),
+    "rate":units/best if best > 0 else math.inf,
+    "repeat":repeat
+  }
+
+def Defaults(function:ClassInitial)->dict:
+  code = function.__code__
+  names = code.co_varnames[:code.co_argcount]
+  return dict(zip(names[len(names)-len(function.__defaults__ or ()):],function.__defaults__ or ()))
+
+def RunSuite(only:list|None=None,seed:int=0,repeat:int=5,scale:float=1,display:ClassInitial=print)->dict:
+  """
+  runs the cases (all of them, or the names in only) and returns the results document
+  """
+  maxDisplay = Displayable.maxDisplay
+  Displayable.maxDisplay = 0 # the runs must not print
+  results = []
+  try:
+    for name,(case,parameterList) in cases.items():
+      if only is not None and name not in only:
+        continue
+      for parameters in parameterList:
+        result = Measure(case,parameters,seed,repeat,scale)
+        result["case"] = name
+        results.append(result)
+        if display is not None:
+          display(f"{name:<24}{json.dumps(parameters):<18}{result['rate']:>14.0f} {result['unit']}/s")
+  finally:
+    Displayable.maxDisplay = maxDisplay
+  return {
+    "machine":{"python":platform.python_version(),"numpy":np.__version__,"platform":platform.platform(),"processor":platform.processor()},
+    "time":time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "seed":seed,
+    "results":results
+  }
+
+def Save(document:dict,path:str)->None|NullInitial:
+  with open(path,"w",encoding="utf-8") as handle:
+    json.dump(document,handle,indent=1)
+
+def Load(path:str)->dict:
+  with open(path,encoding="utf-8") as handle:
+    return json.load(handle)
+
+def Key(result:dict)->tuple:
+  return result["case"],json.dumps(result["parameters"],sort_keys=True)
+
+def Compare(document:dict,baseline:dict,tolerance:float=0.1)->list:
+  """
+  returns one entry per result that is also in the baseline: its speedup (baseline seconds per unit over new seconds per unit)
+  and whether it is a regression (slower than the baseline by more than tolerance)
+  """
+  previous = {Key(result):result for result in baseline["results"]}
+  comparison = []
+  for result in document["results"]:
+    before = previous.get(Key(result))
+    if before is None:
+      continue
+    speedup = result["rate"]/before["rate"]
+    comparison.append({
+      "case":result["case"],
+      "parameters":result["parameters"],
+      "baselineRate":before["rate"],
+      "rate":result["rate"],
+      "speedup":speedup,
+      "regression":speedup < 1-tolerance
+    })
+  return comparison
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description="benchmarks of the simulation and geometry hot paths")
+  parser.add_argument("--only",help="comma separated case names",default=None)
+  parser.add_argument("--seed",type=int,default=0)
+  parser.add_argument("--repeat",type=int,default=5)
+  parser.add_argument("--quick",action="store_true",help="a tenth of the work and 3 repeats")
+  parser.add_argument("--output",default="benchmark_results.json")
+  parser.add_argument("--baseline",default=None,help="a results file to compare with")
+  parser.add_argument("--tolerance",type=float,default=0.1)
+  arguments = parser.parse_args()
+  only = arguments.only.split(",") if arguments.only else None
+  unknown = [name for name in only or [] if name not in cases]
+  if unknown:
+    parser.error(f"unknown cases {unknown}; the cases are {list(cases)}")
+  document = RunSuite(only,arguments.seed,3 if arguments.quick else arguments.repeat,0.1 if arguments.quick else 1)
+  if arguments.baseline is not None:
+    document["comparison"] = Compare(document,Load(arguments.baseline),arguments.tolerance)
+    for entry in document["comparison"]:
+      flag = "REGRESSION" if entry["regression"] else ""
+      print(f"{entry['case']:<24}{json.dumps(entry['parameters']):<18}{entry['speedup']:>8.2f}x {flag}")
+  Save(document,arguments.output)
+  print(f"Results: {os.path.abspath(arguments.output)}")
+  if any(entry["regression"] for entry in document.get("comparison",[])):
+    sys.exit(1)
@@ -5,11 +5,14 @@ The perception consists of the price and the amount of paper in stock.
 The action of the agent is the number to buy.
 """
 
-import random,os
+import os
+import numpy as np
 import matplotlib.pyplot as plt
-from agent_configuration import Agent,Environment,Simulate
+from agent_configuration import Agent,Environment,Simulate,BatchAgent,BatchEnvironment
 from util_class import ClassInitial,NullInitial
-from util_project import SelectFromDistribution
+from util_project import DiscreteDistribution,RunningAverages
+from util_random import RandomSource
+from util_record import TrajectoryRecorder
 
 class PSEnvironment(Environment):
   priceDelta = [
@@ -20,47 +23,99 @@ class PSEnvironment(Environment):
     0, 5, 0
   ]
   standardDeviation = 5
-  def __init__(self)->ClassInitial:
+  paperDistribution = DiscreteDistribution(
+    {
+      6:0.1,
+      5:0.1,
+      4:0.1,
+      3:0.3,
+      2:0.2,
+      1:0.2
+    }
+  ) # amount of paper used per step, compiled once
+  maxUse = max(paperDistribution.items) # most paper used in one step
+  stockKey = "instock" # the stock in the perception
+  minPrice = None # the price has no floor
+  lostSales = False # paper used beyond the stock is owed (the stock goes negative)
+  stateFields = ("time","stock","price","rng","record") # what Snapshot/Restore/Fork carry (see util_snapshot)
+  def __init__(self,rng:ClassInitial=None)->ClassInitial:
+    """
+    rng is the random source (see util_random): None draws from the random module, an int seeds a BlockRandom
+    """
+    self.rng = RandomSource(rng)
     self.time = 0
     self.stock = 20
-    self.stockHistory = [] # memory of the stock history
-    self.priceHistory = [] # memory of the price history
+    self.record = TrajectoryRecorder({"stock":np.int64,"price":np.int64}) # memory of the stock and price history
+  @property
+  def stockHistory(self)->np.ndarray:
+    return self.record.Column("stock")
+  @property
+  def priceHistory(self)->np.ndarray:
+    return self.record.Column("price")
+  @classmethod
+  def SampleUse(cls,generator:ClassInitial,shape:tuple)->np.ndarray:
+    """
+    amounts of paper used, an array of the given shape drawn from a NumPy generator (for models of the environment, see rollout_planner)
+    """
+    return cls.paperDistribution.Sample(int(np.prod(shape)),rng=generator).reshape(shape)
   def InitialPerception(self):
     """
-    initial perception
+    initial perception; the initial price is drawn and recorded once, however many of the agent and the simulation ask for it
     """
-    self.stockHistory.append(self.stock)
-    self.price = round(234+self.standardDeviation*random.gauss(0,1))
-    self.priceHistory.append(self.price)
+    if not len(self.record):
+      self.price = round(234+self.standardDeviation*self.rng.Gauss())
+      self.record.Append(self.stock,self.price)
     return {
       "price":self.price,
       "instock":self.stock
     }
   def Do(self,action)->dict:
-    paperUsed = SelectFromDistribution(
-      {
-        6:0.1,
-        5:0.1,
-        4:0.1,
-        3:0.3,
-        2:0.2,
-        1:0.2
-      }
-    )
+    paperUsed = self.paperDistribution.Sample(rng=self.rng)
     bought = action["buy"]
     self.stock = self.stock+bought-paperUsed
-    self.stockHistory.append(self.stock)
     self.time += 1
     self.price = round(
       self.price
       +self.priceDelta[self.time%len(self.priceDelta)] # repeating pattern
-      +self.standardDeviation*random.gauss(0,1) # randomness
+      +self.standardDeviation*self.rng.Gauss() # randomness
     )
-    self.priceHistory.append(self.price)
+    self.record.Append(self.stock,self.price)
     return {
       "price":self.price,
       "instock":self.stock
     }
+  def Deltas(self,steps:int)->np.ndarray:
+    """
+    the pattern's price changes of the next steps, as a slice of the pattern repeated (kept until priceDelta is replaced)
+    """
+    start = (self.time+1)%len(self.priceDelta)
+    if getattr(self,"deltaSource",None) is not self.priceDelta or len(self.deltaArray) < start+steps:
+      self.deltaSource = self.priceDelta
+      self.deltaArray = np.tile(np.asarray(self.priceDelta),(start+steps)//len(self.priceDelta)+1)
+    return self.deltaArray[start:start+steps]
+  def Skip(self,steps:int,action:dict,keep:ClassInitial=None)->dict:
+    """
+    does the same action for the given number of steps, with the random numbers Do would draw, as one vectorised stretch:
+    the stock is a cumulative sum of the uses and, the price being an integer, round(price+delta+noise) is price+round(delta+noise)
+    keep, if given, is called with the perceptions of all the steps and returns how many of them to take; the others are not taken
+    and their random numbers are left for the next steps
+    returns the perceptions after each step taken as arrays
+    """
+    uniforms,noise = self.rng.Peek(steps,"random","gauss")
+    stocks = self.stock+np.cumsum(action["buy"]-self.paperDistribution.Select(uniforms))
+    deltas = self.Deltas(steps)
+    prices = self.price+np.cumsum(np.round(deltas+self.standardDeviation*noise)).astype(np.int64)
+    taken = steps if keep is None else keep({"price":prices,"instock":stocks})
+    self.rng.Advance(taken,"random","gauss")
+    stocks,prices = stocks[:taken],prices[:taken]
+    if taken:
+      self.time += taken
+      self.stock,self.price = int(stocks[-1]),int(prices[-1])
+      self.record.Extend(stock=stocks,price=prices)
+    return {
+      "price":prices,
+      "instock":stocks
+    }
 
 """
 The agent does not have access to the price model but can only observe the current price and the amount in stock.
@@ -71,24 +126,148 @@ The agent decides how much paper to buy based on its belief state, which include
 The agent prefers to buy more paper if the price is significantly lower than its estimated average price and if the stock is below a certain threshold.
 """
 class PSAgent(Agent):
-  def __init__(self):
+  stateFields = ("spent","ave","lastPrice","instock","record")
+  def __init__(self,environment:ClassInitial,cheapRatio:float=0.9,cheapStock:int=60,cheapBuy:int=48,lowStock:int=12,lowBuy:int=12)->ClassInitial:
+    """
+    buys cheapBuy when the price is below cheapRatio times the average and the stock is below cheapStock
+    otherwise buys lowBuy when the stock is below lowStock
+    """
+    self.cheapRatio,self.cheapStock,self.cheapBuy = cheapRatio,cheapStock,cheapBuy
+    self.lowStock,self.lowBuy = lowStock,lowBuy
     self.spent = 0
     perception = environment.InitialPerception()
     self.ave = self.lastPrice = perception["instock"]
-    self.buyHistory = []
+    self.record = TrajectoryRecorder({"buy":np.int64})
+    self.maxUse = getattr(environment,"maxUse",None) # lets an EventSimulate skip the steps it surely buys nothing
+    self.lookahead = None # (prices,averages) of the last RepeatDecisions
+    self.idleAction = {"buy":0}
+  @property
+  def buyHistory(self)->np.ndarray:
+    return self.record.Column("buy")
   def SelectAction(self, perception)->dict:
     self.lastPrice = perception["price"]
     self.ave = self.ave+(self.lastPrice-self.ave)*0.05
     self.instock = perception["instock"]
-    if self.lastPrice < 0.9*self.ave and self.instock < 60:
-      toBuy = 48
-    elif self.instock < 12:
-      toBuy = 12
+    if self.lastPrice < self.cheapRatio*self.ave and self.instock < self.cheapStock:
+      toBuy = self.cheapBuy
+    elif self.instock < self.lowStock:
+      toBuy = self.lowBuy
     else:
       toBuy = 0
     self.spent += toBuy*self.lastPrice
-    self.buyHistory.append(toBuy)
+    self.record.Append(toBuy)
     return {"buy":toBuy}
+  def IdleSteps(self,perception:dict)->int:
+    """
+    the number of decisions from now that surely buy nothing: the stock stays at or above both thresholds
+    even if the most paper is used on every step
+    """
+    floor = max(self.cheapStock,self.lowStock)
+    if self.maxUse is None or perception["instock"] < floor:
+      return 0
+    return (perception["instock"]-floor)//self.maxUse+1
+  def RepeatDecisions(self,perceptions:dict,action:dict)->int:
+    """
+    the number of leading decisions that surely buy action["buy"], if SelectAction saw each of the perceptions (arrays) in turn
+    a price within a rounding margin of cheapRatio times the average could be cheap or not, so it only counts if both give that buy
+    """
+    prices,stocks = perceptions["price"],perceptions["instock"]
+    averages = RunningAverages(self.ave,prices,0.05)
+    self.lookahead = (prices,averages) # for the Skip that follows
+    threshold = self.cheapRatio*averages
+    margin = 1e-9*np.abs(threshold)
+    buy = action["buy"]
+    low = stocks < self.lowStock
+    otherwise = np.zeros(len(prices),dtype=bool) # where the rule, if the price is not cheap, buys that amount
+    if self.lowBuy == buy:
+      otherwise |= low
+    if buy == 0:
+      otherwise |= ~low
+    maybeCheap = (stocks < self.cheapStock)&(prices < threshold+margin)
+    if self.cheapBuy == buy:
+      repeat = otherwise|(maybeCheap&(prices < threshold-margin))
+    else:
+      repeat = otherwise&~maybeCheap
+    return len(repeat) if repeat.all() else int(repeat.argmin())
+  def Skip(self,perceptions:dict,action:dict)->None|NullInitial:
+    """
+    updates the belief state as if SelectAction had seen each of the perceptions and bought action["buy"] every time
+    """
+    prices,lookahead = perceptions["price"],self.lookahead
+    self.lookahead = None
+    if lookahead is not None and (prices is lookahead[0] or prices.base is lookahead[0]): # the averages RepeatDecisions worked out
+      self.ave = lookahead[1][len(prices)-1].item()
+    else:
+      self.ave = RunningAverages(self.ave,prices,0.05)[-1].item()
+    self.lastPrice = perceptions["price"][-1].item()
+    self.instock = perceptions["instock"][-1].item()
+    self.spent += (action["buy"]*perceptions["price"]).sum().item()
+    self.record.Extend(buy=np.full(len(perceptions["price"]),action["buy"],dtype=np.int64))
+
+"""
+# Batched Paper Buying
+- BatchPSEnvironment and BatchPSAgent step N independent copies of PSEnvironment and PSAgent in lockstep.
+- They follow the same price model, demand distribution and buying rule as the scalar versions.
+- Random draws come from a NumPy generator, so a fixed seed reproduces the whole batch.
+"""
+class BatchPSEnvironment(BatchEnvironment):
+  priceDelta = np.array(PSEnvironment.priceDelta)
+  standardDeviation = PSEnvironment.standardDeviation
+  paperDistribution = PSEnvironment.paperDistribution
+  def __init__(self,size:int,seed:int|None=None)->ClassInitial:
+    self.size = size
+    self.rng = np.random.default_rng(seed)
+    self.time = 0
+    self.stock = np.full(size,20,dtype=np.int64)
+    self.price = np.zeros(size)
+    self.record = TrajectoryRecorder({"stock":(np.int64,(size,)),"price":(np.float64,(size,))}) # one row of N values per step
+    self.perception = {
+      "price":self.price,
+      "instock":self.stock
+    }
+  stockHistory = PSEnvironment.stockHistory
+  priceHistory = PSEnvironment.priceHistory
+  def InitialPerception(self)->dict:
+    """
+    initial perception
+    """
+    if not len(self.record): # drawn and recorded once, as for PSEnvironment
+      self.price[:] = np.round(234+self.standardDeviation*self.rng.standard_normal(self.size))
+      self.record.Append(self.stock,self.price)
+    return self.perception
+  def Do(self,action)->dict:
+    paperUsed = self.paperDistribution.Sample(self.size,rng=self.rng)
+    self.stock += action["buy"]
+    self.stock -= paperUsed
+    self.time += 1
+    self.price += self.priceDelta[self.time%len(self.priceDelta)] # repeating pattern
+    self.price += self.standardDeviation*self.rng.standard_normal(self.size) # randomness
+    np.round(self.price,out=self.price)
+    self.record.Append(self.stock,self.price)
+    return self.perception
+
+class BatchPSAgent(BatchAgent):
+  def __init__(self,environment:ClassInitial,cheapRatio:float=0.9,cheapStock:int=60,cheapBuy:int=48,lowStock:int=12,lowBuy:int=12)->ClassInitial:
+    self.cheapRatio,self.cheapStock,self.cheapBuy = cheapRatio,cheapStock,cheapBuy
+    self.lowStock,self.lowBuy = lowStock,lowBuy
+    self.size = environment.size
+    self.spent = np.zeros(self.size)
+    perception = environment.InitialPerception()
+    self.ave = perception["instock"].astype(float)
+    self.lastPrice = self.ave.copy()
+    self.toBuy = np.zeros(self.size,dtype=np.int64)
+    self.record = TrajectoryRecorder({"buy":(np.int64,(self.size,))}) # one row of N values per step
+    self.action = {"buy":self.toBuy}
+  buyHistory = PSAgent.buyHistory
+  def SelectAction(self,perception)->dict:
+    self.lastPrice[:] = perception["price"]
+    self.ave += (self.lastPrice-self.ave)*0.05
+    self.instock = perception["instock"]
+    cheap = (self.lastPrice < self.cheapRatio*self.ave)&(self.instock < self.cheapStock)
+    self.toBuy[:] = np.where(cheap,self.cheapBuy,np.where(self.instock < self.lowStock,self.lowBuy,0))
+    self.spent += self.toBuy*self.lastPrice
+    self.record.Append(self.toBuy)
+    return self.action
 
 #CHECK RESULTS
 class PlotHistory(object):
@@ -103,9 +282,9 @@ class PlotHistory(object):
     """
     plot history of price and instock
     """
-    number = len(environment.stockHistory)
-    plt.plot(range(number),environment.priceHistory,label="Price")
-    plt.plot(range(number),environment.stockHistory,label="In Stock")
+    number = len(self.environment.stockHistory)
+    plt.plot(range(number),self.environment.priceHistory,label="Price")
+    plt.plot(range(number),self.environment.stockHistory,label="In Stock")
     plt.legend()
     plt.savefig(os.path.join(os.getcwd(),"environment_history.png"))
     print("Environment Result Has Been Saved")
@@ -113,21 +292,29 @@ class PlotHistory(object):
     """
     plot history of buying
     """
-    number = len(agent.buyHistory)
-    plt.bar(range(1,number+1),agent.buyHistory,label="Bought")
+    number = len(self.agent.buyHistory)
+    plt.bar(range(1,number+1),self.agent.buyHistory,label="Bought")
     plt.legend()
     plt.savefig(os.path.join(os.getcwd(),"agent_history.png"))
     print("Agent Result Has Been Saved")
 
 # UNIT TEST
 #environment = PSEnvironment()
-#agent = PSAgent()
+#agent = PSAgent(environment)
 #simulation = Simulate(agent,environment)
 #simulation.Go(100) # 100 steps
 #plotEngine = PlotHistory(agent,environment)
 #plotEngine.PlotEnvironmentHistory()
 #plotEngine.PlotAgentHistory()
 
+# UNIT TEST - BATCH
+#from agent_configuration import BatchSimulate
+#environment = BatchPSEnvironment(1000,seed=42)
+#agent = BatchPSAgent(environment)
+#simulation = BatchSimulate(agent,environment)
+#simulation.Go(100) # 100 steps for each of the 1000 instances
+#print(agent.spent.mean(),environment.stock.mean())
+
 
 
 
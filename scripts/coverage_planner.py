@@ -0,0 +1,355 @@
+import hashlib,heapq,math,time
+import numpy as np
+from util_class import ClassInitial
+from util_display import Displayable
+from garden_simulation import LawnMower,Cell
+from util_random import RandomSource
+
+"""
+# Coverage Planner
+- Decomposes the free cells of a Garden into boustrophedon cells: columns of free cells are merged into one cell
+  for as long as every column has exactly one free interval touching one interval of the next column.
+- A one-cell gap between two free intervals of a column is bridged when a neighbouring column is free beside it,
+  so scattered single obstacles do not split the cells; the sweep of that column steps around the gap through the neighbour.
+- Larger obstacles split and join the cells, and the cells that touch (through a row free in both columns) form a graph.
+- The cells are visited starting from the mower's cell; the next cell is the nearest unvisited neighbour of the current cell,
+  or, when there is none, the nearest unvisited cell touching any visited one, found through a uniform grid of buckets over the cell corners. Each cell is swept column by column, alternating up and down.
+- When the end of one sweep is not next to the start of the following one, they are joined by an L-shaped path that steps around one-cell gaps
+  the same way, and only when both L-shaped paths are blocked A* on the occupancy grid finds the shortest connecting path.
+- The route is a list of neighbouring cells and is cached by its planner per garden layout and start, so it can be replayed any number of times;
+  the cache goes with the planner, so a sweep over many gardens holds no more than the planners still in use.
+"""
+
+def LayoutKey(garden:ClassInitial)->str:
+  """
+  identifies a garden layout by its size and its occupancy bits
+  """
+  digest = hashlib.sha1(garden.occupancy.bits.tobytes())
+  return f"{garden.width}x{garden.height}:{digest.hexdigest()}"
+
+def FreeIntervals(free:np.ndarray)->list:
+  """
+  returns, for every column x, the list of its maximal free intervals (y0,y1)
+  """
+  width,height = free.shape
+  padded = np.zeros((width,height+2),dtype=bool)
+  padded[:,1:-1] = free
+  changes = np.flatnonzero((padded[:,1:] != padded[:,:-1]).ravel())
+  xS,yS = np.divmod(changes,height+1)
+  intervals = [[] for x in range(width)]
+  for x,y0,y1 in zip(xS[0::2].tolist(),yS[0::2].tolist(),(yS[1::2]-1).tolist()):
+    intervals[x].append((y0,y1))
+  return intervals
+
+def BridgedGaps(free:np.ndarray)->np.ndarray:
+  """
+  marks the one-cell gaps (x,y) of the columns that can be stepped around: (x,y-1) and (x,y+1) are free,
+  and so are the three cells beside them in column x-1 or in column x+1
+  """
+  width,height = free.shape
+  padded = np.zeros((width+2,height+2),dtype=bool)
+  padded[1:-1,1:-1] = free
+  beside = padded[:,:-2] & padded[:,1:-1] & padded[:,2:] # rows y-1..y+1 free, for every padded column
+  gaps = ~free & padded[1:-1,:-2] & padded[1:-1,2:]
+  return gaps & (beside[:-2] | beside[2:])
+
+def StraightRun(free:np.ndarray,x:int,yFrom:int,yTo:int)->np.ndarray:
+  """
+  the cells from (x,yFrom) to (x,yTo), stepping around the bridged gaps of column x through a free neighbouring column
+  (on free.T it walks along a row, with x and y swapped)
+  """
+  step = 1 if yTo >= yFrom else -1
+  ys = np.arange(yFrom,yTo+step,step)
+  gaps = np.flatnonzero(~free[x,ys])
+  if not len(gaps):
+    return np.column_stack((np.full(len(ys),x),ys))
+  # every gap becomes three cells beside it: the rows before, at and after the gap
+  counts = np.ones(len(ys),dtype=np.int64)
+  counts[gaps] = 3
+  xs = np.full(len(ys)+2*len(gaps),x)
+  ys = np.repeat(ys,counts)
+  firsts = (np.cumsum(counts)-counts)[gaps]
+  gapYs = ys[firsts]
+  left = free[max(x-1,0),gapYs-1] & free[max(x-1,0),gapYs] & free[max(x-1,0),gapYs+1] & (x > 0)
+  for offset in range(3):
+    xs[firsts+offset] = np.where(left,x-1,x+1)
+    ys[firsts+offset] += (offset-1)*step
+  return np.column_stack((xs,ys))
+
+def AStar(free:bytes,width:int,height:int,start:tuple,goal:tuple)->list:
+  """
+  shortest 4-connected path over the free cells, without start and with goal
+  free holds one byte per cell (x*height+y), nonzero when the cell is free
+  raises ValueError if the goal cannot be reached
+  """
+  # ties on the estimate go to the deepest cell (-steps), so on open ground A* walks straight to the goal
+  goalX,goalY = goal
+  source = start[0]*height+start[1]
+  target = goalX*height+goalY
+  frontier = [(abs(start[0]-goalX)+abs(start[1]-goalY),0,0,source)]
+  cost = {source:0}
+  parent = {source:-1}
+  while frontier:
+    estimate,depth,steps,cell = heapq.heappop(frontier)
+    if cell == target:
+      path = []
+      while cell != source:
+        path.append(divmod(cell,height))
+        cell = parent[cell]
+      return path[::-1]
+    if steps > cost[cell]:
+      continue
+    x,y = divmod(cell,height)
+    steps += 1
+    for nextCell,nextX,nextY,inside in (
+      (cell+height,x+1,y,x+1 < width),
+      (cell-height,x-1,y,x > 0),
+      (cell+1,x,y+1,y+1 < height),
+      (cell-1,x,y-1,y > 0)
+    ):
+      if inside and free[nextCell] and steps < cost.get(nextCell,steps+1):
+        cost[nextCell] = steps
+        parent[nextCell] = cell
+        heapq.heappush(frontier,(steps+abs(nextX-goalX)+abs(nextY-goalY),-steps,steps,nextCell))
+  raise ValueError(f"[No path]::{start} -> {goal}")
+
+def CornerDistance(corners:tuple,position:tuple)->int:
+  """
+  manhattan distance from position to the nearest of the corners (x0,y0,y1,x1,z0,z1) of a cell
+  """
+  x,y = position
+  x0,y0,y1,x1,z0,z1 = corners
+  return min(abs(x0-x)+min(abs(y0-y),abs(y1-y)),abs(x1-x)+min(abs(z0-y),abs(z1-y)))
+
+class FrontierIndex:
+  """
+  the cells of the frontier, bucketed by the square of side size holding each of their corners
+  Nearest searches the buckets ring by ring around a position and stops once no unsearched ring can hold a closer corner,
+  so a query touches the cells near the position instead of the whole frontier
+  """
+  def __init__(self,corners:list,width:int,height:int)->None:
+    self.corners = corners
+    self.size = max(4,math.isqrt(max(1,width*height//max(1,len(corners)))))
+    self.columns = width//self.size+1
+    self.rows = height//self.size+1
+    self.buckets = {} # bucket index -> set of frontier cells with a corner in it
+    self.cells = set()
+  def BucketsOf(self,cell:int)->set:
+    x0,y0,y1,x1,z0,z1 = self.corners[cell]
+    size = self.size
+    return {(x//size)*self.rows+y//size for x,y in ((x0,y0),(x0,y1),(x1,z0),(x1,z1))}
+  def Add(self,cell:int)->None:
+    if cell in self.cells:
+      return
+    self.cells.add(cell)
+    for bucket in self.BucketsOf(cell):
+      self.buckets.setdefault(bucket,set()).add(cell)
+  def Discard(self,cell:int)->None:
+    if cell not in self.cells:
+      return
+    self.cells.discard(cell)
+    for bucket in self.BucketsOf(cell):
+      members = self.buckets[bucket]
+      members.discard(cell)
+      if not members:
+        del self.buckets[bucket]
+  def __len__(self)->int:
+    return len(self.cells)
+  def Nearest(self,position:tuple)->int|None:
+    """
+    the frontier cell nearest to position, the lowest index among equally near ones; None if the frontier is empty
+    """
+    if not self.cells:
+      return None
+    size,rows,buckets = self.size,self.rows,self.buckets
+    column = min(position[0]//size,self.columns-1)
+    row = min(position[1]//size,rows-1)
+    best = None
+    for ring in range(max(column,self.columns-1-column,row,rows-1-row)+1):
+      # a corner in this ring is at least (ring-1)*size+1 away along x or y
+      if best is not None and (ring-1)*size+1 > best[0]:
+        break
+      for x in range(max(column-ring,0),min(column+ring,self.columns-1)+1):
+        step = 2*ring if x not in (column-ring,column+ring) and ring else 1
+        for y in range(row-ring,row+ring+1,step):
+          if not 0 <= y < rows:
+            continue
+          for cell in buckets.get(x*rows+y,()):
+            candidate = (CornerDistance(self.corners[cell],position),cell)
+            if best is None or candidate < best:
+              best = candidate
+    return best[1]
+
+class CoveragePlanner(Displayable):
+  def __init__(self,garden:ClassInitial)->ClassInitial:
+    self.garden = garden
+    self.cache = {} # (layout key,start cell) -> route
+    self.free = ~garden.occupancy.ToArray()
+    self.freeBytes = self.free.tobytes()
+    self.bridged = self.free | BridgedGaps(self.free) # columns through one-cell gaps
+    self.bridgedRows = self.free | BridgedGaps(self.free.T).T # rows through one-cell gaps
+  def Decompose(self)->tuple:
+    """
+    returns (cells,adjacency): every cell is a list of (x,y0,y1) columns with increasing x,
+    adjacency maps a cell index to the set of the cells it touches
+    the columns are intervals of the bridged grid, so they may hold one-cell gaps
+    """
+    cells = []
+    adjacency = []
+    previous = [] # (y0,y1,cell index) of the previous column
+    free = self.free
+    for x,intervals in enumerate(FreeIntervals(self.bridged)):
+      overlaps = []
+      idx = jdx = 0
+      while idx < len(previous) and jdx < len(intervals):
+        (y0,y1,cell),(z0,z1) = previous[idx],intervals[jdx]
+        if y1 >= z0 and z1 >= y0:
+          # bridged gaps do not join columns: some row of the overlap must be free in both
+          low,high = max(y0,z0),min(y1,z1)+1
+          if (free[x-1,low:high] & free[x,low:high]).any():
+            overlaps.append((idx,jdx))
+        if y1 < z1:
+          idx += 1
+        else:
+          jdx += 1
+      previousCount = [0]*len(previous)
+      touchingOf = [[] for interval in intervals]
+      for idx,jdx in overlaps:
+        previousCount[idx] += 1
+        touchingOf[jdx].append(idx)
+      current = []
+      for jdx,(z0,z1) in enumerate(intervals):
+        touching = touchingOf[jdx]
+        if len(touching) == 1 and previousCount[touching[0]] == 1:
+          cell = previous[touching[0]][2]
+        else:
+          cell = len(cells)
+          cells.append([])
+          adjacency.append(set())
+          for idx in touching:
+            other = previous[idx][2]
+            adjacency[cell].add(other)
+            adjacency[other].add(cell)
+        cells[cell].append((x,z0,z1))
+        current.append((z0,z1,cell))
+      previous = current
+    return cells,adjacency
+  def CellOf(self,cells:list,position:tuple)->int:
+    x,y = position
+    if not (0 <= x < self.free.shape[0] and 0 <= y < self.free.shape[1] and self.free[x,y]):
+      raise ValueError(f"[Start is not a free cell]::{position}")
+    for index,columns in enumerate(cells):
+      if columns[0][0] <= x <= columns[-1][0]:
+        for (columnX,y0,y1) in columns:
+          if columnX == x and y0 <= y <= y1:
+            return index
+    raise ValueError(f"[Start is not a free cell]::{position}")
+  def Sweep(self,columns:list,position:tuple)->list:
+    """
+    returns the column runs [(x,yFrom,yTo)] that sweep a cell, starting at the corner nearest to position
+    """
+    x,y = position
+    options = []
+    for ordered in (columns,columns[::-1]):
+      firstX,y0,y1 = ordered[0]
+      options.append((abs(firstX-x)+abs(y0-y),ordered,y0))
+      options.append((abs(firstX-x)+abs(y1-y),ordered,y1))
+    distance,ordered,currentY = min(options,key=lambda option:option[0])
+    runs = []
+    for (columnX,y0,y1) in ordered:
+      yFrom,yTo = (y0,y1) if abs(y0-currentY) <= abs(y1-currentY) else (y1,y0)
+      runs.append((columnX,yFrom,yTo))
+      currentY = yTo
+    return runs
+  def Connect(self,position:tuple,goal:tuple)->np.ndarray:
+    """
+    a path from position to goal, without position and with goal
+    an L-shaped path (along x then y, or along y then x) stepping around one-cell gaps if there is one, else the shortest path found by A*
+    """
+    (x0,y0),(x1,y1) = position,goal
+    xs = slice(min(x0,x1),max(x0,x1)+1)
+    ys = slice(min(y0,y1),max(y0,y1)+1)
+    if self.free[x1,y0] and self.bridgedRows[xs,y0].all() and self.bridged[x1,ys].all():
+      first,second = StraightRun(self.free.T,y0,x0,x1)[:,::-1],StraightRun(self.free,x1,y0,y1)
+    elif self.free[x0,y1] and self.bridged[x0,ys].all() and self.bridgedRows[xs,y1].all():
+      first,second = StraightRun(self.free,x0,y0,y1),StraightRun(self.free.T,y1,x0,x1)[:,::-1]
+    else:
+      return np.array(AStar(self.freeBytes,*self.free.shape,position,goal))
+    return np.concatenate([first[1:],second[1:]])
+  def Plan(self,start:tuple)->np.ndarray:
+    """
+    returns the route from the start cell as an (n,2) array of cells, each next to the one before
+    """
+    start = Cell(*start)
+    key = (LayoutKey(self.garden),start)
+    route = self.cache.get(key)
+    if route is None:
+      begin = time.perf_counter()
+      route = self.Build(start)
+      self.cache[key] = route
+      self.display(1,f"Route: {len(route)} cells [::] Seconds: {time.perf_counter()-begin:.3f}")
+    return route
+  def Build(self,start:tuple)->np.ndarray:
+    cells,adjacency = self.Decompose()
+    corners = [columns[0]+columns[-1] for columns in cells]
+    cell = self.CellOf(cells,start)
+    visited = {cell}
+    frontier = FrontierIndex(corners,*self.free.shape) # unvisited cells touching a visited one
+    pieces = [np.array([start])]
+    position = start
+    while cell is not None:
+      for (x,yFrom,yTo) in self.Sweep(cells[cell],position):
+        if abs(x-position[0])+abs(yFrom-position[1]) > 1:
+          pieces.append(self.Connect(position,(x,yFrom)))
+          position = (x,yFrom)
+        run = StraightRun(self.free,x,yFrom,yTo)
+        pieces.append(run[1:] if (x,yFrom) == position else run)
+        position = (x,yTo)
+      neighbours = adjacency[cell]-visited
+      for other in neighbours:
+        frontier.Add(other)
+      if neighbours:
+        cell = min(neighbours,key=lambda other:(CornerDistance(corners[other],position),other))
+      else:
+        cell = frontier.Nearest(position)
+      if cell is not None:
+        visited.add(cell)
+        frontier.Discard(cell)
+    return np.concatenate([piece.reshape(-1,2) for piece in pieces]).astype(np.int32)
+
+def CompareWithRandomWalk(garden:ClassInitial,x:int=0,y:int=0,maxSteps:int=1000000,seed:int=0)->dict:
+  """
+  steps needed to mow every reachable cell: following the planned route versus the random walk of StartMoving
+  the walk draws from its own source seeded by seed, so the random module is left alone
+  """
+  planner = CoveragePlanner(garden)
+  begin = time.perf_counter()
+  route = planner.Plan((x,y))
+  planSeconds = time.perf_counter()-begin
+  reachable = len(np.unique(route[:,0].astype(np.int64)*(garden.height+1)+route[:,1]))
+  planned = LawnMower(garden,x,y)
+  plannedSteps = planned.FollowRoute(route)
+  walker = LawnMower(garden,x,y,rng=RandomSource(seed))
+  randomSteps = walker.StartMoving(maxSteps,coverCells=reachable)
+  return {
+    "reachableCells":reachable,
+    "planSeconds":planSeconds,
+    "plannedSteps":plannedSteps,
+    "plannedCoverage":planned.coveredCells/reachable,
+    "randomSteps":randomSteps,
+    "randomCoverage":walker.coveredCells/reachable
+  }
+
+#UNIT TEST
+# from garden_simulation import Garden
+# garden = Garden(40,30,[(5,5),(5,6),(5,7),(10,10),(10,11)]+[(20,y) for y in range(5,30)])
+# print(CompareWithRandomWalk(garden,0,0))
+# from util_render import FinalFrameRenderer
+# renderer = FinalFrameRenderer(path="coverage_route.png")
+# lawnMower = LawnMower(garden,0,0,renderer=renderer)
+# lawnMower.FollowRoute(CoveragePlanner(garden).Plan((0,0)))
+# renderer.Finish()
+# large = Garden(1000,1000,np.random.default_rng(0).integers(1,1000,size=(20000,2)))
+# begin = time.perf_counter()
+# route = CoveragePlanner(large).Plan((0,0))
+# assert len(route) >= large.FreeCells()*0.95 and time.perf_counter()-begin < 1 # about 0.25 s
@@ -0,0 +1,202 @@
+import heapq,itertools,math
+import numpy as np
+from util_class import ClassInitial,NullInitial
+from util_record import TrajectoryRecorder
+from agent_configuration import Simulate
+
+"""
+# Event Queue
+- A discrete-event queue: events are (time,callback,arguments) kept in a binary heap and run in time order.
+- Time is continuous; events at the same time run in the order they were scheduled.
+- Cancel marks a pending event as cancelled; it is dropped when it reaches the front of the heap.
+  Cancelling an event that already ran, was already cancelled or never existed does nothing.
+"""
+class EventQueue(object):
+  def __init__(self)->ClassInitial:
+    self.heap = []
+    self.order = itertools.count()
+    self.pending = set() # ids of the events scheduled and not yet run or cancelled
+    self.cancelled = set() # ids of the cancelled events still in the heap
+    self.now = 0
+  def __len__(self)->int:
+    return len(self.pending)
+  def Schedule(self,time:int|float,callback:ClassInitial,*arguments)->int:
+    """
+    returns the id of the event, for Cancel
+    """
+    if time < self.now:
+      raise ValueError(f"[Event in the past]::{time} < {self.now}")
+    event = next(self.order)
+    heapq.heappush(self.heap,(time,event,callback,arguments))
+    self.pending.add(event)
+    return event
+  def Cancel(self,event:int)->None|NullInitial:
+    if event in self.pending:
+      self.pending.discard(event)
+      self.cancelled.add(event)
+  def NextTime(self)->int|float|None:
+    while self.heap and self.heap[0][1] in self.cancelled:
+      self.cancelled.discard(heapq.heappop(self.heap)[1])
+    return self.heap[0][0] if self.heap else None
+  def Run(self,until:int|float)->None|NullInitial:
+    """
+    runs the events up to and including time until, in time order
+    """
+    while True:
+      time = self.NextTime()
+      if time is None or time > until:
+        break
+      time,event,callback,arguments = heapq.heappop(self.heap)
+      self.pending.discard(event)
+      self.now = time
+      callback(time,*arguments)
+    self.now = max(self.now,until)
+
+"""
+# Event-Driven Simulation
+- EventSimulate runs an agent and an environment on an EventQueue instead of the fixed loop of Simulate.Go; it fills the same histories and store.
+- A decision event makes the agent act and the environment respond, then schedules the next decision.
+- Agents and environments that know when nothing will happen let the simulation skip ahead:
+  agent.IdleSteps(perception) returns how many of its next decisions are sure to be agent.idleAction, and
+  environment.Skip(steps,action) applies that action for that many steps at once and returns the perceptions as arrays.
+  The agent then catches up with agent.Skip(perceptions,action), and the next decision is scheduled that many steps later.
+- An agent with RepeatDecisions(perceptions,action) can also judge a stretch it has not seen: the environment computes up to `lookahead`
+  steps of the last action (Skip(steps,action,keep)), the agent counts how many of its decisions over them surely take that action again,
+  and only those steps are taken. The next lookahead of that action is twice its last stretch taken (at least minLookahead),
+  so short stretches do not pay for long ones, and the decision that ends a stretch is a plain step.
+- Skipping draws the same random numbers in the same order as stepping, so the run makes the decisions of Simulate.Go
+  (the vectorised prices and averages agree with stepping to rounding).
+- When skipping does not pay (a stretch shorter than minSkip), the next decisions are plain steps of the loop of Simulate.Go, with no event
+  per step; their number doubles with every skip that does not pay, up to maxPlain, and goes back to 1 after one that does.
+  An action whose stretch did not pay is not looked ahead the next 1,2,4... times it is taken (up to maxPlain), so a domain that
+  alternates long stretches of one action with single steps of another only tries the long ones.
+  So a domain whose actions seldom repeat runs at the speed of Simulate.Go, and one whose actions often do skips most of its steps.
+- Skips and plain steps stop before the time of the next event of another process.
+- Any Agent/Environment without those methods runs unchanged, one decision per unit of time (the compatibility path).
+- Other processes can put their own events on the queue (e.g. a price shock at time 37.5).
+- Snapshot/Restore/Fork work as for Simulate. Restore and Fork start a new queue whose next decision is at the current step,
+  so events of other processes are not carried over: schedule them again on the restored or forked simulation.
+"""
+class EventSimulate(Simulate):
+  stateFields = Simulate.stateFields+("decisions",)
+  minLookahead,maxLookahead = 8,256 # steps computed ahead for a RepeatDecisions agent
+  minSkip = 8 # the shortest skip that pays for itself
+  maxPlain = 256 # the most plain steps between two tries to skip
+  def __init__(self,agent:ClassInitial,environment:ClassInitial,storePath:str|None=None)->ClassInitial:
+    Simulate.__init__(self,agent,environment,storePath)
+    self.canSkip = hasattr(agent,"IdleSteps") and hasattr(environment,"Skip")
+    self.canLook = self.canSkip and hasattr(agent,"RepeatDecisions")
+    self.decisions = 0 # number of decision events run (a skip counts as one, a plain step as one)
+    self.end = 0
+    self.Reschedule()
+  def Restore(self,snapshot:dict)->None|NullInitial:
+    Simulate.Restore(self,snapshot)
+    self.Reschedule()
+  def Fork(self)->ClassInitial:
+    clone = Simulate.Fork(self)
+    clone.Reschedule()
+    return clone
+  def Reschedule(self)->None|NullInitial:
+    """
+    a new queue holding only the next decision, at the current step (the old queue's events are bound to the simulation that made them)
+    """
+    self.queue = EventQueue()
+    self.queue.now = max(self.steps-1,0) # as after a Go that ended here
+    self.queue.Schedule(self.steps,self.Decide)
+    self.lastAction = None # the action a stretch would repeat
+    self.repeats = {} # action values -> [lookahead,passes after the next stretch that does not pay,passes left]
+    self.plain = 1 # plain steps to take after a skip that does not pay
+    self.wait = 0 # plain steps left before the next try to skip
+  def Go(self,n:int)->None|NullInitial:
+    self.end = self.steps+n
+    self.queue.Run(self.end-1)
+    if self.store is not None:
+      self.store.Flush()
+  def Decide(self,time:int|float)->None|NullInitial:
+    limit = self.end-self.steps
+    following = self.queue.NextTime()
+    if following is not None:
+      limit = max(min(limit,math.ceil(following-time)),1) # the decisions before the next event of another process
+    if self.canSkip and self.wait == 0:
+      steps = self.TrySkip(limit)
+      if steps:
+        self.decisions += 1
+        self.queue.Schedule(time+steps,self.Decide)
+        return
+    steps = min(max(self.wait,1),limit)
+    self.lastAction = self.Steps(steps)
+    self.wait = max(self.wait-steps,0)
+    self.decisions += steps
+    self.queue.Schedule(time+steps,self.Decide)
+  def TrySkip(self,limit:int)->int:
+    """
+    skips what it can of the next limit steps and returns the number of steps skipped; sets the plain steps to take before the next try
+    """
+    steps = min(self.agent.IdleSteps(self.perception),limit)
+    if steps > 1:
+      self.SkipSteps(steps,self.agent.idleAction)
+    elif self.canLook and limit > 1 and self.lastAction is not None:
+      repeat = self.repeats.setdefault(tuple(self.lastAction.values()),[self.minLookahead,1,0])
+      if repeat[2]:
+        repeat[2] -= 1
+        self.wait = self.plain
+        return 0
+      horizon = min(repeat[0],limit)
+      steps = self.SkipSteps(horizon,self.lastAction,self.agent.RepeatDecisions)
+      repeat[0] = min(max(2*steps,self.minLookahead),self.maxLookahead)
+      if steps >= self.minSkip:
+        repeat[1] = 1
+      else:
+        repeat[2],repeat[1] = repeat[1],min(2*repeat[1],self.maxPlain)
+      if steps < horizon:
+        self.wait = 1 # the decision that ended the stretch takes another action
+    else:
+      steps = 0
+    if steps >= self.minSkip:
+      self.plain = 1
+    else:
+      self.wait = max(self.wait,self.plain)
+      self.plain = min(2*self.plain,self.maxPlain)
+    return steps
+  def SkipSteps(self,steps:int,action:dict,repeatDecisions:ClassInitial=None)->int:
+    """
+    applies the action for the given number of steps, or, with repeatDecisions, for as many of them as it counts the agent repeating it
+    returns the number of steps taken
+    """
+    seen = {}
+    def Seen(perceptions:dict)->dict:
+      # the agent sees the current perception and all but the last of the new ones
+      seen.update({key:np.concatenate(([self.perception[key]],values[:-1])) for key,values in perceptions.items()})
+      return seen
+    if repeatDecisions is None:
+      perceptions = self.environment.Skip(steps,action)
+    else:
+      perceptions = self.environment.Skip(steps,action,lambda perceptions:repeatDecisions(Seen(perceptions),action))
+    steps = len(next(iter(perceptions.values())))
+    if steps == 0:
+      return 0
+    if self.actionHistory is None:
+      self.actionHistory = TrajectoryRecorder.FromRow(action)
+      if self.storePath is not None:
+        self.OpenStore(action)
+    self.agent.Skip({key:values[:steps] for key,values in seen.items()} if seen else Seen(perceptions),action)
+    self.actionHistory.Extend(**{key:np.full(steps,value) for key,value in action.items()})
+    self.perceptionHistory.Extend(**perceptions)
+    if self.store is not None:
+      for idx in range(steps):
+        self.store.Append(self.steps+idx+1,*(values[idx] for values in perceptions.values()),*action.values())
+    self.perception = {key:values[-1].item() for key,values in perceptions.items()}
+    self.steps += steps
+    self.lastAction = action
+    self.Event(2,"skip",count=self.steps,skipped=steps,action=action)
+    return steps
+
+#UNIT TEST
+# import random
+# from buying_simulation import PSEnvironment,PSAgent
+# random.seed(0)
+# environment = PSEnvironment()
+# agent = PSAgent(environment,cheapStock=40)
+# simulation = EventSimulate(agent,environment)
+# simulation.Go(10000)
+# print(simulation.steps,simulation.decisions,agent.spent)
@@ -0,0 +1,156 @@
+import itertools,os,random,time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from util_class import ClassInitial
+from util_display import Displayable
+from agent_configuration import Simulate
+from buying_simulation import PSEnvironment,PSAgent
+from fuel_simulation import FuelEnvironment,FuelAgent
+from util_random import BlockRandom
+
+"""
+# Experiment Runner
+- Runs a parameter sweep over the stock buying (PSAgent/PSEnvironment) or fuel (FuelAgent/FuelEnvironment) domain.
+- A configuration is a dictionary of agent parameters (e.g. cheapRatio, cheapStock, cheapBuy) and environment parameters (prefixed with "environment.", e.g. "environment.standardDeviation").
+- Every (configuration,seed) pair is one run; runs are grouped into chunks that are handed to a ProcessPoolExecutor.
+- Each run draws from its own BlockRandom (see util_random) seeded from its seed alone, so the results do not depend on the number of workers or on which worker ran it.
+- Runs with the same seed see the same random demand and price noise, which makes the configurations directly comparable.
+- The results are collected into a ResultTable with one column per parameter and per metric.
+"""
+
+domains = {
+  # name -> (environment class,agent class,stock key of the perception)
+  "stock":(PSEnvironment,PSAgent,"instock"),
+  "fuel":(FuelEnvironment,FuelAgent,"fuelStock")
+}
+
+def GridSpace(parameters:dict)->list:
+  """
+  parameters maps each name to a list of values
+  returns every combination as a list of configurations
+  """
+  names = list(parameters)
+  return [dict(zip(names,values)) for values in itertools.product(*(parameters[name] for name in names))]
+
+def RandomSpace(parameters:dict,samples:int,seed:int=0)->list:
+  """
+  parameters maps each name to a list of values (picked uniformly) or to a (low,high) tuple
+  a tuple of two ints gives an int in [low,high], otherwise a float in [low,high)
+  returns the sampled configurations
+  """
+  generator = random.Random(seed)
+  configurations = []
+  for idx in range(samples):
+    configuration = {}
+    for name,values in parameters.items():
+      if isinstance(values,tuple):
+        low,high = values
+        if isinstance(low,int) and isinstance(high,int):
+          configuration[name] = generator.randint(low,high)
+        else:
+          configuration[name] = generator.uniform(low,high)
+      else:
+        configuration[name] = generator.choice(values)
+    configurations.append(configuration)
+  return configurations
+
+def Build(domain:str,configuration:dict,seed:ClassInitial)->tuple:
+  """
+  returns the (agent,environment) of a run: the environment draws from a BlockRandom of the seed (None for fresh entropy)
+  """
+  environmentClass,agentClass = domains[domain][:2]
+  environment = environmentClass(rng=BlockRandom(seed))
+  agentParameters = {}
+  for name,value in configuration.items():
+    if name.startswith("environment."):
+      setattr(environment,name[len("environment."):],value)
+    else:
+      agentParameters[name] = value
+  return agentClass(environment,**agentParameters),environment
+
+def RunOnce(domain:str,configuration:dict,seed:int,steps:int)->dict:
+  """
+  runs one simulation and returns its summary metrics
+  """
+  stockKey = domains[domain][2]
+  agent,environment = Build(domain,configuration,seed)
+  simulation = Simulate(agent,environment)
+  simulation.Go(steps)
+  return {
+    "spent":agent.spent,
+    "stockouts":int((environment.stockHistory <= 0).sum()),
+    "finalStock":simulation.perception[stockKey]
+  }
+
+def RunChunk(domain:str,tasks:list,steps:int)->list:
+  """
+  runs a chunk of (index,configuration,seed) tasks in one worker
+  """
+  return [(index,RunOnce(domain,configuration,seed,steps)) for (index,configuration,seed) in tasks]
+
+class ResultTable(object):
+  """
+  columnar table: every column is a NumPy array with one entry per run
+  """
+  def __init__(self,columns:dict)->ClassInitial:
+    self.columns = columns
+  def __len__(self)->int:
+    return len(next(iter(self.columns.values()))) if self.columns else 0
+  def __getitem__(self,name:str)->np.ndarray:
+    return self.columns[name]
+  def Rows(self)->list:
+    names = list(self.columns)
+    return [dict(zip(names,values)) for values in zip(*(self.columns[name].tolist() for name in names))]
+  def Summary(self,by:list,metric:str)->list:
+    """
+    returns [(configuration,mean of metric)] for each distinct value of the columns in by, best (lowest) first
+    """
+    groups = {}
+    for row in self.Rows():
+      groups.setdefault(tuple(row[name] for name in by),[]).append(row[metric])
+    summary = [(dict(zip(by,key)),sum(values)/len(values)) for key,values in groups.items()]
+    return sorted(summary,key=lambda pair:pair[1])
+
+class ExperimentRunner(Displayable):
+  def __init__(self,domain:str="stock",steps:int=100,workers:int|None=None,chunkSize:int|None=None)->ClassInitial:
+    """
+    workers is the number of processes (None uses every core, 1 runs in this process)
+    chunkSize is the number of runs per submitted task (None picks about four chunks per worker)
+    """
+    if domain not in domains:
+      raise ValueError(f"[Unknown domain]::{domain}")
+    self.domain = domain
+    self.steps = steps
+    self.workers = workers
+    self.chunkSize = chunkSize
+  def Run(self,configurations:list,seeds:list)->ClassInitial:
+    tasks = [
+      (index,configuration,seed)
+      for index,(configuration,seed) in enumerate(itertools.product(configurations,seeds))
+    ]
+    start = time.perf_counter()
+    if self.workers == 1:
+      results = RunChunk(self.domain,tasks,self.steps)
+    else:
+      workers = self.workers or os.cpu_count() or 1
+      with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunkSize = self.chunkSize or max(1,len(tasks)//(4*workers))
+        chunks = [tasks[idx:idx+chunkSize] for idx in range(0,len(tasks),chunkSize)]
+        futures = [executor.submit(RunChunk,self.domain,chunk,self.steps) for chunk in chunks]
+        results = [result for future in futures for result in future.result()]
+    results.sort(key=lambda pair:pair[0])
+    self.display(1,f"Runs: {len(tasks)} [::] Seconds: {time.perf_counter()-start:.2f}")
+    names = sorted({name for configuration in configurations for name in configuration})
+    columns = {name:np.array([configuration.get(name) for (index,configuration,seed) in tasks]) for name in names}
+    columns["seed"] = np.array([seed for (index,configuration,seed) in tasks])
+    for metric in ("spent","stockouts","finalStock"):
+      columns[metric] = np.array([metrics[metric] for (index,metrics) in results])
+    return ResultTable(columns)
+
+#UNIT TEST
+# if __name__ == "__main__":
+#   configurations = GridSpace({"cheapRatio":[0.85,0.9,0.95],"cheapStock":[40,60,80],"cheapBuy":[24,48]})
+#   runner = ExperimentRunner("stock",steps=100)
+#   table = runner.Run(configurations,seeds=range(50))
+#   for configuration,spent in table.Summary(["cheapRatio","cheapStock","cheapBuy"],"spent")[:5]:
+#     print(configuration,spent)
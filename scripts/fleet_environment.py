@@ -0,0 +1,271 @@
+import math
+import numpy as np
+from util_class import ClassInitial,NullInitial
+from agent_configuration import Environment
+from util_geometry import SegmentParameters
+from util_record import TrajectoryRecorder
+from util_wall_index import Fresh
+
+def CosSin(degrees:np.ndarray)->tuple:
+  """
+  cos and sin of angles in degrees, computed with math.cos/math.sin once per distinct angle
+  the headings of a fleet take few distinct values, and the results are bit-for-bit those of BodyEnvironment
+  """
+  angles,inverse = np.unique(degrees,return_inverse=True)
+  cosines = np.array([math.cos(angle*math.pi/180) for angle in angles.tolist()])
+  sines = np.array([math.sin(angle*math.pi/180) for angle in angles.tolist()])
+  return cosines[inverse],sines[inverse]
+
+"""
+# Fleet Environment
+- Many bodies (as in BodyEnvironment) share one WallEnvironment; their state is kept in arrays with one entry per robot.
+- Do advances every active robot by one step at once: the move and whisker segments of the whole fleet are tested
+  against the walls through the WallIndex in one vectorized query.
+- With a proximity radius, the robots closer than the radius to another robot are found every step (a hash grid of
+  cells of that size, searched with np.searchsorted) and reported in the perception as "near".
+- Every step records the positions and crash flags of all robots in a TrajectoryRecorder.
+"""
+class FleetEnvironment(Environment):
+  steerCodes = {"left":1,"straight":0,"right":-1}
+  def __init__(self,environment:ClassInitial,initPositions:ClassInitial,proximity:int|float|None=None)->ClassInitial:
+    """
+    initPositions is an (M,3) array-like of (x,y,direction), one row per robot
+    """
+    self.environment = environment
+    initPositions = np.asarray(initPositions,dtype=float).reshape(-1,3)
+    self.size = len(initPositions)
+    self.xPos = initPositions[:,0].copy()
+    self.yPos = initPositions[:,1].copy()
+    self.direction = initPositions[:,2].copy()
+    self.turningAngle = 18 # degrees that a left makes
+    self.whiskerLength = 6 # length of the whisker
+    self.whiskerAngle = 30 # angle of whisker relative to robot
+    self.crashed = np.zeros(self.size,dtype=bool)
+    self.whisker = np.zeros(self.size,dtype=bool)
+    self.near = np.zeros(self.size,dtype=bool)
+    self.proximity = proximity
+    self.closePairs = np.zeros((0,2),dtype=np.int64)
+    self.index = None
+    self.steps = 0
+    self.record = TrajectoryRecorder(
+      {
+        "xPos":(np.float64,(self.size,)),
+        "yPos":(np.float64,(self.size,)),
+        "crashed":(np.bool_,(self.size,))
+      }
+    )
+    self.record.Append(self.xPos,self.yPos,self.crashed)
+  def HitWalls(self,segments:np.ndarray)->np.ndarray:
+    """
+    returns, for every (K,2,2) segment, true if it intersects a wall
+    """
+    self.index = Fresh(self.index,self.environment)
+    hits = np.zeros(len(segments),dtype=bool)
+    segment,walls = self.index.Candidates(segments)
+    if len(segment):
+      hit,_ = SegmentParameters(segments[segment],self.environment.wallArray[walls])
+      hits[segment[hit]] = True
+    return hits
+  def Whiskers(self)->np.ndarray:
+    cosines,sines = CosSin(self.direction-self.whiskerAngle)
+    segments = np.empty((self.size,2,2))
+    segments[:,0,0],segments[:,0,1] = self.xPos,self.yPos
+    segments[:,1,0] = self.xPos+self.whiskerLength*cosines
+    segments[:,1,1] = self.yPos+self.whiskerLength*sines
+    self.whisker[:] = self.HitWalls(segments)
+    return self.whisker
+  def Proximity(self)->np.ndarray:
+    """
+    finds the pairs of robots closer than the proximity radius, by looking up the 9 neighbouring cells of a hash grid
+    """
+    radius = self.proximity
+    cellX = np.floor(self.xPos/radius).astype(np.int64)
+    cellY = np.floor(self.yPos/radius).astype(np.int64)
+    span = int(cellY.max()-cellY.min())+3
+    keys = (cellX-cellX.min()+1)*span+(cellY-cellY.min()+1)
+    order = np.argsort(keys,kind="stable")
+    sortedKeys = keys[order]
+    pairs = []
+    for dx in (-1,0,1):
+      for dy in (-1,0,1):
+        lookup = keys+dx*span+dy
+        start = np.searchsorted(sortedKeys,lookup,side="left")
+        counts = np.searchsorted(sortedKeys,lookup,side="right")-start
+        first = np.repeat(np.arange(self.size),counts)
+        second = order[np.repeat(start,counts)+np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts,counts)]
+        keep = first < second
+        pairs.append(np.column_stack((first[keep],second[keep])))
+    pairs = np.concatenate(pairs)
+    close = (self.xPos[pairs[:,0]]-self.xPos[pairs[:,1]])**2+(self.yPos[pairs[:,0]]-self.yPos[pairs[:,1]])**2 <= radius*radius
+    self.closePairs = pairs[close]
+    self.near[:] = False
+    self.near[self.closePairs.ravel()] = True
+    return self.near
+  def Perception(self)->dict:
+    perception = {
+      "xPos":self.xPos,
+      "yPos":self.yPos,
+      "direction":self.direction,
+      "whisker":self.Whiskers(),
+      "crashed":self.crashed
+    }
+    if self.proximity is not None:
+      perception["near"] = self.Proximity()
+    return perception
+  InitialPerception = Perception
+  def Do(self,action:dict)->dict:
+    """
+    action is {'steer':steer} with one code of steerCodes per robot (1 left, 0 straight, -1 right),
+    and optionally {'active':mask} to move only some of the robots; crashed robots never move
+    """
+    self.steps += 1
+    moving = ~self.crashed
+    if "active" in action:
+      moving &= action["active"]
+    robots = np.flatnonzero(moving)
+    if len(robots):
+      steer = np.asarray(action["steer"])[robots]
+      direction = (self.direction[robots]+steer*self.turningAngle+360)%360 # making in range [0,360)
+      cosines,sines = CosSin(direction)
+      segments = np.empty((len(robots),2,2))
+      segments[:,0,0],segments[:,0,1] = self.xPos[robots],self.yPos[robots]
+      segments[:,1,0] = self.xPos[robots]+cosines
+      segments[:,1,1] = self.yPos[robots]+sines
+      self.crashed[robots] = self.HitWalls(segments)
+      self.direction[robots] = direction
+      self.xPos[robots] = segments[:,1,0]
+      self.yPos[robots] = segments[:,1,1]
+    self.record.Append(self.xPos,self.yPos,self.crashed)
+    return self.Perception()
+  @property
+  def history(self)->np.ndarray:
+    """
+    (steps,M,2) positions of every robot at every step
+    """
+    return np.stack((self.record.Column("xPos"),self.record.Column("yPos")),axis=-1)
+
+"""
+# Fleet Middle Layer
+- The middle layer of MiddleEnvironment for every robot of a fleet: each robot has its own target, remaining timeout and arrival flag.
+- Tick steers every robot that is still on its way (whisker on, or another robot near when avoidRobots is set: turn left;
+  otherwise head towards the target) and advances the fleet by one step.
+- Do sets the targets and ticks until every robot has arrived or timed out, like the loop of MiddleEnvironment.Do.
+"""
+class FleetMiddleEnvironment(Environment):
+  def __init__(self,fleet:ClassInitial,avoidRobots:bool=False)->ClassInitial:
+    self.fleet = fleet
+    self.perception = fleet.InitialPerception()
+    self.straightAngle = 11 # angle that is close enough to straight ahead
+    self.closeThreshold = 2 # distance that is close enough to arrived
+    self.closeThresholdSquared = self.closeThreshold**2 # just compute it once
+    self.avoidRobots = avoidRobots
+    self.targets = np.zeros((fleet.size,2))
+    self.remaining = np.zeros(fleet.size,dtype=np.int64)
+    self.arrived = np.zeros(fleet.size,dtype=bool)
+    self.active = np.zeros(fleet.size,dtype=bool)
+  def InitialPerception(self)->dict:
+    return {}
+  def IsCloseEnough(self)->np.ndarray:
+    Rx,Ry = self.perception["xPos"],self.perception["yPos"]
+    return (self.targets[:,0]-Rx)**2+(self.targets[:,1]-Ry)**2 <= self.closeThresholdSquared
+  def HeadTowards(self)->np.ndarray:
+    """
+    the steer code that heads every robot towards its target
+    """
+    Gx,Gy = self.targets[:,0],self.targets[:,1]
+    Rx,Ry = self.perception["xPos"],self.perception["yPos"]
+    with np.errstate(divide="ignore",invalid="ignore"):
+      goal = np.arccos((Gx-Rx)/np.sqrt((Gx-Rx)*(Gx-Rx)+(Gy-Ry)*(Gy-Ry)))*180/math.pi
+    goal = np.where(Ry > Gy,-goal,goal)
+    goalFrom = (goal-self.perception["direction"]+540)%360-180
+    return np.where(goalFrom > self.straightAngle,1,np.where(goalFrom < -self.straightAngle,-1,0))
+  def Steer(self)->np.ndarray:
+    avoid = self.perception["whisker"]
+    if self.avoidRobots and "near" in self.perception:
+      avoid = avoid|self.perception["near"]
+    return np.where(avoid,1,self.HeadTowards())
+  def SetGoals(self,robots:np.ndarray,targets:ClassInitial,timeout:int=-1)->None|NullInitial:
+    """
+    robots is an index array or a boolean mask; a timeout of -1 never runs out
+    """
+    self.targets[robots] = targets
+    self.remaining[robots] = timeout
+    self.arrived[robots] = self.IsCloseEnough()[robots]
+    self.active[robots] = ~self.arrived[robots]&(self.remaining[robots] != 0)
+  def Tick(self)->None|NullInitial:
+    active = self.active.copy()
+    self.perception = self.fleet.Do({"steer":self.Steer(),"active":active})
+    self.remaining[active] -= 1
+    self.arrived[active] = self.IsCloseEnough()[active]
+    self.active &= ~self.arrived&(self.remaining != 0)
+  def Do(self,action:dict)->dict:
+    """
+    action is {'go_to':targets,'timeout':timeout}; targets is one (x,y) pair for every robot or an (M,2) array
+        returns {'arrived':array} with the arrival flag of every robot
+    """
+    self.SetGoals(np.arange(self.fleet.size),action["go_to"],action.get("timeout",-1))
+    while self.active.any():
+      self.Tick()
+    return {"arrived":self.arrived.copy()}
+
+"""
+# Fleet Top Layer
+- The top layer of TopEnvironment for every robot: each robot has its own list of locations to visit and its own position in that list.
+- A robot moves on to its next location as soon as it arrives at (or times out on) the current one, independently of the others.
+- Do returns an (M,L) array telling which of the planned visits arrived.
+"""
+class FleetTopEnvironment(Environment):
+  def __init__(self,middle:ClassInitial,timeout:int=200,locations:dict={
+    "mail":(-5,10),
+    "o103":(50,100),
+    "o109":(100,10),
+    "storage":(101,51)
+  }):
+    self.middle = middle
+    self.timeout = timeout
+    self.locations = locations
+  def Do(self,plan:dict)->np.ndarray:
+    """
+    plan is {'visit':names} with one list of location names for every robot, or one list shared by all robots
+    """
+    size = self.middle.fleet.size
+    toDo = plan["visit"]
+    if not toDo or isinstance(toDo[0],str):
+      toDo = [toDo]*size
+    lengths = np.array([len(names) for names in toDo])
+    targets = np.zeros((size,max(lengths.max(),1),2))
+    for robot,names in enumerate(toDo):
+      for idx,loc in enumerate(names):
+        targets[robot,idx] = self.locations[loc]
+    self.arrivals = np.zeros(targets.shape[:2],dtype=bool)
+    self.next = np.zeros(size,dtype=np.int64)
+    self.pending = np.zeros(size,dtype=bool) # robots with a goal whose result is not recorded yet
+    self.Advance(targets,lengths)
+    while self.middle.active.any():
+      self.middle.Tick()
+      self.Advance(targets,lengths)
+    self.display(1,f"Robots: {size} [::] Arrived: {int(self.arrivals.sum())}/{int(lengths.sum())} [::] Steps: {self.middle.fleet.steps}")
+    return self.arrivals
+  def Advance(self,targets:np.ndarray,lengths:np.ndarray)->None|NullInitial:
+    """
+    records the result of every finished goal and gives those robots their next location
+    """
+    while True:
+      finished = np.flatnonzero(self.pending&~self.middle.active)
+      self.arrivals[finished,self.next[finished]] = self.middle.arrived[finished]
+      self.next[finished] += 1
+      self.pending[finished] = False
+      robots = np.flatnonzero(~self.pending&~self.middle.active&(self.next < lengths))
+      if len(robots) == 0:
+        return
+      self.middle.SetGoals(robots,targets[robots,self.next[robots]],self.timeout)
+      self.pending[robots] = True
+
+#UNIT TEST
+# from wall_environment import WallEnvironment
+# environment = WallEnvironment({((20,0),(30,20)),((70,-5),(70,25))})
+# rng = np.random.default_rng(0)
+# fleet = FleetEnvironment(environment,np.column_stack((rng.uniform(-10,10,500),rng.uniform(-10,10,500),np.full(500,90.0))),proximity=1.0)
+# middle = FleetMiddleEnvironment(fleet)
+# top = FleetTopEnvironment(middle)
+# print(top.Do({"visit":["o109","storage","o109","o103"]}).mean())
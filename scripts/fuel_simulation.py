@@ -4,10 +4,24 @@ Fuel prices change over time due to market dynamics and other factors.
 The agent's goal is to buy fuel at optimal prices to ensure the company's vehicles are always operational without overspending on fuel costs.
 """
 
-import random,os
+import os
+import numpy as np
 import matplotlib.pyplot as plt
-from agent_configuration import Agent,Environment
+from agent_configuration import Agent,Environment,BatchAgent,BatchEnvironment
 from util_class import ClassInitial,NullInitial
+from util_display import Displayable
+from util_project import RunningAverages
+from util_random import RandomSource
+from util_record import TrajectoryRecorder
+
+def Floored(start:int|float,changes:np.ndarray,floor:int|float)->np.ndarray:
+  """
+  the values of value = max(floor,value+change) after each of the changes, starting from start (at least floor):
+  the cumulative sum lifted by the running maximum of how far it fell below the floor
+  """
+  walk = start+np.cumsum(changes)
+  walk += np.maximum(np.maximum.accumulate(floor-walk),0)
+  return walk
 
 class FuelEnvironment(Environment):
   priceDelta = [
@@ -15,61 +29,197 @@ class FuelEnvironment(Environment):
         -2, 5, -3, 7, -6, 4, 0, -4, 6, -2, 8, -5, 3, -7, 1
   ]
   standardDeviation = 3
-  def __init__(self)->ClassInitial:
+  minUse,maxUse = 50,150 # least and most fuel used in one step
+  stockKey = "fuelStock" # the stock in the perception
+  minPrice = 50 # the price never goes below it
+  lostSales = True # fuel used beyond the stock is not delivered (the stock stops at 0)
+  stateFields = ("time","fuelStock","price","rng","record") # what Snapshot/Restore/Fork carry (see util_snapshot)
+  def __init__(self,rng:ClassInitial=None)->ClassInitial:
+    """
+    rng is the random source (see util_random): None draws from the random module, an int seeds a BlockRandom
+    """
+    self.rng = RandomSource(rng)
     self.time = 0
     self.fuelStock = 1000 # in liters
-    self.stockHistory = []
-    self.priceHistory = []
+    self.record = TrajectoryRecorder({"stock":np.int64,"price":np.float64})
     self.price = 100 # initial price per liter
+  @property
+  def stockHistory(self)->np.ndarray:
+    return self.record.Column("stock")
+  @property
+  def priceHistory(self)->np.ndarray:
+    return self.record.Column("price")
+  @classmethod
+  def SampleUse(cls,generator:ClassInitial,shape:tuple)->np.ndarray:
+    """
+    amounts of fuel used, an array of the given shape drawn from a NumPy generator (for models of the environment, see rollout_planner)
+    """
+    return generator.integers(cls.minUse,cls.maxUse+1,size=shape)
   def InitialPerception(self):
-    self.stockHistory.append(self.fuelStock)
-    self.priceHistory.append(self.price)
+    """
+    the perception before the first step; its row is recorded once, however many of the agent and the simulation ask for it
+    """
+    if not len(self.record):
+      self.record.Append(self.fuelStock,self.price)
     return {
       "price":self.price,
       "fuelStock":self.fuelStock
     }
   def Do(self,action):
-    fuelUsed = random.randint(50,150) # Simulate fuel consumption
+    fuelUsed = self.rng.Integer(self.minUse,self.maxUse) # Simulate fuel consumption
     bought = action["buy"]
     self.fuelStock = max(self.fuelStock+bought-fuelUsed,0)
-    self.stockHistory.append(self.fuelStock)
     self.time += 1
-    priceChange = self.priceDelta[self.time%len(self.priceDelta)]+self.standardDeviation*random.gauss(0,1)
-    self.price = max(50,self.price+priceChange) # Prevent price from going below a minimum
-    self.priceHistory.append(self.price)
+    priceChange = self.priceDelta[self.time%len(self.priceDelta)]+self.standardDeviation*self.rng.Gauss()
+    self.price = max(self.minPrice,self.price+priceChange) # Prevent price from going below a minimum
+    self.record.Append(self.fuelStock,self.price)
     return {
       "price":self.price,
       "fuelStock":self.fuelStock
     }
+  def Deltas(self,steps:int)->np.ndarray:
+    """
+    the pattern's price changes of the next steps, as a slice of the pattern repeated (kept until priceDelta is replaced)
+    """
+    start = (self.time+1)%len(self.priceDelta)
+    if getattr(self,"deltaSource",None) is not self.priceDelta or len(self.deltaArray) < start+steps:
+      self.deltaSource = self.priceDelta
+      self.deltaArray = np.tile(np.asarray(self.priceDelta),(start+steps)//len(self.priceDelta)+1)
+    return self.deltaArray[start:start+steps]
+  def Skip(self,steps:int,action:dict,keep:ClassInitial=None)->dict:
+    """
+    does the same action for the given number of steps, with the random numbers Do would draw, as one vectorised stretch
+    (the stock and the price are floored cumulative sums; the prices agree with stepping to rounding)
+    keep, if given, is called with the perceptions of all the steps and returns how many of them to take; the others are not taken
+    and their random numbers are left for the next steps
+    returns the perceptions after each step taken as arrays
+    """
+    used,noise = self.rng.Peek(steps,(self.minUse,self.maxUse),"gauss")
+    stocks = Floored(self.fuelStock,action["buy"]-used,0)
+    deltas = self.Deltas(steps)
+    prices = Floored(self.price,deltas+self.standardDeviation*noise,self.minPrice)
+    taken = steps if keep is None else keep({"price":prices,"fuelStock":stocks})
+    self.rng.Advance(taken,(self.minUse,self.maxUse),"gauss")
+    stocks,prices = stocks[:taken],prices[:taken]
+    if taken:
+      self.time += taken
+      self.fuelStock,self.price = int(stocks[-1]),float(prices[-1])
+      self.record.Extend(stock=stocks,price=prices)
+    return {
+      "price":prices,
+      "fuelStock":stocks
+    }
 
 class FuelAgent(Agent):
-  def __init__(self)->ClassInitial:
+  stateFields = ("spent","ave","lastPrice","fuelStock","record")
+  def __init__(self,environment:ClassInitial,cheapRatio:float=0.9,cheapStock:int=800,cheapBuy:int=200,lowStock:int=500,lowBuy:int=100)->ClassInitial:
+    """
+    buys cheapBuy when the price is below cheapRatio times the average and the stock is below cheapStock
+    otherwise buys lowBuy when the stock is below lowStock
+    """
+    self.cheapRatio,self.cheapStock,self.cheapBuy = cheapRatio,cheapStock,cheapBuy
+    self.lowStock,self.lowBuy = lowStock,lowBuy
     self.spent = 0
-    self.ave = self.lastPrice = environment.InitialPerception()["price"] # Average Price
-    self.fuelStock = environment.InitialPerception()["fuelStock"]
-    self.buyHistory = []
+    perception = environment.InitialPerception()
+    self.ave = self.lastPrice = perception["price"] # Average Price
+    self.fuelStock = perception["fuelStock"]
+    self.record = TrajectoryRecorder({"spent":np.float64}) # total spent after each decision
+    self.maxUse = getattr(environment,"maxUse",None) # lets an EventSimulate skip the steps it surely buys nothing
+    self.lookahead = None # (prices,averages) of the last RepeatDecisions
+    self.idleAction = {"buy":0}
+  @property
+  def buyHistory(self)->np.ndarray:
+    return self.record.Column("spent")
   def SelectAction(self,perception):
     self.lastPrice = perception["price"]
     self.fuelStock = perception["fuelStock"]
-    self.ave = self.ave+(self.lastPrice-self.ave)
-    if self.lastPrice < 0.9*self.ave and self.fuelStock < 800:
-      toBuy = 200
-    elif self.fuelStock < 500:
-      toBuy = 100
+    self.ave = self.ave+(self.lastPrice-self.ave)*0.05
+    if self.lastPrice < self.cheapRatio*self.ave and self.fuelStock < self.cheapStock:
+      toBuy = self.cheapBuy
+    elif self.fuelStock < self.lowStock:
+      toBuy = self.lowBuy
     else:
       toBuy = 0
     self.spent += toBuy*self.lastPrice
-    self.buyHistory.append(self.spent)
+    self.record.Append(self.spent)
     return {"buy":toBuy}
+  def IdleSteps(self,perception:dict)->int:
+    """
+    the number of decisions from now that surely buy nothing: the stock stays at or above both thresholds
+    even if the most fuel is used on every step
+    """
+    floor = max(self.cheapStock,self.lowStock)
+    if self.maxUse is None or perception["fuelStock"] < floor:
+      return 0
+    return (perception["fuelStock"]-floor)//self.maxUse+1
+  def RepeatDecisions(self,perceptions:dict,action:dict)->int:
+    """
+    the number of leading decisions that surely buy action["buy"], if SelectAction saw each of the perceptions (arrays) in turn
+    a price within a rounding margin of cheapRatio times the average could be cheap or not, so it only counts if both give that buy
+    """
+    prices,stocks = perceptions["price"],perceptions["fuelStock"]
+    averages = RunningAverages(self.ave,prices,0.05)
+    self.lookahead = (prices,averages) # for the Skip that follows
+    threshold = self.cheapRatio*averages
+    margin = 1e-9*np.abs(threshold)
+    buy = action["buy"]
+    low = stocks < self.lowStock
+    otherwise = np.zeros(len(prices),dtype=bool) # where the rule, if the price is not cheap, buys that amount
+    if self.lowBuy == buy:
+      otherwise |= low
+    if buy == 0:
+      otherwise |= ~low
+    maybeCheap = (stocks < self.cheapStock)&(prices < threshold+margin)
+    if self.cheapBuy == buy:
+      repeat = otherwise|(maybeCheap&(prices < threshold-margin))
+    else:
+      repeat = otherwise&~maybeCheap
+    return len(repeat) if repeat.all() else int(repeat.argmin())
+  def Skip(self,perceptions:dict,action:dict)->None|NullInitial:
+    """
+    updates the belief state as if SelectAction had seen each of the perceptions and bought action["buy"] every time
+    """
+    prices,lookahead = perceptions["price"],self.lookahead
+    self.lookahead = None
+    if lookahead is not None and (prices is lookahead[0] or prices.base is lookahead[0]): # the averages RepeatDecisions worked out
+      self.ave = lookahead[1][len(prices)-1].item()
+    else:
+      self.ave = RunningAverages(self.ave,prices,0.05)[-1].item()
+    self.lastPrice = perceptions["price"][-1].item()
+    self.fuelStock = perceptions["fuelStock"][-1].item()
+    spent = self.spent+np.cumsum(action["buy"]*perceptions["price"]) # the total after each decision, as SelectAction records it
+    self.spent = spent[-1].item()
+    self.record.Extend(spent=spent)
   
-class FuelSimulation(object):
+class FuelSimulation(Displayable):
   def __init__(self,agent:ClassInitial,environment:ClassInitial)->ClassInitial:
     self.agent = agent
     self.environment = environment
+    self.perception = self.environment.InitialPerception() # the agent already recorded the initial row
+    self.perceptionHistory = TrajectoryRecorder.FromRow(self.perception)
+    self.perceptionHistory.AppendRow(self.perception)
   def Run(self,steps:int)->None|NullInitial:
+    verbose = self.Displaying(2)
+    profiler = self.profiler
+    every = profiler.every if profiler is not None else 0
     for idx in range(steps):
-      currentPerception = self.environment.Do(self.agent.SelectAction(self.environment.InitialPerception()))
-      print(f"Step: {idx} [::] Price: {currentPerception['price']} [::] Stock: {currentPerception['fuelStock']}")
+      timed = every and idx%every == 0
+      if timed:
+        start = profiler.clock()
+      action = self.agent.SelectAction(self.perception)
+      if timed:
+        start = profiler.Add("fuel.agent",start,every)
+      self.perception = currentPerception = self.environment.Do(action)
+      if timed:
+        start = profiler.Add("fuel.environment",start,every)
+      self.perceptionHistory.AppendRow(currentPerception)
+      if verbose:
+        self.Event(2,"step",step=idx,price=currentPerception["price"],stock=currentPerception["fuelStock"])
+      if timed:
+        profiler.Add("fuel.record",start,every)
+    if profiler is not None:
+      profiler.Count("fuel.steps",steps)
+      self.display(1,profiler.Report())
   def VisualizeResults(self)->None:
     plt.figure(figsize=(14,8))
     plt.subplot(1,2,1)
@@ -89,11 +239,79 @@ class FuelSimulation(object):
     plt.savefig(os.path.join(os.getcwd(),"fuel_simulation.png"))
     plt.show()
 
+"""
+# Batched Fuel Management
+- BatchFuelEnvironment and BatchFuelAgent step N independent copies of FuelEnvironment and FuelAgent in lockstep.
+- They follow the same price model, consumption range and buying rule as the scalar versions.
+- Random draws come from a NumPy generator, so a fixed seed reproduces the whole batch.
+"""
+class BatchFuelEnvironment(BatchEnvironment):
+  priceDelta = np.array(FuelEnvironment.priceDelta)
+  standardDeviation = FuelEnvironment.standardDeviation
+  def __init__(self,size:int,seed:int|None=None)->ClassInitial:
+    self.size = size
+    self.rng = np.random.default_rng(seed)
+    self.time = 0
+    self.fuelStock = np.full(size,1000,dtype=np.int64) # in liters
+    self.price = np.full(size,100.0) # initial price per liter
+    self.record = TrajectoryRecorder({"stock":(np.int64,(size,)),"price":(np.float64,(size,))}) # one row of N values per step
+    self.perception = {
+      "price":self.price,
+      "fuelStock":self.fuelStock
+    }
+  stockHistory = FuelEnvironment.stockHistory
+  priceHistory = FuelEnvironment.priceHistory
+  def InitialPerception(self)->dict:
+    if not len(self.record): # recorded once, as for FuelEnvironment
+      self.record.Append(self.fuelStock,self.price)
+    return self.perception
+  def Do(self,action)->dict:
+    fuelUsed = self.rng.integers(FuelEnvironment.minUse,FuelEnvironment.maxUse+1,size=self.size) # Simulate fuel consumption
+    self.fuelStock += action["buy"]
+    self.fuelStock -= fuelUsed
+    np.maximum(self.fuelStock,0,out=self.fuelStock)
+    self.time += 1
+    self.price += self.priceDelta[self.time%len(self.priceDelta)]
+    self.price += self.standardDeviation*self.rng.standard_normal(self.size)
+    np.maximum(self.price,FuelEnvironment.minPrice,out=self.price) # Prevent price from going below a minimum
+    self.record.Append(self.fuelStock,self.price)
+    return self.perception
+
+class BatchFuelAgent(BatchAgent):
+  def __init__(self,environment:ClassInitial,cheapRatio:float=0.9,cheapStock:int=800,cheapBuy:int=200,lowStock:int=500,lowBuy:int=100)->ClassInitial:
+    self.cheapRatio,self.cheapStock,self.cheapBuy = cheapRatio,cheapStock,cheapBuy
+    self.lowStock,self.lowBuy = lowStock,lowBuy
+    self.size = environment.size
+    self.spent = np.zeros(self.size)
+    perception = environment.InitialPerception()
+    self.ave = perception["price"].copy() # Average Price
+    self.lastPrice = self.ave.copy()
+    self.fuelStock = perception["fuelStock"].copy()
+    self.toBuy = np.zeros(self.size,dtype=np.int64)
+    self.record = TrajectoryRecorder({"spent":(np.float64,(self.size,))}) # one row of N values per step
+    self.action = {"buy":self.toBuy}
+  buyHistory = FuelAgent.buyHistory
+  def SelectAction(self,perception)->dict:
+    self.lastPrice[:] = perception["price"]
+    self.fuelStock[:] = perception["fuelStock"]
+    self.ave += (self.lastPrice-self.ave)*0.05
+    cheap = (self.lastPrice < self.cheapRatio*self.ave)&(self.fuelStock < self.cheapStock)
+    self.toBuy[:] = np.where(cheap,self.cheapBuy,np.where(self.fuelStock < self.lowStock,self.lowBuy,0))
+    self.spent += self.toBuy*self.lastPrice
+    self.record.Append(self.spent)
+    return self.action
+
 # UNIT TEST
 #environment = FuelEnvironment()
-#agent = FuelAgent()
+#agent = FuelAgent(environment)
 #simulation = FuelSimulation(agent,environment)
 #simulation.Run(100)
 #simulation.VisualizeResults()
 
-    
\ No newline at end of file
+# UNIT TEST - BATCH
+#from agent_configuration import BatchSimulate
+#environment = BatchFuelEnvironment(1000,seed=42)
+#agent = BatchFuelAgent(environment)
+#simulation = BatchSimulate(agent,environment)
+#simulation.Go(100) # 100 steps for each of the 1000 instances
+#print(agent.spent.mean(),environment.fuelStock.mean())
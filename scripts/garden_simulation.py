@@ -1,63 +1,140 @@
-import matplotlib.pyplot as plt
-import math,random,os
+import math,os
+import numpy as np
+from util_grid import BitGrid
+from util_render import TraceBuffer,Renderer
+from util_random import RandomSource
 
 """
 # Project Overview
 - Environment: A garden represented by a rectangular grid with obstacles (trees).
 - Robot: An autonomous lawn mower with simple controls: move forward and turn.
 - Objective: Cover the entire garden area without colliding with obstacles.
+- Positions are mapped to the unit cell of the nearest integer point, so the garden has (width+1) x (height+1) cells.
+- Obstacles are kept in a bit-packed occupancy grid: checking a move is one O(1) lookup instead of a scan of the obstacle list.
+- The mower marks every cell it reaches in its own coverage grid and keeps a running count, so the coverage is known at every step.
 """
 
+def Cell(x:int|float,y:int|float)->tuple:
+  """
+  returns the integer cell of a position
+  """
+  return math.floor(x+0.5),math.floor(y+0.5)
+
 class Garden:
   def __init__(self,width:int,height:int,obstacles=None)->None:
+    """
+    obstacles is a list of (x,y) points or an (n,2) array
+    """
     if obstacles is None:
       obstacles = []
     self.width = width
     self.height = height
     self.obstacles = obstacles
+    self.occupancy = BitGrid(width+1,height+1)
+    self.obstacleCells = 0
+    if len(obstacles):
+      self.AddObstacles(np.asarray(obstacles,dtype=float))
+  def AddObstacles(self,points:np.ndarray)->None:
+    """
+    marks the cells of an (n,2) array of points as occupied; points outside the garden are ignored
+    """
+    cells = np.floor(points+0.5).astype(np.int64)
+    inside = (cells[:,0] >= 0) & (cells[:,0] <= self.width) & (cells[:,1] >= 0) & (cells[:,1] <= self.height)
+    self.obstacleCells += self.occupancy.SetMany(cells[inside,0],cells[inside,1])
+  def IsFree(self,x:int|float,y:int|float)->bool:
+    """
+    True if the position is inside the garden and its cell has no obstacle
+    """
+    if not (0 <= x <= self.width and 0 <= y <= self.height):
+      return False
+    return not self.occupancy.Get(*Cell(x,y))
+  def FreeCells(self)->int:
+    return self.occupancy.width*self.occupancy.height-self.obstacleCells
 
 class LawnMower:
   """
   Simulates the autonomous lawn mower. It can move forward and turn.
   It avoids moving outside the garden bounds or into obstacles.
-  The lawn mower's path is visualized, with obstacles marked distinctly.
+  The lawn mower's path is recorded in a trace; the renderer (none by default) visualizes it, with obstacles marked distinctly.
+  The cells it has mowed are kept in a coverage grid, with their number in coveredCells.
+  The random turns of StartMoving come from rng (see util_random; the random module by default).
   """
-  def __init__(self,garden,x:int=0,y:int=0,direction:int=90):
+  def __init__(self,garden,x:int=0,y:int=0,direction:int=90,renderer=None,rng=None):
     self.garden = garden
+    self.rng = RandomSource(rng)
     self.x = x
     self.y = y
     self.direction = direction
-    self.figure,self.axs = plt.subplots()
-    self.axs.set_xlim(0,garden.width)
-    self.axs.set_ylim(0,garden.height)
-    self.axs.set_aspect("equal","box")
-    self.PlotObstacles()
-  def PlotObstacles(self):
-    for obst in self.garden.obstacles:
-      self.axs.plot(obst[0],obst[1],"bs",markersize=10) # Plot obstacles as blue squares
+    self.coverage = BitGrid(garden.width+1,garden.height+1)
+    self.coveredCells = 0
+    self.Mow(x,y)
+    self.trace = TraceBuffer(("path",))
+    self.renderer = renderer if renderer is not None else Renderer()
+    self.renderer.Begin(self.trace,self.PlotObstacles)
+  def PlotObstacles(self,axs):
+    axs.set_xlim(0,self.garden.width)
+    axs.set_ylim(0,self.garden.height)
+    axs.set_aspect("equal","box")
+    axs.set_autoscale_on(False)
+    if len(self.garden.obstacles):
+      xS,yS = np.asarray(self.garden.obstacles,dtype=float).T
+      axs.plot(xS,yS,"bs",markersize=10) # Plot obstacles as blue squares
+  def Mow(self,x:int|float,y:int|float)->None:
+    cellX,cellY = Cell(x,y)
+    if self.coverage.Contains(cellX,cellY) and self.coverage.Set(cellX,cellY):
+      self.coveredCells += 1
+  def CoveragePercentage(self)->float:
+    """
+    returns the mowed share of the cells without obstacles, in percent
+    """
+    return 100.0*self.coveredCells/self.garden.FreeCells()
   def MoveForward(self):
     radian = math.radians(self.direction)
-    nextX = self.x+math.cos(radian)
-    nextY = self.y+math.sin(radian)
-    if 0 <= nextX <= self.garden.width and 0 <= nextY <= self.garden.height and (nextX,nextY) not in self.garden.obstacles:
+    # rounding drops the float noise of cos/sin, so right-angle moves stay on exact integer positions
+    nextX = self.x+round(math.cos(radian),12)
+    nextY = self.y+round(math.sin(radian),12)
+    if self.garden.IsFree(nextX,nextY):
       self.x = nextX
       self.y = nextY
-      self.axs.plot(self.x,self.y,"go") # Mowed grass as green dots
-      plt.draw()
-      plt.pause(0.2)
+      self.Mow(nextX,nextY)
+      self.trace.Add("path",self.x,self.y) # Mowed grass as green dots
+    self.renderer.Step()
   def Turn(self,angle):
     self.direction = (self.direction+angle)%360
-  def StartMoving(self,steps=100):
+  def FollowRoute(self,route)->int:
+    """
+    replays a route of neighbouring cells (e.g. from CoveragePlanner), turning to face each next cell
+    returns the number of forward moves
+    """
+    headings = {(1,0):0,(0,1):90,(-1,0):180,(0,-1):270}
+    steps = 0
+    for (fromX,fromY),(toX,toY) in zip(route[:-1].tolist(),route[1:].tolist()):
+      heading = headings[(toX-fromX,toY-fromY)]
+      if heading != self.direction:
+        self.Turn(heading-self.direction)
+      self.MoveForward()
+      steps += 1
+    return steps
+  def StartMoving(self,steps=100,coverCells=None)->int:
+    """
+    moves at random for the given steps, or until coverCells cells are mowed
+    returns the number of steps taken
+    """
     for idx in range(steps):
+      if coverCells is not None and self.coveredCells >= coverCells:
+        return idx
       self.MoveForward()
-      if random.random() < 0.3: # Randomly decide to turn to simulate navigation
-        self.Turn(random.choice([-90,90]))
+      if self.rng.Random() < 0.3: # Randomly decide to turn to simulate navigation
+        self.Turn(self.rng.Choice([-90,90]))
+    return steps
 
 #UNIT TEST
+# from util_render import FinalFrameRenderer
 # width,height = 20,20
 # obstacles = [(5,5),(5,6),(5,7),(10,10),(10,11)]
 # garden = Garden(width,height,obstacles)
-# lawnMower = LawnMower(garden,x=0,y=0,direction=90)
+# renderer = FinalFrameRenderer(path=os.path.join(os.getcwd(),"garden_simulation.png"))
+# lawnMower = LawnMower(garden,x=0,y=0,direction=90,renderer=renderer)
 # lawnMower.StartMoving(100)
-# plt.savefig(os.path.join(os.getcwd(),"garden_simulation.png"))
-# plt.show()
+# renderer.Finish()
+# print(lawnMower.coveredCells,lawnMower.CoveragePercentage())
@@ -0,0 +1,82 @@
+import math
+import numpy as np
+from util_class import ClassInitial
+
+"""
+# Kinematics
+- Replays movement scripts of (distance,angle) commands for many robots at once: each command moves forward by distance and then turns by angle,
+  as MoveForward(distance) followed by Turn(angle) of SimpleRobot or VisualRobot.
+- The headings are a cumulative sum of the turns (taken modulo 360); the positions are cumulative sums of distance*cos/sin of the heading.
+- Headings in whole degrees are looked up in a table of math.cos/math.sin, and the sums are accumulated in the same order as the robots do,
+  so the poses are bit-for-bit those of GetPosition(); other headings use NumPy trig and agree to rounding.
+"""
+degrees = np.arange(360)
+cosTable = np.array([math.cos(math.radians(degree)) for degree in degrees.tolist()])
+sinTable = np.array([math.sin(math.radians(degree)) for degree in degrees.tolist()])
+
+def HeadingCosSin(directions:np.ndarray)->tuple:
+  """
+  cos and sin of headings in degrees
+  """
+  if directions.size == 0:
+    return np.empty(directions.shape),np.empty(directions.shape)
+  whole = directions.astype(np.int64)
+  if np.array_equal(whole,directions) and whole.min() >= 0 and whole.max() < 360:
+    return cosTable[whole],sinTable[whole]
+  radians = directions*(math.pi/180) # the same rounding as math.radians
+  return np.cos(radians),np.sin(radians)
+
+def InitialPoses(robots:list)->np.ndarray:
+  """
+  the (M,3) poses (x,y,direction) of a list of robots
+  """
+  return np.array([robot.GetPosition() for robot in robots],dtype=float).reshape(-1,3)
+
+def Trajectories(commands:ClassInitial,initial:ClassInitial=(0,0,30))->np.ndarray:
+  """
+  commands is an (M,T,2) array of (distance,angle), or a (T,2) script shared by all the robots
+  initial is an (M,3) array of starting poses, or one (x,y,direction) pose for every robot
+  returns the (M,T,3) poses (x,y,direction) after each command
+  """
+  commands = np.asarray(commands,dtype=float)
+  initial = np.asarray(initial,dtype=float).reshape(-1,3)
+  if commands.ndim == 2:
+    commands = np.broadcast_to(commands,(len(initial),)+commands.shape)
+  robots,steps = commands.shape[:2]
+  initial = np.broadcast_to(initial,(robots,3))
+  poses = np.empty((robots,steps,3))
+  if steps == 0:
+    return poses
+  distances,angles = commands[...,0],commands[...,1]
+  # heading of every command before its turn, and after it
+  turns = np.empty((robots,steps+1))
+  turns[:,0] = initial[:,2]
+  turns[:,1:] = angles
+  headings = np.mod(np.cumsum(turns,axis=1),360)
+  headings[:,0] = initial[:,2]
+  cosines,sines = HeadingCosSin(headings[:,:-1])
+  for axis,trig in ((0,cosines),(1,sines)):
+    moves = np.empty((robots,steps+1))
+    moves[:,0] = initial[:,axis]
+    np.multiply(distances,trig,out=moves[:,1:])
+    poses[...,axis] = np.cumsum(moves,axis=1)[:,1:]
+  poses[...,2] = headings[:,1:]
+  return poses
+
+def FinalPoses(commands:ClassInitial,initial:ClassInitial=(0,0,30))->np.ndarray:
+  """
+  the (M,3) poses after the last command
+  """
+  return Trajectories(commands,initial)[:,-1]
+
+#UNIT TEST
+# from basic_robot_logic import SimpleRobot
+# movements = [(10,0),(10,-10),(10,90),(5,90)]
+# robot = SimpleRobot()
+# for distance,angle in movements:
+#   robot.MoveForward(distance)
+#   robot.Turn(angle)
+# print(robot.GetPosition(),FinalPoses(movements))
+# commands = np.random.default_rng(0).integers(-90,91,size=(1000,1000,2))
+# print(Trajectories(commands,np.zeros((1000,3))).shape)
+# print(Trajectories(np.zeros((0,5,2)),np.zeros((0,3))).shape,FinalPoses(np.zeros((0,5,2))).shape) # (0, 5, 3) (0, 3)
@@ -0,0 +1,319 @@
+import bisect,random,time
+import numpy as np
+from util_class import ClassInitial,NullInitial
+from util_display import Displayable
+from util_project import ArgMaxArray,ArgMaxRows
+from agent_configuration import Agent,Simulate
+from buying_simulation import PSEnvironment,BatchPSEnvironment
+
+"""
+# Tabular Q-Learning
+- A state encoder turns a perception into a state: an int index into a dense Q-table, or a hashable tuple for a sparse one.
+- An action encoder turns an action index into the action dictionary the environment expects.
+- QTable stores the action values as a dense NumPy array (one row per state); SparseQTable keeps one row per visited state in a dictionary.
+- EpsilonGreedy and Softmax pick an action from a row of action values, or from many rows at once.
+- QLearningAgent is an ordinary Agent: it learns from the reward of each step while Simulate runs it (Q-learning or SARSA).
+- BatchQLearner trains on a batched environment: N episodes run in lockstep and every step is one vectorized TD update.
+"""
+
+class GridEncoder(object):
+  """
+  discretizes each perception key with its own bin edges and combines the bins into one state index
+  """
+  def __init__(self,bins:dict)->ClassInitial:
+    self.keys = list(bins)
+    self.edges = [list(bins[key]) for key in self.keys]
+    self.edgeArrays = [np.asarray(edges) for edges in self.edges]
+    self.strides = []
+    stride = 1
+    for edges in reversed(self.edges):
+      self.strides.insert(0,stride)
+      stride *= len(edges)+1
+    self.numberOfStates = stride
+  def Encode(self,perception:dict)->int:
+    state = 0
+    for key,edges,stride in zip(self.keys,self.edges,self.strides):
+      state += bisect.bisect_right(edges,perception[key])*stride
+    return state
+  def EncodeBatch(self,perception:dict)->np.ndarray:
+    """
+    encodes a perception of arrays, one state per instance
+    """
+    state = 0
+    for key,edges,stride in zip(self.keys,self.edgeArrays,self.strides):
+      state = state+np.digitize(perception[key],edges)*stride
+    return state
+
+class TupleEncoder(GridEncoder):
+  """
+  like GridEncoder but returns the tuple of bins, for a SparseQTable
+  """
+  def Encode(self,perception:dict)->tuple:
+    return tuple(bisect.bisect_right(edges,perception[key]) for key,edges in zip(self.keys,self.edges))
+  def EncodeBatch(self,perception:dict)->list:
+    """
+    encodes a perception of arrays into a list of tuples, one per instance, the same as Encode gives
+    """
+    return list(zip(*(np.digitize(perception[key],edges).tolist() for key,edges in zip(self.keys,self.edgeArrays))))
+
+class ActionEncoder(object):
+  """
+  the actions are {key:value} for each of the values
+  """
+  def __init__(self,key:str,values:list)->ClassInitial:
+    self.key = key
+    self.values = list(values)
+    self.valueArray = np.asarray(self.values)
+    self.numberOfActions = len(self.values)
+  def Decode(self,action:int)->dict:
+    return {self.key:self.values[action]}
+  def DecodeBatch(self,actions:np.ndarray)->dict:
+    return {self.key:self.valueArray[actions]}
+
+class QTable(object):
+  """
+  dense action values, one row per state index
+  """
+  def __init__(self,numberOfStates:int,numberOfActions:int,initialValue:float=0.0)->ClassInitial:
+    self.values = np.full((numberOfStates,numberOfActions),initialValue)
+  def Row(self,state:int)->np.ndarray:
+    return self.values[state]
+  def Rows(self,states:np.ndarray)->np.ndarray:
+    return self.values[states]
+  def Update(self,state:int,action:int,target:float,alpha:float)->None|NullInitial:
+    row = self.values[state]
+    row[action] += alpha*(target-row[action])
+  def UpdateBatch(self,states:np.ndarray,actions:np.ndarray,targets:np.ndarray,alpha:float)->None|NullInitial:
+    """
+    one TD update per (state,action,target); the updates of an entry that appears several times are averaged
+    """
+    errors = targets-self.values[states,actions]
+    entries,inverse = np.unique(states*self.values.shape[1]+actions,return_inverse=True)
+    meanErrors = np.bincount(inverse,weights=errors)/np.bincount(inverse)
+    self.values.flat[entries] += alpha*meanErrors
+
+class SparseQTable(object):
+  """
+  action values kept only for the states that were visited, for large or unbounded state spaces
+  """
+  def __init__(self,numberOfActions:int,initialValue:float=0.0)->ClassInitial:
+    self.numberOfActions = numberOfActions
+    self.initialValue = initialValue
+    self.values = {}
+  def Row(self,state:ClassInitial)->np.ndarray:
+    row = self.values.get(state)
+    if row is None:
+      row = self.values[state] = np.full(self.numberOfActions,self.initialValue)
+    return row
+  def Rows(self,states:ClassInitial)->np.ndarray:
+    return np.array([self.Row(state) for state in states])
+  def Update(self,state:ClassInitial,action:int,target:float,alpha:float)->None|NullInitial:
+    row = self.Row(state)
+    row[action] += alpha*(target-row[action])
+  def UpdateBatch(self,states:ClassInitial,actions:np.ndarray,targets:np.ndarray,alpha:float)->None|NullInitial:
+    for state,action,target in zip(states,actions.tolist(),targets.tolist()):
+      self.Update(state,action,target,alpha)
+
+class EpsilonGreedy(object):
+  """
+  a random action with probability epsilon, otherwise a greedy one (ties broken at random)
+  """
+  def __init__(self,epsilon:float=0.1)->ClassInitial:
+    self.epsilon = epsilon
+  def Select(self,values:np.ndarray,rng:ClassInitial=random)->int:
+    if rng.random() < self.epsilon:
+      return min(int(rng.random()*len(values)),len(values)-1)
+    return ArgMaxArray(values,rng)
+  def SelectRows(self,values:np.ndarray,rng:np.random.Generator)->np.ndarray:
+    actions = ArgMaxRows(values,rng)
+    explore = rng.random(len(values)) < self.epsilon
+    actions[explore] = rng.integers(values.shape[1],size=int(explore.sum()))
+    return actions
+
+class Softmax(object):
+  """
+  picks action a with probability proportional to exp(Q(s,a)/temperature)
+  """
+  def __init__(self,temperature:float=1.0)->ClassInitial:
+    self.temperature = temperature
+  def Select(self,values:np.ndarray,rng:ClassInitial=random)->int:
+    weights = np.exp((values-values.max())/self.temperature)
+    cumulative = np.cumsum(weights)
+    return min(int(np.searchsorted(cumulative,rng.random()*cumulative[-1],side="right")),len(values)-1)
+  def SelectRows(self,values:np.ndarray,rng:np.random.Generator)->np.ndarray:
+    # Gumbel-max trick: adding Gumbel noise and taking the argmax samples the softmax of every row at once
+    noise = -np.log(-np.log(rng.random(values.shape)))
+    return np.argmax(values/self.temperature+noise,axis=1)
+
+"""
+# Q-Learning Agent
+- SelectAction receives the perception that resulted from the previous action, so the agent computes that step's reward itself with reward(previous perception,action,perception).
+- Q-learning bootstraps from the best action of the new state; SARSA from the action it actually takes next.
+- EndEpisode(perception) learns from the last step of an episode and forgets it, so the next episode does not bootstrap from this one.
+"""
+class QLearningAgent(Agent):
+  def __init__(self,encoder:ClassInitial,actions:ClassInitial,reward:ClassInitial,table:ClassInitial=None,exploration:ClassInitial=None,alpha:float=0.1,gamma:float=0.95,method:str="q",rng:ClassInitial=None)->ClassInitial:
+    if method not in ("q","sarsa"):
+      raise ValueError(f"[Unknown method]::{method}")
+    self.encoder = encoder
+    self.actions = actions
+    self.reward = reward
+    self.table = table if table is not None else QTable(encoder.numberOfStates,actions.numberOfActions)
+    self.exploration = exploration if exploration is not None else EpsilonGreedy()
+    self.alpha = alpha
+    self.gamma = gamma
+    self.method = method
+    self.rng = rng if rng is not None else random
+    self.learning = True
+    self.previous = None # (perception,state,action index,action) of the last step
+    self.totalReward = 0.0
+  def SelectAction(self,perception:dict)->dict:
+    state = self.encoder.Encode(perception)
+    row = self.table.Row(state)
+    if self.learning:
+      actionIndex = self.exploration.Select(row,self.rng)
+    else:
+      actionIndex = ArgMaxArray(row,self.rng)
+    action = self.actions.Decode(actionIndex)
+    if self.previous is not None:
+      previousPerception,previousState,previousIndex,previousAction = self.previous
+      reward = self.reward(previousPerception,previousAction,perception)
+      self.totalReward += reward
+      if self.learning:
+        future = row[actionIndex] if self.method == "sarsa" else row.max()
+        self.table.Update(previousState,previousIndex,reward+self.gamma*future,self.alpha)
+    self.previous = (perception,state,actionIndex,action)
+    return action
+  def EndEpisode(self,perception:dict|None=None,terminal:bool=True)->None|NullInitial:
+    """
+    updates the last step with the final perception (if given), bootstrapping only when the episode was cut short (terminal=False)
+    """
+    if self.previous is not None and perception is not None:
+      previousPerception,previousState,previousIndex,previousAction = self.previous
+      reward = self.reward(previousPerception,previousAction,perception)
+      self.totalReward += reward
+      if self.learning:
+        future = 0.0 if terminal else self.table.Row(self.encoder.Encode(perception)).max()
+        self.table.Update(previousState,previousIndex,reward+self.gamma*future,self.alpha)
+    self.previous = None
+
+"""
+# Batched Training
+- BatchQLearner trains one Q-table on a batched environment (e.g. BatchPSEnvironment): each round runs N episodes in lockstep.
+- States are encoded with EncodeBatch, actions chosen with SelectRows and the N TD updates of a step are applied with one UpdateBatch.
+- reward(previous perception,action,perception) works on arrays and returns one reward per instance.
+"""
+class BatchQLearner(Displayable):
+  def __init__(self,environmentFactory:ClassInitial,encoder:ClassInitial,actions:ClassInitial,reward:ClassInitial,table:ClassInitial=None,exploration:ClassInitial=None,alpha:float=0.1,gamma:float=0.95,method:str="q",seed:int|None=None)->ClassInitial:
+    """
+    environmentFactory(size,seed) returns a new batched environment
+    """
+    if method not in ("q","sarsa"):
+      raise ValueError(f"[Unknown method]::{method}")
+    self.environmentFactory = environmentFactory
+    self.encoder = encoder
+    self.actions = actions
+    self.reward = reward
+    self.table = table if table is not None else QTable(encoder.numberOfStates,actions.numberOfActions)
+    self.exploration = exploration if exploration is not None else EpsilonGreedy()
+    self.alpha = alpha
+    self.gamma = gamma
+    self.method = method
+    self.seedSequence = np.random.SeedSequence(seed)
+    self.rng = np.random.default_rng(self.seedSequence.spawn(1)[0])
+  def Run(self,size:int,steps:int,learning:bool=True)->np.ndarray:
+    """
+    runs one round of size episodes of the given number of steps
+    returns the total reward of every episode
+    """
+    environment = self.environmentFactory(size,self.seedSequence.spawn(1)[0])
+    perception = environment.InitialPerception()
+    totals = np.zeros(size)
+    states = self.encoder.EncodeBatch(perception)
+    actions = self.Choose(states,learning)
+    for step in range(steps):
+      previous = {key:value.copy() for key,value in perception.items()}
+      action = self.actions.DecodeBatch(actions)
+      perception = environment.Do(action)
+      rewards = self.reward(previous,action,perception)
+      totals += rewards
+      nextStates = self.encoder.EncodeBatch(perception)
+      nextActions = self.Choose(nextStates,learning)
+      if learning:
+        rows = self.table.Rows(nextStates)
+        if self.method == "sarsa":
+          future = rows[np.arange(size),nextActions]
+        else:
+          future = rows.max(axis=1)
+        self.table.UpdateBatch(states,actions,rewards+self.gamma*future,self.alpha)
+      states,actions = nextStates,nextActions
+    return totals
+  def Choose(self,states:np.ndarray,learning:bool)->np.ndarray:
+    rows = self.table.Rows(states)
+    if learning:
+      return self.exploration.SelectRows(rows,self.rng)
+    return ArgMaxRows(rows,self.rng)
+  def Train(self,episodes:int,steps:int,size:int=1000)->list:
+    """
+    trains on episodes episodes, size of them at a time
+    returns the mean total reward of each round
+    """
+    means = []
+    for start in range(0,episodes,size):
+      totals = self.Run(min(size,episodes-start),steps)
+      means.append(float(totals.mean()))
+      self.display(1,f"Episodes: {start+len(totals)} [::] Mean Reward: {means[-1]:.1f}")
+    return means
+
+"""
+# Stock Buying Task
+- States: the amount in stock and the price, both binned; actions: buy 0, 12, 24 or 48.
+- Reward: minus the money spent, minus a penalty for every unit of missing stock.
+"""
+stockoutPenalty = 500
+
+def StockBuyingTask()->tuple:
+  """
+  returns (encoder,actions,reward) for PSEnvironment and BatchPSEnvironment
+  """
+  encoder = GridEncoder(
+    {
+      "instock":list(range(0,100,6)),
+      "price":list(range(160,320,10))
+    }
+  )
+  actions = ActionEncoder("buy",[0,12,24,48])
+  def Reward(previous:dict,action:dict,perception:dict)->ClassInitial:
+    missing = np.maximum(-perception["instock"],0)
+    return -action["buy"]*previous["price"]-stockoutPenalty*missing
+  return encoder,actions,Reward
+
+def BatchPSFactory(size:int,seed:ClassInitial)->ClassInitial:
+  return BatchPSEnvironment(size,seed=seed)
+
+def BenchmarkQLearning(scalarSteps:int=20000,batchSize:int=1000,batchSteps:int=200)->dict:
+  """
+  measures training throughput in environment steps per second on the stock buying task
+  """
+  encoder,actions,reward = StockBuyingTask()
+  environment = PSEnvironment()
+  agent = QLearningAgent(encoder,actions,lambda previous,action,perception:float(reward(previous,action,perception)))
+  simulation = Simulate(agent,environment)
+  start = time.perf_counter()
+  simulation.Go(scalarSteps)
+  scalarSeconds = time.perf_counter()-start
+  learner = BatchQLearner(BatchPSFactory,encoder,actions,reward,seed=0)
+  start = time.perf_counter()
+  learner.Train(batchSize,batchSteps,size=batchSize)
+  batchSeconds = time.perf_counter()-start
+  return {
+    "scalarStepsPerSecond":scalarSteps/scalarSeconds,
+    "batchStepsPerSecond":batchSize*batchSteps/batchSeconds
+  }
+
+#UNIT TEST
+# encoder,actions,reward = StockBuyingTask()
+# learner = BatchQLearner(BatchPSFactory,encoder,actions,reward,seed=1)
+# print(learner.Train(20000,100,size=2000))
+# print(learner.Run(1000,100,learning=False).mean())
+# print(BenchmarkQLearning())
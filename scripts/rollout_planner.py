@@ -0,0 +1,150 @@
+import os,time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor,wait,FIRST_COMPLETED
+from util_class import ClassInitial,NullInitial
+from agent_configuration import Agent
+from util_record import TrajectoryRecorder
+
+"""
+# Rollout Model
+- The price and use model of a PSEnvironment or FuelEnvironment, small enough to send to worker processes.
+- Paths draws `samples` futures of `horizon` steps at once: the prices are a cumulative sum of the repeating price pattern
+  and Gaussian noise, kept above the environment's minPrice by a running maximum (the same walk as stepping max(minPrice,price+change)),
+  and the uses come from the environment's SampleUse. The rounding of the paper price is left out.
+"""
+class RolloutModel(object):
+  def __init__(self,environment:ClassInitial)->ClassInitial:
+    self.environmentClass = type(environment)
+    self.priceDelta = np.asarray(environment.priceDelta,dtype=float)
+    self.standardDeviation = environment.standardDeviation
+    self.minPrice = environment.minPrice
+    self.lostSales = environment.lostSales
+  def Paths(self,generator:ClassInitial,now:int,price:int|float,samples:int,horizon:int)->tuple:
+    """
+    returns the (samples,horizon+1) prices from the current one on and the (samples,horizon) uses of the steps after time now
+    """
+    deltas = self.priceDelta[np.arange(now+1,now+horizon+1)%len(self.priceDelta)]
+    prices = np.empty((samples,horizon+1))
+    prices[:,0] = price
+    walk = prices[:,1:]
+    np.cumsum(deltas+self.standardDeviation*generator.standard_normal((samples,horizon)),axis=1,out=walk)
+    walk += price
+    if self.minPrice is not None:
+      walk += np.maximum(np.maximum.accumulate(self.minPrice-walk,axis=1),0)
+    return prices,self.environmentClass.SampleUse(generator,(samples,horizon))
+
+def RolloutCosts(model:ClassInitial,now:int,price:int|float,stock:int|float,candidates:np.ndarray,lowStock:int|float,lowBuy:int|float,
+  penalty:float,horizon:int,samples:int,seed:ClassInitial)->np.ndarray:
+  """
+  the cost of every candidate first buy in each of `samples` futures: what is spent, plus penalty for every unit short on every step,
+  less the stock left at the end valued at the last price; after the first step the base rule buys lowBuy whenever the stock is below lowStock
+  only the stock that another horizon would use is worth its price at the end (more is not credited), so rising prices do not make hoarding pay
+  every candidate sees the same futures (common random numbers), so their differences are not swamped by the noise of the futures
+  returns a (candidates,samples) array
+  """
+  prices,uses = model.Paths(np.random.default_rng(seed),now,price,samples,horizon)
+  buy = np.repeat(candidates[:,None],samples,axis=1)
+  cost = buy*price
+  stock = np.full(buy.shape,float(stock))
+  for step in range(horizon):
+    stock += buy
+    stock -= uses[:,step]
+    short = np.maximum(-stock,0)
+    if model.lostSales:
+      stock += short
+    cost += penalty*short
+    if step+1 < horizon:
+      buy = np.where(stock < lowStock,lowBuy,0.0)
+      cost += buy*prices[:,step+1]
+  cost -= np.clip(stock,0,uses.sum(axis=1))*prices[:,horizon]
+  return cost
+
+"""
+# Rollout Agent
+- A lookahead buyer for the paper (PSEnvironment) and fuel (FuelEnvironment) domains.
+- At every decision each candidate buy is scored by its mean cost over many short simulated futures (RolloutCosts), and the cheapest is bought.
+- The futures are drawn in batches of `batch` samples, each batch from a generator seeded by (seed,decision,batch),
+  so a decision depends on the seed and the number of batches only, not on the workers.
+- timeBudget (seconds) stops a decision once it has used that long, after at least one batch.
+- With workers > 1 the batches of a decision go to a process pool; the hand-off costs about a millisecond,
+  so it pays only for large samples and horizons. Close() shuts the pool down.
+- By default the candidates are 0, 1, 2, 4 and 8 times the most used in a step, the base rule keeps two steps of the most use in stock,
+  and a unit short for one step costs twice the current price.
+"""
+class RolloutAgent(Agent):
+  stateFields = ("decisions","spent","stock","lastPrice","record")
+  def __init__(self,environment:ClassInitial,candidates:list|None=None,horizon:int=10,samples:int=128,batch:int=128,timeBudget:float|None=None,
+    stockoutPenalty:float|None=None,lowStock:int|float|None=None,lowBuy:int|float|None=None,seed:int|None=None,workers:int=1)->ClassInitial:
+    if horizon < 1 or samples < 1 or batch < 1:
+      raise ValueError(f"[Horizon, samples and batch must be positive]::{(horizon,samples,batch)}")
+    maxUse = environment.maxUse
+    self.model = RolloutModel(environment)
+    self.stockKey = environment.stockKey
+    self.candidates = np.array(candidates if candidates is not None else [0,maxUse,2*maxUse,4*maxUse,8*maxUse],dtype=float)
+    self.horizon = horizon
+    self.samples = samples
+    self.batch = min(batch,samples)
+    self.timeBudget = timeBudget
+    self.stockoutPenalty = stockoutPenalty
+    self.lowStock = lowStock if lowStock is not None else 2*maxUse
+    self.lowBuy = lowBuy if lowBuy is not None else 2*maxUse
+    self.entropy = np.random.SeedSequence(seed).entropy
+    self.workers = workers
+    self.executor = None
+    self.decisions = 0
+    self.spent = 0
+    self.stock = self.lastPrice = None
+    self.record = TrajectoryRecorder({"buy":np.int64})
+  @property
+  def buyHistory(self)->np.ndarray:
+    return self.record.Column("buy")
+  def SelectAction(self,perception:dict)->dict:
+    self.lastPrice = perception["price"]
+    self.stock = perception[self.stockKey]
+    toBuy = int(self.candidates[np.argmin(self.ExpectedCosts())])
+    self.decisions += 1
+    self.spent += toBuy*self.lastPrice
+    self.record.Append(toBuy)
+    return {"buy":toBuy}
+  def ExpectedCosts(self)->np.ndarray:
+    """
+    the mean rollout cost of every candidate at the current decision
+    """
+    penalty = self.stockoutPenalty if self.stockoutPenalty is not None else 2*self.lastPrice
+    arguments = (self.model,self.decisions,self.lastPrice,self.stock,self.candidates,self.lowStock,self.lowBuy,penalty,self.horizon,self.batch)
+    seeds = [(self.entropy,self.decisions,idx) for idx in range(-(-self.samples//self.batch))]
+    if self.workers > 1:
+      costs = self.PoolCosts(arguments,seeds)
+    else:
+      costs = []
+      deadline = time.perf_counter()+self.timeBudget if self.timeBudget is not None else None
+      for seed in seeds:
+        costs.append(RolloutCosts(*arguments,seed))
+        if deadline is not None and time.perf_counter() > deadline:
+          break
+    return np.mean([cost.mean(axis=1) for cost in costs],axis=0)
+  def PoolCosts(self,arguments:tuple,seeds:list)->list:
+    if self.executor is None:
+      self.executor = ProcessPoolExecutor(max_workers=self.workers or os.cpu_count())
+    futures = [self.executor.submit(RolloutCosts,*arguments,seed) for seed in seeds]
+    done,pending = wait(futures,timeout=self.timeBudget)
+    if not done:
+      done,pending = wait(futures,return_when=FIRST_COMPLETED)
+    for future in pending:
+      future.cancel()
+    return [future.result() for future in futures if future in done] # in submission order, so the mean does not depend on timing
+  def Close(self)->None|NullInitial:
+    if self.executor is not None:
+      self.executor.shutdown(cancel_futures=True)
+      self.executor = None
+
+#UNIT TEST
+# from util_random import BlockRandom
+# from agent_configuration import Simulate
+# from buying_simulation import PSEnvironment,PSAgent
+# for agentClass in (PSAgent,RolloutAgent):
+#   environment = PSEnvironment(rng=BlockRandom(3))
+#   agent = agentClass(environment)
+#   simulation = Simulate(agent,environment)
+#   simulation.Go(10000)
+#   print(agentClass.__name__,agent.spent,int((environment.stockHistory <= 0).sum()))
@@ -0,0 +1,183 @@
+import heapq,math
+import numpy as np
+from util_class import ClassInitial,NullInitial
+from util_display import Displayable
+from util_geometry import SegmentArray,SegmentParameters,PointSegmentDistances,SegmentDistances
+from util_wall_index import Fresh
+
+"""
+# Route Planner
+- A visibility graph over the wall map: its nodes are points just beyond both sides of every wall end, kept a clearance away from every wall.
+- Two nodes are joined when the straight segment between them keeps the clearance from every wall;
+  the graph is built once per map and rebuilt only when the walls change (the environment's version goes up).
+- Path connects a start and a goal to the visible nodes and runs Dijkstra; it returns the length and the waypoints to steer to.
+- Paths are memoized by the (start,goal) coordinates, so moving a location (e.g. with PlotFollow) never returns a stale path;
+  Invalidate drops the paths of a position that moved.
+- Order sorts the stops of a multi-stop visit by nearest neighbour and then improves the order with 2-opt over the path lengths.
+"""
+class RoutePlanner(Displayable):
+  def __init__(self,environment:ClassInitial,clearance:int|float=4)->ClassInitial:
+    """
+    environment is a WallEnvironment; clearance is the distance kept from the walls (a little over the turning radius of the body)
+    """
+    self.environment = environment
+    self.clearance = clearance
+    self.index = None
+    self.version = None
+    self.paths = {} # (start,goal) -> (length,waypoints)
+  def Walls(self)->np.ndarray:
+    walls = [wall for wall in self.environment.wallList if wall is not None]
+    return SegmentArray(walls)
+  def Build(self)->None|NullInitial:
+    """
+    builds the visibility graph of the current walls
+    """
+    self.version = self.environment.version
+    self.paths = {}
+    self.wallSegments = self.Walls()
+    nodes = []
+    for ((x0,y0),(x1,y1)) in self.wallSegments.tolist():
+      length = math.hypot(x1-x0,y1-y0)
+      if length == 0:
+        continue
+      ux,uy = (x1-x0)/length,(y1-y0)/length
+      for (px,py,sign) in ((x1,y1,1),(x0,y0,-1)):
+        for side in (1,-1):
+          nodes.append((px+self.clearance*(sign*ux-side*uy),py+self.clearance*(sign*uy+side*ux)))
+    nodes = np.array(nodes).reshape(-1,2)
+    if len(nodes):
+      nodes = nodes[self.Visible(np.repeat(nodes[:,None,:],2,axis=1),self.clearance*0.999)]
+    self.nodes = nodes
+    self.edges = [[] for node in nodes] # node -> [(other node,length)]
+    if len(nodes) > 1:
+      first,second = np.triu_indices(len(nodes),k=1)
+      segments = np.stack((nodes[first],nodes[second]),axis=1)
+      visible = self.Visible(segments,self.clearance*0.999,clearEnds=True)
+      lengths = np.hypot(*(segments[:,1]-segments[:,0]).T)
+      for idx,jdx,length in zip(first[visible].tolist(),second[visible].tolist(),lengths[visible].tolist()):
+        self.edges[idx].append((jdx,length))
+        self.edges[jdx].append((idx,length))
+    self.display(2,f"Nodes: {len(nodes)} [::] Edges: {sum(len(edges) for edges in self.edges)//2}")
+  def Visible(self,segments:np.ndarray,clearance:int|float,clearEnds:bool=False,chunkSize:int=1<<20)->np.ndarray:
+    """
+    true for every (K,2,2) segment that passes at least clearance from every wall (clearance 0: does not cross any wall)
+    only the walls registered in the grid cells around a segment are measured
+    clearEnds tells that both ends of every segment are known to be clear, so only crossings and wall ends near the segment are tested
+    """
+    self.index = Fresh(self.index,self.environment)
+    visible = np.ones(len(segments),dtype=bool)
+    rows = max(1,chunkSize//max(1,len(self.wallSegments)))
+    for start in range(0,len(segments),rows):
+      chunk = segments[start:start+rows]
+      segment,walls = self.index.Candidates(chunk,clearance)
+      if len(segment) == 0:
+        continue
+      chunkSegments,wallSegments = chunk[segment],self.environment.wallArray[walls]
+      if clearEnds:
+        blocked,_ = SegmentParameters(chunkSegments,wallSegments,collinear=True)
+        for end in (0,1):
+          blocked |= PointSegmentDistances(wallSegments[:,end],chunkSegments) < clearance
+      else:
+        distances = SegmentDistances(chunkSegments,wallSegments)
+        blocked = distances < clearance if clearance > 0 else distances <= 0
+      visible[start+segment[blocked]] = False
+    return visible
+  def Path(self,start:tuple,goal:tuple)->tuple:
+    """
+    returns (length,waypoints) of the shortest route, the waypoints ending with the goal
+    returns (inf,[goal]) when the graph has no route, so the caller falls back to steering straight at the goal
+    """
+    if self.version != self.environment.version:
+      self.Build()
+    start,goal = tuple(map(float,start)),tuple(map(float,goal))
+    key = (start,goal)
+    if key not in self.paths:
+      self.paths[key] = self.Search(start,goal)
+    return self.paths[key]
+  def Search(self,start:tuple,goal:tuple)->tuple:
+    if self.Visible(np.array([[start,goal]]),0)[0]:
+      return math.hypot(goal[0]-start[0],goal[1]-start[1]),[goal]
+    count = len(self.nodes)
+    if count == 0:
+      return math.inf,[goal]
+    # start and goal connect to the nodes they see with the clearance, or failing that with a bare line of sight
+    startVisible = self.Connections(np.stack((np.broadcast_to(start,(count,2)),self.nodes),axis=1))
+    goalVisible = self.Connections(np.stack((self.nodes,np.broadcast_to(goal,(count,2))),axis=1))
+    startLengths = np.hypot(self.nodes[:,0]-start[0],self.nodes[:,1]-start[1])
+    goalLengths = np.hypot(self.nodes[:,0]-goal[0],self.nodes[:,1]-goal[1])
+    distance = {}
+    parent = {}
+    frontier = []
+    for node in np.flatnonzero(startVisible).tolist():
+      distance[node] = startLengths[node]
+      parent[node] = None
+      heapq.heappush(frontier,(startLengths[node],node))
+    best,last = math.inf,None
+    while frontier:
+      length,node = heapq.heappop(frontier)
+      if length > distance[node] or length >= best:
+        continue
+      if goalVisible[node] and length+goalLengths[node] < best:
+        best,last = length+goalLengths[node],node
+      for other,edge in self.edges[node]:
+        if length+edge < distance.get(other,math.inf):
+          distance[other] = length+edge
+          parent[other] = node
+          heapq.heappush(frontier,(length+edge,other))
+    if last is None:
+      return math.inf,[goal]
+    waypoints = [goal]
+    while last is not None:
+      waypoints.append(tuple(self.nodes[last].tolist()))
+      last = parent[last]
+    return float(best),waypoints[::-1]
+  def Connections(self,segments:np.ndarray)->np.ndarray:
+    visible = self.Visible(segments,self.clearance*0.999)
+    if not visible.any():
+      visible = self.Visible(segments,0)
+    return visible
+  def Invalidate(self,position:tuple)->None|NullInitial:
+    """
+    forgets the memoized paths that start or end at position
+    """
+    position = tuple(map(float,position))
+    self.paths = {key:value for key,value in self.paths.items() if position not in key}
+  def Order(self,start:tuple,stops:list)->list:
+    """
+    returns the indices of the stops in a short visiting order from start (nearest neighbour, then 2-opt)
+    """
+    count = len(stops)
+    if count < 2:
+      return list(range(count))
+    points = [start]+list(stops)
+    lengths = np.zeros((count+1,count+1))
+    for idx in range(count+1):
+      for jdx in range(1,count+1):
+        if idx != jdx:
+          lengths[idx,jdx] = self.Path(points[idx],points[jdx])[0]
+    lengths[np.isinf(lengths)] = 1e9 # unreachable legs go last, but the order stays well defined
+    tour = [0]
+    remaining = set(range(1,count+1))
+    while remaining:
+      nearest = min(remaining,key=lambda stop:(lengths[tour[-1],stop],stop))
+      tour.append(nearest)
+      remaining.remove(nearest)
+    improved = True
+    while improved:
+      improved = False
+      for idx in range(1,count):
+        for jdx in range(idx+1,count+1):
+          # reversing tour[idx..jdx] replaces the legs (idx-1,idx) and (jdx,jdx+1); the route is open so the last leg may be missing
+          before = lengths[tour[idx-1],tour[idx]]+(lengths[tour[jdx],tour[jdx+1]] if jdx < count else 0)
+          after = lengths[tour[idx-1],tour[jdx]]+(lengths[tour[idx],tour[jdx+1]] if jdx < count else 0)
+          if after < before-1e-9:
+            tour[idx:jdx+1] = tour[idx:jdx+1][::-1]
+            improved = True
+    return [stop-1 for stop in tour[1:]]
+
+#UNIT TEST
+# from wall_environment import WallEnvironment
+# environment = WallEnvironment({((10,-11),(10,0)),((10,50),(10,31)),((30,-10),(30,0)),((30,10),(30,20))})
+# planner = RoutePlanner(environment)
+# print(planner.Path((0,0),(100,10)))
+# print(planner.Order((0,0),[(50,100),(100,10),(101,51)]))
@@ -0,0 +1,456 @@
+import asyncio,itertools,json,math,os,subprocess,sys,time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import matplotlib
+matplotlib.use("Agg") # sessions never draw, but the modules import pyplot
+from util_class import ClassInitial,NullInitial
+from util_display import Displayable
+from util_log import JSONValue
+from agent_configuration import Simulate
+from experiment_runner import Build
+from wall_environment import WallEnvironment,BodyEnvironment,MiddleEnvironment,TopEnvironment,Lidar
+
+"""
+# Simulation Sessions
+- A session is one simulation hosted by the service, driven by requests: {"op":...,"session":id,...}.
+- "stock" and "fuel" sessions are an agent and its environment in a Simulate (built as experiment_runner builds its runs):
+  step runs the agent for n steps, act applies the client's own actions ({"buy":n}) instead of the agent's.
+- "robot" sessions are a WallEnvironment with the body, middle and top layers:
+  act applies body actions ({"steer":"left"}), go_to runs MiddleEnvironment.Do and visit runs TopEnvironment.Do.
+- Every reply carries the perceptions produced since the previous reply as one batch of columns (see Batch), so a client
+  that steps one at a time and one that runs 10000 steps read them the same way; perceptions re-reads any part of the history.
+- Cost(request) estimates the work of a request in steps, so the service can run the small ones on its event loop.
+"""
+
+def Batch(columns:dict,start:int,end:int)->dict:
+  """
+  rows [start,end) of the history columns, as lists
+  """
+  return {"from":start,"count":max(end-start,0),"columns":{name:values[start:end].tolist() for name,values in columns.items()}}
+
+class AgentSession(object):
+  def __init__(self,kind:str,seed:int|None=None,parameters:dict|None=None)->ClassInitial:
+    agent,environment = Build(kind,parameters or {},seed)
+    self.simulation = Simulate(agent,environment)
+    self.sent = 0 # rows of the history already sent back
+    self.lock = asyncio.Lock() # the requests of a session run one at a time
+  def Cost(self,request:dict)->int|float:
+    if request["op"] == "step":
+      return request.get("steps",1)
+    if request["op"] == "act":
+      return len(request["actions"])
+    return 0
+  def Handle(self,request:dict)->dict:
+    op = request["op"]
+    if op == "step":
+      self.simulation.Go(request.get("steps",1))
+    elif op == "act":
+      self.simulation.Apply(request["actions"])
+    elif op == "perceptions":
+      return self.Perceptions(request.get("since",0),request.get("limit"))
+    else:
+      raise ValueError(f"[Unknown operation for this session]::{op}")
+    return self.Perceptions()
+  def Perceptions(self,since:int|None=None,limit:int|None=None)->dict:
+    """
+    the perceptions since the previous reply (since=None), or from row since of the history (row 0 is the initial perception)
+    """
+    history = self.simulation.perceptionHistory
+    start = self.sent if since is None else since
+    end = len(history) if limit is None else min(len(history),start+limit)
+    if since is None:
+      self.sent = end
+    return {"steps":self.simulation.steps,"batch":Batch(history.View(),start,end)}
+
+class RobotSession(object):
+  def __init__(self,kind:str="robot",seed:int|None=None,parameters:dict|None=None)->ClassInitial:
+    """
+    parameters: walls ([[x0,y0],[x1,y1]] each), position ([x,y,direction]), locations ({name:[x,y]}), timeout and lidar (a number of rays)
+    """
+    parameters = parameters or {}
+    walls = {tuple(tuple(point) for point in wall) for wall in parameters.get("walls",())}
+    lidar = Lidar(parameters["lidar"]) if parameters.get("lidar") else None
+    self.body = BodyEnvironment(WallEnvironment(walls),initPosition=tuple(parameters.get("position",(0,0,90))),lidar=lidar)
+    self.middle = MiddleEnvironment(self.body)
+    top = {"timeout":parameters.get("timeout",200)}
+    if "locations" in parameters:
+      top["locations"] = {name:tuple(position) for name,position in parameters["locations"].items()}
+    self.top = TopEnvironment(self.middle,**top)
+    self.top.maxDisplay = 0 # the arrivals go back in the replies
+    self.sent = 0
+    self.lock = asyncio.Lock()
+  def Cost(self,request:dict)->int|float:
+    if request["op"] == "act":
+      return len(request["actions"])
+    if request["op"] == "perceptions":
+      return 0
+    return math.inf # a go_to or visit can take any number of steps
+  def Handle(self,request:dict)->dict:
+    op = request["op"]
+    result = {}
+    if op == "act":
+      for action in request["actions"]:
+        self.middle.perception = self.body.Do(action)
+    elif op == "go_to":
+      result = self.middle.Do({"go_to":tuple(request["target"]),"timeout":request.get("timeout",self.top.timeout)})
+    elif op == "visit":
+      unknown = [loc for loc in request["plan"]["visit"] if loc not in self.top.locations]
+      if unknown:
+        raise ValueError(f"[Unknown locations]::{unknown}")
+      result = self.top.Do(request["plan"])
+    elif op == "perceptions":
+      return self.Perceptions(request.get("since",0),request.get("limit"))
+    else:
+      raise ValueError(f"[Unknown operation for this session]::{op}")
+    result.update(self.Perceptions())
+    return result
+  def Perceptions(self,since:int|None=None,limit:int|None=None)->dict:
+    """
+    the positions since the previous reply (since=None), or from row since of the path, with the latest perception
+    """
+    path = self.body.history
+    start = self.sent if since is None else since
+    end = len(path) if limit is None else min(len(path),start+limit)
+    if since is None:
+      self.sent = end
+    return {
+      "steps":self.body.steps,
+      "perception":self.middle.perception,
+      "batch":Batch({"xPos":path[:,0],"yPos":path[:,1]},start,end)
+    }
+
+sessionKinds = {
+  # kind -> session class
+  "stock":AgentSession,
+  "fuel":AgentSession,
+  "robot":RobotSession
+}
+
+"""
+# Simulation Service
+- An asyncio server for other processes: requests and replies are JSON objects, one per line, over TCP (host,port) or a Unix socket (path).
+- Every request has an "op" and may have an "id", which is copied into its reply. The requests of a connection run concurrently,
+  so replies can come back out of order, but the requests of one session run one at a time in the order they arrived.
+- Ops: create (kind, seed, parameters) -> session; step, act, go_to, visit and perceptions on a session; run streams a long run
+  back as one reply per batch of steps (the last has "done":true); close; stats.
+- Stepping runs on a thread pool, so the event loop keeps reading and answering while a long MiddleEnvironment.Do runs.
+  A request of at most inlineSteps steps runs on the loop itself, since handing it to a thread costs more than the steps.
+- Errors are replied as {"ok":false,"error":...}; the connection and the other sessions carry on.
+"""
+class SimulationService(Displayable):
+  lineLimit = 2**24 # longest request or reply line, in bytes
+  def __init__(self,workers:int=4,inlineSteps:int=32,batchSize:int=1000,maxSessions:int=100000)->ClassInitial:
+    self.executor = ThreadPoolExecutor(max_workers=workers,thread_name_prefix="simulation")
+    self.inlineSteps = inlineSteps
+    self.batchSize = batchSize # steps per streamed reply of a run
+    self.maxSessions = maxSessions
+    self.sessions = {}
+    self.ids = itertools.count(1)
+    self.counters = {"requests":0,"inline":0,"pooled":0,"errors":0}
+    self.started = time.time()
+    self.server = None
+  async def Start(self,host:str="127.0.0.1",port:int=8765,path:str|None=None)->ClassInitial:
+    if path is not None:
+      self.server = await asyncio.start_unix_server(self.Connection,path,limit=self.lineLimit)
+    else:
+      self.server = await asyncio.start_server(self.Connection,host,port,limit=self.lineLimit)
+    self.display(1,"Serving on",path if path is not None else f"{host}:{port}")
+    return self.server
+  async def Serve(self,host:str="127.0.0.1",port:int=8765,path:str|None=None)->None|NullInitial:
+    server = await self.Start(host,port,path)
+    try:
+      async with server:
+        await server.serve_forever()
+    finally:
+      self.executor.shutdown(wait=False,cancel_futures=True)
+  async def Connection(self,reader:ClassInitial,writer:ClassInitial)->None|NullInitial:
+    lock = asyncio.Lock() # one drain at a time
+    tasks = set()
+    try:
+      while True:
+        try:
+          line = await reader.readline()
+        except ValueError: # longer than lineLimit
+          await self.Send(writer,lock,{"id":None,"ok":False,"error":f"[Request longer than]::{self.lineLimit}"})
+          break
+        if not line:
+          break
+        task = asyncio.create_task(self.Answer(line,writer,lock))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+      if tasks:
+        await asyncio.gather(*tasks,return_exceptions=True)
+    except ConnectionError:
+      pass
+    finally:
+      writer.close()
+  async def Send(self,writer:ClassInitial,lock:ClassInitial,reply:dict)->None|NullInitial:
+    writer.write(json.dumps(reply,default=JSONValue).encode()+b"\n")
+    async with lock:
+      try:
+        await writer.drain()
+      except ConnectionError:
+        pass # the client went away; its sessions stay until closed
+  async def Answer(self,line:bytes,writer:ClassInitial,lock:ClassInitial)->None|NullInitial:
+    reply = {"id":None}
+    try:
+      request = json.loads(line)
+      if not isinstance(request,dict):
+        raise ValueError(f"[Request must be a JSON object]::{line[:80]}")
+      reply["id"] = request.get("id")
+      self.counters["requests"] += 1
+      if request.get("op") == "run":
+        await self.Run(request,writer,lock)
+        return
+      reply.update(await self.Handle(request))
+      reply["ok"] = True
+    except Exception as error: # any failure of a request goes back to its client
+      self.counters["errors"] += 1
+      reply.update(ok=False,error=f"{type(error).__name__}: {error}",done=True)
+    await self.Send(writer,lock,reply)
+  async def Handle(self,request:dict)->dict:
+    op = request.get("op")
+    if op == "create":
+      return self.Create(request.get("kind","stock"),request.get("seed"),request.get("parameters"))
+    if op == "stats":
+      return self.Stats()
+    session = self.Session(request)
+    async with session.lock:
+      if op == "close":
+        del self.sessions[request["session"]]
+        return {"closed":request["session"]}
+      return await self.Execute(session,request)
+  async def Execute(self,session:ClassInitial,request:dict)->dict:
+    """
+    runs the request on the loop when it is small, else on the pool
+    """
+    if session.Cost(request) <= self.inlineSteps:
+      self.counters["inline"] += 1
+      return session.Handle(request)
+    self.counters["pooled"] += 1
+    return await asyncio.get_running_loop().run_in_executor(self.executor,session.Handle,request)
+  async def Run(self,request:dict,writer:ClassInitial,lock:ClassInitial)->None|NullInitial:
+    """
+    {'op':'run','session':id,'steps':n,'batch':b} steps the agent n times, replying after every b steps
+    """
+    session = self.Session(request)
+    steps,batch = request["steps"],request.get("batch",self.batchSize)
+    if steps < 1 or batch < 1:
+      raise ValueError(f"[Steps and batch must be positive]::{(steps,batch)}")
+    done = 0
+    async with session.lock:
+      while done < steps:
+        count = min(batch,steps-done)
+        reply = await self.Execute(session,{"op":"step","steps":count})
+        done += count
+        reply.update(id=request.get("id"),ok=True,done=done >= steps)
+        await self.Send(writer,lock,reply)
+  def Create(self,kind:str,seed:int|None,parameters:dict|None)->dict:
+    if kind not in sessionKinds:
+      raise ValueError(f"[Unknown session kind]::{kind}")
+    if len(self.sessions) >= self.maxSessions:
+      raise ValueError(f"[Too many sessions]::{self.maxSessions}")
+    ident = next(self.ids)
+    self.sessions[ident] = sessionKinds[kind](kind,seed,parameters)
+    return {"session":ident}
+  def Session(self,request:dict)->ClassInitial:
+    session = self.sessions.get(request.get("session"))
+    if session is None:
+      raise ValueError(f"[Unknown session]::{request.get('session')}")
+    return session
+  def Stats(self)->dict:
+    return {"sessions":len(self.sessions),"uptime":time.time()-self.started,**self.counters}
+
+"""
+# Service Client
+- A client over one connection: Request sends a request and waits for its reply, Stream yields the replies of a run.
+- Requests are matched to replies by id, so many coroutines can share one connection with their requests in flight together.
+- A reply with "ok":false raises ValueError.
+"""
+class ServiceClient(object):
+  def __init__(self,reader:ClassInitial,writer:ClassInitial)->ClassInitial:
+    self.reader = reader
+    self.writer = writer
+    self.ids = itertools.count(1)
+    self.pending = {} # id -> future of the reply, or queue of the replies of a run
+    self.listener = asyncio.create_task(self.Listen())
+  @classmethod
+  async def Open(cls,host:str="127.0.0.1",port:int=8765,path:str|None=None)->ClassInitial:
+    if path is not None:
+      reader,writer = await asyncio.open_unix_connection(path,limit=SimulationService.lineLimit)
+    else:
+      reader,writer = await asyncio.open_connection(host,port,limit=SimulationService.lineLimit)
+    return cls(reader,writer)
+  async def Listen(self)->None|NullInitial:
+    try:
+      while True:
+        line = await self.reader.readline()
+        if not line:
+          break
+        reply = json.loads(line)
+        waiter = self.pending.get(reply.get("id"))
+        if isinstance(waiter,asyncio.Queue):
+          waiter.put_nowait(reply)
+        elif waiter is not None:
+          del self.pending[reply["id"]]
+          waiter.set_result(reply)
+    except ConnectionError:
+      pass
+    finally:
+      for waiter in self.pending.values():
+        if isinstance(waiter,asyncio.Queue):
+          waiter.put_nowait(None)
+        elif not waiter.done():
+          waiter.set_exception(ConnectionError("[Service connection closed]"))
+      self.pending = {}
+  async def Send(self,op:str,fields:dict,waiter:ClassInitial)->int:
+    ident = next(self.ids)
+    self.pending[ident] = waiter
+    self.writer.write(json.dumps({"id":ident,"op":op,**fields}).encode()+b"\n")
+    await self.writer.drain()
+    return ident
+  async def Request(self,op:str,**fields)->dict:
+    future = asyncio.get_running_loop().create_future()
+    await self.Send(op,fields,future)
+    reply = await future
+    if not reply["ok"]:
+      raise ValueError(f"[Service error]::{reply['error']}")
+    return reply
+  async def Stream(self,op:str="run",**fields)->ClassInitial:
+    queue = asyncio.Queue()
+    ident = await self.Send(op,fields,queue)
+    try:
+      while True:
+        reply = await queue.get()
+        if reply is None:
+          raise ConnectionError("[Service connection closed]")
+        if not reply["ok"]:
+          raise ValueError(f"[Service error]::{reply['error']}")
+        yield reply
+        if reply["done"]:
+          break
+    finally:
+      self.pending.pop(ident,None)
+  async def Close(self)->None|NullInitial:
+    self.writer.close()
+    await self.listener
+
+"""
+# Load Test
+- Opens `sessions` stock (or fuel) sessions spread over `connections` connections, and every session sends `rounds` step requests
+  of `steps` steps, one after the other; the latency of a request is the time from sending it to reading its reply.
+- With robots > 0, that many robot sessions keep visiting locations on a walled map at the same time, so the step latencies show
+  whether long MiddleEnvironment.Do calls hold the other sessions up.
+- Reports the p50, p99 and largest latency in milliseconds and the steps per second of the whole test.
+"""
+robotMap = {
+  "walls":[[[10,-11],[10,0]],[[10,50],[10,31]],[[30,-10],[30,0]],[[30,10],[30,20]]],
+  "position":[0,0,90]
+}
+
+async def LoadTest(host:str="127.0.0.1",port:int=8765,path:str|None=None,sessions:int=1000,connections:int=50,rounds:int=20,steps:int=1,
+  kind:str="stock",robots:int=0,seed:int=0)->dict:
+  clients = [await ServiceClient.Open(host,port,path) for idx in range(connections)]
+  latencies = []
+  visits = [0]
+  finished = asyncio.Event()
+  async def Drive(index:int)->None|NullInitial:
+    client = clients[index%connections]
+    session = (await client.Request("create",kind=kind,seed=seed+index))["session"]
+    for idx in range(rounds):
+      start = time.perf_counter()
+      await client.Request("step",session=session,steps=steps)
+      latencies.append(time.perf_counter()-start)
+    await client.Request("close",session=session)
+  async def Roam(index:int)->None|NullInitial:
+    client = clients[index%connections]
+    session = (await client.Request("create",kind="robot",parameters=robotMap))["session"]
+    while not finished.is_set():
+      await client.Request("visit",session=session,plan={"visit":["o109","storage","o109","o103","mail"]})
+      visits[0] += 1
+    await client.Request("close",session=session)
+  roaming = [asyncio.create_task(Roam(index)) for index in range(robots)]
+  start = time.perf_counter()
+  await asyncio.gather(*(Drive(index) for index in range(sessions)))
+  seconds = time.perf_counter()-start
+  finished.set()
+  await asyncio.gather(*roaming)
+  stats = await clients[0].Request("stats")
+  for client in clients:
+    await client.Close()
+  milliseconds = np.array(latencies)*1000
+  return {
+    "sessions":sessions,
+    "requests":len(latencies),
+    "seconds":seconds,
+    "stepsPerSecond":len(latencies)*steps/seconds,
+    "p50":float(np.percentile(milliseconds,50)),
+    "p99":float(np.percentile(milliseconds,99)),
+    "max":float(milliseconds.max()),
+    "robotVisits":visits[0],
+    "service":{name:stats[name] for name in ("requests","inline","pooled","errors")}
+  }
+
+async def WaitForService(host:str,port:int,path:str|None,seconds:float=10)->None|NullInitial:
+  deadline = time.perf_counter()+seconds
+  while True:
+    try:
+      client = await ServiceClient.Open(host,port,path)
+      await client.Close()
+      return
+    except OSError:
+      if time.perf_counter() > deadline:
+        raise
+      await asyncio.sleep(0.05)
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description="asyncio service hosting simulation sessions, and its load test")
+  parser.add_argument("mode",choices=("serve","load"))
+  parser.add_argument("--host",default="127.0.0.1")
+  parser.add_argument("--port",type=int,default=8765)
+  parser.add_argument("--unix",default=None,help="a Unix socket path instead of TCP")
+  parser.add_argument("--workers",type=int,default=4,help="threads that run the long requests (serve)")
+  parser.add_argument("--inline-steps",type=int,default=32,help="requests of up to this many steps run on the event loop (serve)")
+  parser.add_argument("--sessions",type=int,default=1000)
+  parser.add_argument("--connections",type=int,default=50)
+  parser.add_argument("--rounds",type=int,default=20)
+  parser.add_argument("--steps",type=int,default=1,help="steps per request (load)")
+  parser.add_argument("--kind",default="stock",choices=("stock","fuel"))
+  parser.add_argument("--robots",type=int,default=0,help="robot sessions visiting locations during the load test")
+  parser.add_argument("--spawn",action="store_true",help="start a service in a child process for the load test")
+  arguments = parser.parse_args()
+  if arguments.mode == "serve":
+    service = SimulationService(arguments.workers,arguments.inline_steps)
+    try:
+      asyncio.run(service.Serve(arguments.host,arguments.port,arguments.unix))
+    except KeyboardInterrupt:
+      pass
+  else:
+    child = None
+    if arguments.spawn:
+      command = [sys.executable,os.path.abspath(__file__),"serve","--host",arguments.host,"--port",str(arguments.port),"--workers",str(arguments.workers)]
+      if arguments.unix is not None:
+        command += ["--unix",arguments.unix]
+      child = subprocess.Popen(command)
+    try:
+      if child is not None:
+        asyncio.run(WaitForService(arguments.host,arguments.port,arguments.unix))
+      result = asyncio.run(LoadTest(arguments.host,arguments.port,arguments.unix,arguments.sessions,arguments.connections,
+        arguments.rounds,arguments.steps,arguments.kind,arguments.robots))
+      print(json.dumps(result,indent=1))
+    finally:
+      if child is not None:
+        child.terminate()
+        child.wait()
+
+#UNIT TEST
+# python simulation_service.py load --spawn --sessions 1000 --robots 4
+# async def Demo():
+#   client = await ServiceClient.Open()
+#   session = (await client.Request("create",kind="stock",seed=7))["session"]
+#   print(await client.Request("step",session=session,steps=3))
+#   async for reply in client.Stream("run",session=session,steps=5000,batch=1000):
+#     print(reply["steps"],reply["batch"]["count"])
+#   await client.Close()
+# asyncio.run(Demo())
@@ -1,10 +1,30 @@
 from util_class import ClassInitial
+from util_log import FieldText
 
 class Displayable(object):
   maxDisplay:ClassInitial|int = 1
+  channel:ClassInitial = None # a LogChannel (see util_log); when set, the records go to its sinks instead of being printed
+  profiler:ClassInitial = None # a Profiler (see util_profile); when set, the simulation loops time their phases into it
   def display(self,level:int,*args,**nargs)->None:
     """
     if level is less than or equal to the current maximum display level [maxDisplay]
     """
     if level <= self.maxDisplay:
-      print(*args,**nargs)
+      if self.channel is None:
+        print(*args,**nargs)
+      else:
+        self.channel.Message(level,type(self).__name__,args,nargs.get("end","\n"))
+  def Displaying(self,level:int)->bool:
+    """
+    true if a message of this level would be shown; check it once before a loop and skip building the messages when false
+    """
+    return level <= self.maxDisplay
+  def Event(self,level:int,name:str,**fields)->None:
+    """
+    a structured record: printed as "Key: value [::] Key: value", or sent to the channel with its fields
+    """
+    if level <= self.maxDisplay:
+      if self.channel is None:
+        print(FieldText(fields))
+      else:
+        self.channel.Event(level,type(self).__name__,name,fields)
@@ -0,0 +1,168 @@
+import math
+import numpy as np
+from util_class import ClassInitial
+
+"""
+# Segment Geometry
+- Shared segment-intersection kernels for the wall environment and the intersection exercise.
+- A line segment is a pair of points ((x0,y0),(x1,y1)); a set of N segments is a float array of shape (N,2,2).
+- SegmentsIntersect tests one pair in plain Python; the other kernels test many segments at once with NumPy.
+- All kernels use the same formula, so a pair gets the same answer whichever kernel tests it.
+- Parallel segments never intersect, unless collinear=True is given: then collinear segments that overlap or touch intersect too.
+"""
+
+def SegmentArray(segments:ClassInitial)->np.ndarray:
+  """
+  returns the segments as a float array of shape (N,2,2)
+  """
+  return np.asarray(segments,dtype=float).reshape(-1,2,2)
+
+def SegmentsIntersect(lineA:tuple,lineB:tuple,collinear:bool=False)->bool:
+  """
+  returns true if the line segments, line-A and line-B intersect
+  """
+  ((Ax0,Ay0),(Ax1,Ay1)) = lineA
+  ((Bx0,By0),(Bx1,By1)) = lineB
+  dA,dB = Ax1-Ax0,Bx1-Bx0
+  eA,eB = Ay1-Ay0,By1-By0
+  angleSeg = dB*eA-eB*dA
+  numeratorB = dA*(By0-Ay0)-eA*(Bx0-Ax0)
+  numeratorA = dB*(By0-Ay0)-eB*(Bx0-Ax0)
+  if angleSeg == 0:
+    # line segments are parallel; collinear ones intersect when their bounding boxes overlap
+    return (
+      collinear and numeratorA == 0 and numeratorB == 0
+      and max(min(Ax0,Ax1),min(Bx0,Bx1)) <= min(max(Ax0,Ax1),max(Bx0,Bx1))
+      and max(min(Ay0,Ay1),min(By0,By1)) <= min(max(Ay0,Ay1),max(By0,By1))
+    )
+  cB = numeratorB/angleSeg # position along line B
+  if cB < 0 or cB > 1:
+    return False
+  cA = numeratorA/angleSeg # position along line A
+  return 0 <= cA <= 1
+
+def SegmentParameters(segmentsA:np.ndarray,segmentsB:np.ndarray,collinear:bool=False)->tuple:
+  """
+  tests the segments of A against the segments of B, pairing them by broadcasting
+  returns (hit,position) where position is the fraction along A of the first point shared with B
+  """
+  Ax0,Ay0,Ax1,Ay1 = segmentsA[...,0,0],segmentsA[...,0,1],segmentsA[...,1,0],segmentsA[...,1,1]
+  Bx0,By0,Bx1,By1 = segmentsB[...,0,0],segmentsB[...,0,1],segmentsB[...,1,0],segmentsB[...,1,1]
+  dA,dB = Ax1-Ax0,Bx1-Bx0
+  eA,eB = Ay1-Ay0,By1-By0
+  angleSeg = dB*eA-eB*dA
+  numeratorB = dA*(By0-Ay0)-eA*(Bx0-Ax0)
+  numeratorA = dB*(By0-Ay0)-eB*(Bx0-Ax0)
+  parallel = angleSeg == 0
+  with np.errstate(divide="ignore",invalid="ignore"):
+    cB = numeratorB/angleSeg # position along line B
+    cA = numeratorA/angleSeg # position along line A
+  hit = ~parallel&(cB >= 0)&(cB <= 1)&(cA >= 0)&(cA <= 1)
+  position = np.where(hit,cA,np.inf)
+  if collinear:
+    overlap = (
+      parallel&(numeratorA == 0)&(numeratorB == 0)
+      &(np.maximum(np.minimum(Ax0,Ax1),np.minimum(Bx0,Bx1)) <= np.minimum(np.maximum(Ax0,Ax1),np.maximum(Bx0,Bx1)))
+      &(np.maximum(np.minimum(Ay0,Ay1),np.minimum(By0,By1)) <= np.minimum(np.maximum(Ay0,Ay1),np.maximum(By0,By1)))
+    )
+    if overlap.any():
+      # the first shared point is the nearest end of B projected onto A, clipped to A
+      lengthSquared = dA*dA+eA*eA
+      with np.errstate(divide="ignore",invalid="ignore"):
+        t0 = ((Bx0-Ax0)*dA+(By0-Ay0)*eA)/lengthSquared
+        t1 = ((Bx1-Ax0)*dA+(By1-Ay0)*eA)/lengthSquared
+      start = np.where(lengthSquared > 0,np.clip(np.minimum(t0,t1),0,1),0)
+      hit = hit|overlap
+      position = np.where(overlap,start,position)
+  return hit,position
+
+def PointSegmentDistances(points:np.ndarray,segments:np.ndarray)->np.ndarray:
+  """
+  distance from each (...,2) point to the (...,2,2) segment paired with it by broadcasting
+  """
+  start,end = segments[...,0,:],segments[...,1,:]
+  direction = end-start
+  lengthSquared = (direction*direction).sum(axis=-1)
+  with np.errstate(divide="ignore",invalid="ignore"):
+    t = ((points-start)*direction).sum(axis=-1)/lengthSquared
+  t = np.where(lengthSquared > 0,np.clip(t,0,1),0)
+  nearest = start+t[...,None]*direction
+  return np.hypot(points[...,0]-nearest[...,0],points[...,1]-nearest[...,1])
+
+def SegmentDistances(segmentsA:np.ndarray,segmentsB:np.ndarray)->np.ndarray:
+  """
+  shortest distance between the segments of A and B paired by broadcasting (0 where they intersect)
+  """
+  hit,_ = SegmentParameters(segmentsA,segmentsB,collinear=True)
+  distance = np.minimum(
+    np.minimum(PointSegmentDistances(segmentsA[...,0,:],segmentsB),PointSegmentDistances(segmentsA[...,1,:],segmentsB)),
+    np.minimum(PointSegmentDistances(segmentsB[...,0,:],segmentsA),PointSegmentDistances(segmentsB[...,1,:],segmentsA))
+  )
+  return np.where(hit,0.0,distance)
+
+def IntersectOneToMany(segment:tuple,segments:ClassInitial,collinear:bool=False)->np.ndarray:
+  """
+  returns a boolean array telling which of the segments intersect the given segment
+  """
+  hit,_ = SegmentParameters(SegmentArray(segment)[0],SegmentArray(segments),collinear)
+  return hit
+
+def IntersectManyToMany(segmentsA:ClassInitial,segmentsB:ClassInitial,allPairs:bool=False,collinear:bool=False)->np.ndarray:
+  """
+  pairs the i-th segment of A with the i-th segment of B and returns an array of shape (N,)
+  with allPairs every segment of A is tested against every segment of B and an array of shape (N,M) is returned
+  """
+  segmentsA,segmentsB = SegmentArray(segmentsA),SegmentArray(segmentsB)
+  if allPairs:
+    segmentsA = segmentsA[:,None]
+  elif len(segmentsA) != len(segmentsB):
+    raise ValueError(f"[Segment counts differ]::{len(segmentsA)} and {len(segmentsB)}")
+  hit,_ = SegmentParameters(segmentsA,segmentsB,collinear)
+  return hit
+
+def FirstHit(segment:tuple,segments:ClassInitial,collinear:bool=False)->tuple:
+  """
+  returns (index,distance) of the segment hit first when travelling along the given segment
+  returns (-1,inf) when nothing is hit
+  """
+  segment = SegmentArray(segment)[0]
+  _,position = SegmentParameters(segment,SegmentArray(segments),collinear)
+  if len(position) == 0:
+    return -1,math.inf
+  index = int(np.argmin(position))
+  if math.isinf(position[index]):
+    return -1,math.inf
+  (x0,y0),(x1,y1) = segment
+  return index,float(position[index])*math.hypot(x1-x0,y1-y0)
+
+def FirstHits(segmentsA:ClassInitial,segmentsB:ClassInitial,collinear:bool=False,chunkSize:int=1<<20)->tuple:
+  """
+  FirstHit for every segment of A against all the segments of B
+  returns (indices,distances) arrays of shape (N,), using -1 and inf where nothing is hit
+  the pairs are tested in chunks of about chunkSize to bound the memory used
+  """
+  segmentsA,segmentsB = SegmentArray(segmentsA),SegmentArray(segmentsB)
+  indices = np.full(len(segmentsA),-1,dtype=np.int64)
+  distances = np.full(len(segmentsA),np.inf)
+  if len(segmentsA) == 0 or len(segmentsB) == 0:
+    return indices,distances
+  lengths = np.hypot(segmentsA[:,1,0]-segmentsA[:,0,0],segmentsA[:,1,1]-segmentsA[:,0,1])
+  rows = max(1,chunkSize//len(segmentsB))
+  for start in range(0,len(segmentsA),rows):
+    chunk = slice(start,start+rows)
+    _,position = SegmentParameters(segmentsA[chunk,None],segmentsB,collinear)
+    nearest = np.argmin(position,axis=1)
+    first = position[np.arange(len(nearest)),nearest]
+    found = np.isfinite(first)
+    indices[chunk] = np.where(found,nearest,-1)
+    distances[chunk] = np.where(found,first*lengths[chunk],np.inf)
+  return indices,distances
+
+#UNIT TEST
+# walls = SegmentArray([((20,0),(30,20)),((70,-5),(70,25)),((0,5),(10,5))])
+# print(SegmentsIntersect(((0,0),(1,1)),((1,0),(0,1))))
+# print(IntersectOneToMany(((0,0),(100,10)),walls))
+# print(IntersectManyToMany(walls,walls,allPairs=True,collinear=True))
+# print(FirstHit(((0,0),(100,10)),walls))
+# print(FirstHits([((0,0),(100,10)),((0,0),(0,10))],walls))
+# print(SegmentDistances(SegmentArray(((0,0),(100,10)))[0],walls))
@@ -0,0 +1,137 @@
+import collections,json,sys,time
+from util_class import ClassInitial,NullInitial
+
+"""
+# Log Channel
+- A channel receives log records from Displayable objects (display and Event) and hands them to its sinks.
+- A record is a tuple (time,level,source,name,args,fields): display gives the printed arguments (args), Event gives a name and keyword fields.
+- Records are formatted by the sinks that write them, never on the way in.
+- Nothing is formatted when a record is dropped by the level check; callers hoist Displaying(level) out of their loops,
+  so a disabled level costs one comparison per loop instead of one f-string per step.
+- Sinks buffer and write in batches: RingSink keeps the last records in memory (unformatted, the fields by reference),
+  JSONLSink writes one JSON object per line and StdoutSink prints the same text display would print.
+- Counters and gauges (Count,Gauge) collect metrics next to the records; Metrics returns them.
+"""
+
+def FieldText(fields:dict)->str:
+  """
+  renders fields as "Key: value [::] Key: value", the style of the messages of this project
+  """
+  return " [::] ".join(f"{key[:1].upper()}{key[1:]}: {value}" for key,value in fields.items())
+
+def RecordText(record:tuple)->str:
+  when,level,source,name,args,fields = record
+  return " ".join(map(str,args)) if args is not None else FieldText(fields)
+
+class RingSink(object):
+  def __init__(self,capacity:int=10000)->ClassInitial:
+    self.records = collections.deque(maxlen=capacity)
+  def Emit(self,record:tuple)->None|NullInitial:
+    self.records.append(record)
+  def Records(self,name:str|None=None)->list:
+    return [record for record in self.records if name is None or record[3] == name]
+  def Flush(self)->None|NullInitial:
+    pass
+  def Close(self)->None|NullInitial:
+    pass
+
+class StdoutSink(object):
+  def __init__(self,batchSize:int=256,stream:ClassInitial=None)->ClassInitial:
+    self.batchSize = batchSize
+    self.stream = stream
+    self.buffer = []
+  def Emit(self,record:tuple)->None|NullInitial:
+    end = record[5].get("end","\n") if record[4] is not None else "\n"
+    self.buffer.append(RecordText(record)+end)
+    if len(self.buffer) >= self.batchSize:
+      self.Flush()
+  def Flush(self)->None|NullInitial:
+    if self.buffer:
+      stream = self.stream if self.stream is not None else sys.stdout
+      stream.write("".join(self.buffer))
+      stream.flush()
+      self.buffer = []
+  def Close(self)->None|NullInitial:
+    self.Flush()
+
+class JSONLSink(object):
+  def __init__(self,path:str,batchSize:int=1024)->ClassInitial:
+    self.batchSize = batchSize
+    self.handle = open(path,"a",encoding="utf-8")
+    self.buffer = []
+  def Emit(self,record:tuple)->None|NullInitial:
+    when,level,source,name,args,fields = record
+    entry = {"time":when,"level":level,"source":source,"name":name}
+    if args is not None:
+      entry["text"] = RecordText(record)
+    else:
+      entry.update(fields)
+    # fields are rendered now, so values changed in place later are logged as they were
+    self.buffer.append(json.dumps(entry,default=JSONValue))
+    if len(self.buffer) >= self.batchSize:
+      self.Flush()
+  def Flush(self)->None|NullInitial:
+    if self.buffer:
+      self.handle.write("\n".join(self.buffer)+"\n")
+      self.handle.flush()
+      self.buffer = []
+  def Close(self)->None|NullInitial:
+    if not self.handle.closed:
+      self.Flush()
+      self.handle.close()
+
+def JSONValue(value:ClassInitial)->ClassInitial:
+  """
+  converts NumPy values and other objects for json.dumps
+  """
+  if hasattr(value,"tolist"):
+    return value.tolist()
+  return str(value)
+
+class LogChannel(object):
+  def __init__(self,sinks:list|None=None,level:int=3)->ClassInitial:
+    """
+    level is the highest level the channel passes on (objects still filter with their own maxDisplay first)
+    """
+    self.sinks = sinks if sinks is not None else [StdoutSink()]
+    self.level = level
+    self.counters = {}
+    self.gauges = {}
+  def Enabled(self,level:int)->bool:
+    return level <= self.level
+  def Message(self,level:int,source:str,args:tuple,end:str="\n")->None|NullInitial:
+    if level <= self.level:
+      record = (time.time(),level,source,None,args,{"end":end} if end != "\n" else {})
+      for sink in self.sinks:
+        sink.Emit(record)
+  def Event(self,level:int,source:str,name:str,fields:dict)->None|NullInitial:
+    if level <= self.level:
+      record = (time.time(),level,source,name,None,fields)
+      for sink in self.sinks:
+        sink.Emit(record)
+  def Count(self,name:str,amount:int|float=1)->None|NullInitial:
+    self.counters[name] = self.counters.get(name,0)+amount
+  def Gauge(self,name:str,value:int|float)->None|NullInitial:
+    self.gauges[name] = value
+  def Metrics(self)->dict:
+    return {"counters":dict(self.counters),"gauges":dict(self.gauges)}
+  def Flush(self)->None|NullInitial:
+    for sink in self.sinks:
+      sink.Flush()
+  def Close(self)->None|NullInitial:
+    for sink in self.sinks:
+      sink.Close()
+  def __enter__(self)->ClassInitial:
+    return self
+  def __exit__(self,*exception)->None|NullInitial:
+    self.Close()
+
+#UNIT TEST
+# from util_display import Displayable
+# ring = RingSink(1000)
+# Displayable.channel = LogChannel([ring,JSONLSink("run.jsonl"),StdoutSink()])
+# Displayable.maxDisplay = 2
+# Displayable().Event(2,"step",count=0,action={"buy":12})
+# Displayable().display(1,"Arrived at","o109",{"arrived":True})
+# Displayable.channel.Close()
+# print(ring.Records("step"))
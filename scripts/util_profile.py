@@ -0,0 +1,129 @@
+import cProfile,io,os,pstats,sys,threading,time
+from util_class import ClassInitial,NullInitial
+
+"""
+# Profiler
+- Opt-in timers and counters for the simulation loops: set Displayable.profiler (or the profiler of one object) to a Profiler.
+- Every loop reads the profiler once before it starts; with no profiler each step only tests a local flag.
+- The steps are sampled: a loop times and counts one step in every `every` and weights it by every, so the totals are estimates
+  and the overhead is a few percent even for steps of a few microseconds (every=1 times every step exactly).
+  While a body step is timed, profiler.timing is true, so the wall queries and whisker hits of that step are counted too.
+- Phases are timed by chaining the clock: start = profiler.Add("phase",start,weight) adds the time since start and returns the new start,
+  so a step split into k phases costs k+1 clock readings.
+- Phase names are "layer.phase" (e.g. "simulate.agent", "body.collision"); the layers nest, so a layer's time includes the layers below it.
+- Counters (Count) record how much work was done: steps, collision tests, walls tested, whisker hits.
+- Report gives a summary table; Simulate.Go, FuelSimulation.Run and TopEnvironment.Do display it (level 1) at the end of the run.
+"""
+class Profiler(object):
+  def __init__(self,every:int=16)->ClassInitial:
+    if every < 1:
+      raise ValueError(f"[Sampling interval must be positive]::{every}")
+    self.every = every
+    self.clock = time.perf_counter_ns
+    self.timing = False # true while a sampled body step runs
+    self.Reset()
+  def Reset(self)->None|NullInitial:
+    self.times = {} # phase -> nanoseconds
+    self.calls = {} # phase -> number of times timed
+    self.counters = {}
+  def Add(self,phase:str,start:int,weight:int=1)->int:
+    """
+    adds the time since start (a reading of clock) to the phase, weight times (the sampling interval of a sampled step), and returns the current reading
+    """
+    now = self.clock()
+    self.times[phase] = self.times.get(phase,0)+(now-start)*weight
+    self.calls[phase] = self.calls.get(phase,0)+weight
+    return now
+  def Count(self,name:str,amount:int=1)->None|NullInitial:
+    self.counters[name] = self.counters.get(name,0)+amount
+  def Summary(self)->dict:
+    return {
+      "phases":{phase:{"seconds":self.times[phase]/1e9,"calls":self.calls[phase]} for phase in self.times},
+      "counters":dict(self.counters)
+    }
+  def Report(self)->str:
+    lines = [f"{'Phase':<28}{'Seconds':>10}{'Calls':>10}{'Microseconds/call':>20}"]
+    for phase in sorted(self.times):
+      seconds,calls = self.times[phase]/1e9,self.calls[phase]
+      lines.append(f"{phase:<28}{seconds:>10.4f}{calls:>10}{seconds*1e6/calls:>20.3f}")
+    for name in sorted(self.counters):
+      lines.append(f"{name:<28}{self.counters[name]:>10}")
+    return "\n".join(lines)
+
+def CProfile(function:ClassInitial,*args,sortBy:str="cumulative",lines:int=20,**nargs)->tuple:
+  """
+  runs function(*args,**nargs) under cProfile
+  returns (result,report) where report lists the top functions sorted by sortBy
+  """
+  profile = cProfile.Profile()
+  result = profile.runcall(function,*args,**nargs)
+  stream = io.StringIO()
+  pstats.Stats(profile,stream=stream).sort_stats(sortBy).print_stats(lines)
+  return result,stream.getvalue()
+
+"""
+# Sampler
+- A sampling profiler: a background thread looks at the stack of the profiled thread every interval seconds.
+- "own" counts the function running at the sample, "total" counts every function on the stack.
+- It costs nothing per call, so it can stay on for a whole run; the counts are statistical (at least a few hundred samples are needed).
+"""
+class Sampler(object):
+  def __init__(self,interval:float=0.005)->ClassInitial:
+    self.interval = interval
+    self.own = {}
+    self.total = {}
+    self.samples = 0
+    self.thread = None
+  def Start(self)->None|NullInitial:
+    self.target = threading.get_ident()
+    self.running = True
+    self.thread = threading.Thread(target=self.Run,daemon=True)
+    self.thread.start()
+  def Stop(self)->None|NullInitial:
+    self.running = False
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+  def Run(self)->None|NullInitial:
+    while self.running:
+      time.sleep(self.interval)
+      frame = sys._current_frames().get(self.target)
+      if frame is None:
+        continue
+      self.samples += 1
+      seen = set()
+      key = self.Key(frame)
+      self.own[key] = self.own.get(key,0)+1
+      while frame is not None:
+        key = self.Key(frame)
+        if key not in seen:
+          seen.add(key)
+          self.total[key] = self.total.get(key,0)+1
+        frame = frame.f_back
+  @staticmethod
+  def Key(frame:ClassInitial)->str:
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+  def Report(self,lines:int=15)->str:
+    rows = [f"Samples: {self.samples}",f"{'Function':<48}{'Own %':>8}{'Total %':>9}"]
+    for key in sorted(self.own,key=self.own.get,reverse=True)[:lines]:
+      rows.append(f"{key:<48}{100*self.own[key]/self.samples:>8.1f}{100*self.total[key]/self.samples:>9.1f}")
+    return "\n".join(rows)
+  def __enter__(self)->ClassInitial:
+    self.Start()
+    return self
+  def __exit__(self,*exception)->None|NullInitial:
+    self.Stop()
+
+#UNIT TEST
+# import random
+# from util_display import Displayable
+# from agent_configuration import Simulate
+# from buying_simulation import PSEnvironment,PSAgent
+# random.seed(0)
+# Displayable.profiler = Profiler()
+# environment = PSEnvironment()
+# simulation = Simulate(PSAgent(environment),environment)
+# with Sampler() as sampler:
+#   simulation.Go(100000)
+# print(sampler.Report())
+# print(CProfile(simulation.Go,1000,lines=10)[1])
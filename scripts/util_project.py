@@ -1,4 +1,5 @@
-import random,math
+import random,math,numbers
+import numpy as np
 from util_class import ClassInitial
 
 # The argmax method returns the index of an element that has the maximum value
@@ -16,40 +17,113 @@ def ArgMaxAll(generator:ClassInitial)->list:
       maxValues.append(element)
   return maxValues
 
-def ArgMaxRandom(generator:ClassInitial)->int|float:
+def ArgMaxRandom(generator:ClassInitial,rng:ClassInitial=None)->int|float:
   """
   if there are multiple elements with the max value, one is returned at random
+  the ties are reservoir-sampled while the generator is consumed, so no list of them is built
+  rng is anything with a random() method (the random module by default, a random.Random or a NumPy Generator)
   """
-  return random.choice(ArgMaxAll(generator))
+  if rng is None:
+    rng = random
+  chosen = None
+  ties = 0
+  maxValue = -math.inf
+  for (element,value) in generator:
+    if value > maxValue:
+      chosen,maxValue,ties = element,value,1
+    elif value == maxValue:
+      ties += 1
+      if rng.random()*ties < 1: # keeps each of the ties with probability 1/ties
+        chosen = element
+  if ties == 0:
+    raise IndexError("ArgMaxRandom of an empty sequence")
+  return chosen
+
+smallArray = 32 # below this length a 1-D array is faster as a list than through ArgMaxArray
 
-def ArgMax(lst:list)->int|float:
+def ArgMax(lst:list,rng:ClassInitial=None)->int|float:
   """
-  returns maximum index in a list
+  returns maximum index in a list (or a 1-D NumPy array)
   """
-  return ArgMaxRandom(enumerate(lst))
+  if isinstance(lst,np.ndarray):
+    if lst.ndim == 1 and lst.size < smallArray:
+      return ArgMaxRandom(enumerate(lst.tolist()),rng)
+    return ArgMaxArray(lst,rng)
+  return ArgMaxRandom(enumerate(lst),rng)
 
-def ArgMaxDictionary(dct:dict)->int|float:
+def ArgMaxDictionary(dct:dict,rng:ClassInitial=None)->int|float:
   """
   returns the arg max of a dictionary dct
   """
-  return ArgMaxRandom(dct.items())
+  return ArgMaxRandom(dct.items(),rng)
+
+"""
+# NumPy Fast Paths
+- ArgMaxArray is ArgMax for a 1-D array: the maximum and its ties are found by NumPy and one tie is picked at random.
+  NaNs are passed over, as the list path does (a NaN is never greater than or equal to anything).
+- ArgMaxRows does the same for every row of a 2-D array at once (e.g. the greedy action of every state of a Q-table).
+- ArgMax hands arrays shorter than smallArray to the list path instead: for a few values NumPy's call overhead is the larger cost.
+"""
+def ArgMaxArray(values:np.ndarray,rng:ClassInitial=None)->int:
+  """
+  returns the index of a maximal value of a 1-D array, ties broken at random
+  """
+  if rng is None:
+    rng = random
+  if values.size == 0:
+    raise IndexError("ArgMaxArray of an empty array")
+  maxValue = values.max()
+  if maxValue != maxValue: # NaN: fall back to the maximum of the other values
+    if np.isnan(values).all():
+      raise IndexError("ArgMaxArray of an all-NaN array")
+    maxValue = np.nanmax(values)
+  ties = np.flatnonzero(values == maxValue)
+  if len(ties) == 1:
+    return int(ties[0])
+  return int(ties[min(int(rng.random()*len(ties)),len(ties)-1)])
 
+def ArgMaxRows(table:np.ndarray,rng:ClassInitial=None)->np.ndarray:
+  """
+  returns the column of a maximal value of every row of a 2-D array, ties broken at random within each row
+  rng is a NumPy Generator (by default one seeded from the random module)
+  NaNs are passed over as in ArgMaxArray; a row of NaNs only raises IndexError
+  """
+  maxima = table.max(axis=1,keepdims=True)
+  if np.isnan(maxima).any():
+    if np.isnan(table).all(axis=1).any():
+      raise IndexError("ArgMaxRows of an all-NaN row")
+    maxima = np.nanmax(table,axis=1,keepdims=True)
+  ties = table == maxima # never true for a NaN
+  best = ties.argmax(axis=1)
+  tied = np.flatnonzero(ties.sum(axis=1) > 1)
+  if len(tied):
+    if rng is None:
+      rng = np.random.default_rng(random.getrandbits(64))
+    # every tied entry gets a random key, the largest key wins
+    keys = np.where(ties[tied],rng.random((len(tied),table.shape[1])),-1.0)
+    best[tied] = keys.argmax(axis=1)
+  return best
 
 # EXAMPLE
 #exampleList = [1,4,5,12,78]
 #exampleDictionary = {2:5,5:11,7:7}
 #print(ArgMax(exampleDictionary))
 #print(ArgMax(exampleList))
+#print(ArgMax(np.array([1,78,5,12,78]),rng=random.Random(3)))
+#print(ArgMaxRows(np.array([[1,2,2],[3,0,3]]),rng=np.random.default_rng(3)))
+#print(ArgMaxRows(np.array([[np.nan,1,2],[3,np.nan,0]]))) # [2 0]
+#print(ArgMax(np.array([np.nan,1,2,2])),ArgMax(np.arange(100.0))) # 2 or 3, 99
 
-def FlipRandom(probability:float)->bool:
+def FlipRandom(probability:float,rng:ClassInitial=None)->bool:
   """
   return true with probability prob
   """
-  return random.random() < probability
+  return (random.random() if rng is None else rng.random()) < probability
 
 # The probabilities should sum to 1 or more. If they sum to more than one, the excess is ignored.
-def SelectFromDistribution(itemDistribution:dict)->int|float:
-  randomReal = random.random()
+# Callers that sample the same distribution repeatedly should hold a DiscreteDistribution instead.
+def SelectFromDistribution(itemDistribution:dict,rng:ClassInitial=None)->int|float:
+  randomReal = random.random() if rng is None else rng.random()
   for (item,probability) in itemDistribution.items():
     if randomReal < probability:
       return item
@@ -57,6 +131,101 @@ def SelectFromDistribution(itemDistribution:dict)->int|float:
       randomReal -= probability
   raise RuntimeError(f"[Not a probability distribution]::{itemDistribution}")
 
+"""
+# Discrete Distribution
+- A distribution compiled once into Walker/Vose alias tables, so each sample costs O(1) whatever the number of items.
+- It follows SelectFromDistribution: the probabilities are taken in order and any excess over 1 is ignored.
+- Non-distributions (no items, negative or non-finite probabilities, a total below 1) are rejected when it is built, not when it is sampled.
+- Sample() draws one item with the random module; Sample(n) draws an array of n items with NumPy.
+- Select(uniforms) maps an array of uniform numbers to the items that Sample() would return for each of them.
+"""
+class DiscreteDistribution(object):
+  tolerance = 1e-9 # how far below 1 the total probability may be
+  def __init__(self,itemDistribution:dict)->ClassInitial:
+    if not itemDistribution:
+      raise ValueError(f"[Not a probability distribution]::{itemDistribution}")
+    items,probabilities = [],[]
+    remaining = 1.0
+    for (item,probability) in itemDistribution.items():
+      if not isinstance(probability,numbers.Real) or not math.isfinite(probability) or probability < 0:
+        raise ValueError(f"[Not a probability distribution]::{itemDistribution}")
+      items.append(item)
+      probabilities.append(min(float(probability),remaining))
+      remaining = max(remaining-probability,0.0)
+    if remaining > self.tolerance:
+      raise ValueError(f"[Not a probability distribution]::{itemDistribution}")
+    self.items = items
+    self.probabilities = [probability/sum(probabilities) for probability in probabilities]
+    self.BuildTables()
+  def BuildTables(self)->None:
+    """
+    Vose's alias method: column i keeps item i with probability accept[i], otherwise item alias[i]
+    """
+    count = len(self.items)
+    scaled = [probability*count for probability in self.probabilities]
+    self.accept = [1.0]*count
+    self.alias = list(range(count))
+    small = [idx for idx in range(count) if scaled[idx] < 1]
+    large = [idx for idx in range(count) if scaled[idx] >= 1]
+    while small and large:
+      less,more = small.pop(),large.pop()
+      self.accept[less] = scaled[less]
+      self.alias[less] = more
+      scaled[more] = scaled[more]+scaled[less]-1
+      (small if scaled[more] < 1 else large).append(more)
+    # whatever is left only differs from 1 by rounding
+    self.count = count
+    self.aliasItems = [self.items[idx] for idx in self.alias]
+    self.itemArray = np.asarray(self.items)
+    self.acceptArray = np.asarray(self.accept)
+    self.aliasArray = np.asarray(self.alias)
+  def Sample(self,n:int|None=None,rng:ClassInitial=None)->ClassInitial:
+    """
+    returns one item, or an array of n items when n is given
+    rng is anything with a random() method for one item (the random module by default, or a source of util_random)
+    and the NumPy generator used for n items (by default one seeded from the random module)
+    """
+    if n is None:
+      column = (random.random() if rng is None else rng.random())*self.count
+      idx = min(int(column),self.count-1) # guards against rounding up to count
+      if column-idx < self.accept[idx]:
+        return self.items[idx]
+      return self.aliasItems[idx]
+    if rng is None:
+      rng = np.random.default_rng(random.getrandbits(64))
+    columns = rng.integers(self.count,size=n)
+    keep = rng.random(n) < self.acceptArray[columns]
+    return self.itemArray[np.where(keep,columns,self.aliasArray[columns])]
+  sample = Sample
+  def Select(self,uniforms:np.ndarray)->np.ndarray:
+    scaled = uniforms*self.count
+    columns = np.minimum(scaled.astype(np.int64),self.count-1)
+    keep = scaled-columns < self.acceptArray[columns]
+    return self.itemArray[np.where(keep,columns,self.aliasArray[columns])]
 
+averagePowers = {} # (rate,chunk) -> the powers (1-rate)^1..(1-rate)^chunk
 
+def RunningAverages(start:float,values:np.ndarray,rate:float,chunk:int=256)->np.ndarray:
+  """
+  the averages a running update average += (value-average)*rate gives after each of the values, starting from start
+  in closed form, average_n = (1-rate)^n*start + rate*sum over k of (1-rate)^(n-k)*value_k, in chunks so the powers stay in range
+  agrees with the running update to rounding
+  """
+  powers = averagePowers.get((rate,chunk))
+  if powers is None:
+    powers = averagePowers[(rate,chunk)] = (1-rate)**np.arange(1,chunk+1)
+  averages = np.empty(len(values))
+  for begin in range(0,len(values),chunk):
+    part = values[begin:begin+chunk]
+    scale = powers[:len(part)]
+    averages[begin:begin+len(part)] = scale*(start+rate*np.cumsum(part/scale))
+    start = averages[begin+len(part)-1]
+  return averages
 
+#UNIT TEST
+# paperUsed = DiscreteDistribution({6:0.1,5:0.1,4:0.1,3:0.3,2:0.2,1:0.2})
+# print(paperUsed.Sample())
+# print(np.bincount(paperUsed.Sample(100000))/100000)
+# DiscreteDistribution({1:0.5,2:0.2}) # raises ValueError
+# weights = np.array([0.25,0.25,0.5],dtype=np.float32)
+# print(DiscreteDistribution(dict(enumerate(weights))).Sample(10))
@@ -0,0 +1,189 @@
+import functools,random
+import numpy as np
+from util_class import ClassInitial
+
+"""
+# Random Sources
+- Environments and agents draw their random numbers from a source passed in at construction (rng=...) instead of the random module.
+- A source has Random() (uniform in [0,1), also as random() so it fits every rng argument of util_project and q_learning),
+  Gauss() (standard normal), Integer(low,high) (both ends included, like random.randint), Choice(items) and Spawn(n).
+- GlobalRandom is the default: it draws from the random module, so random.seed(...) reproduces the runs exactly as before.
+- BlockRandom draws from a NumPy Generator seeded by a SeedSequence. The numbers are drawn in blocks (4096 at a time by default)
+  and handed out one by one, which costs a fraction of a random module call per number.
+  Every kind of draw has its own block, so a run is reproduced by its seed alone, whatever mix of draws it makes.
+- Spawn(n) returns n independent child sources (SeedSequence.spawn): give one to each run, worker or robot,
+  and the results no longer depend on how the runs are split between processes or in which order they run.
+- Snapshot/Restore capture and put back the state of a source, and Fork returns a copy that draws the same numbers from then on,
+  so a forked simulation sees the same future as the original until their actions differ.
+  GlobalRandom snapshots the random module itself. There is only one random module, so its Fork hands the copy a BlockRandom
+  seeded from it (like Spawn): the branch is independent and reproduced by random.seed(...), but it does not see the original's future.
+  For what-if runs that must share the future, give the run a seeded source.
+- Peek(n,*kinds) returns, as one array per kind, the numbers that n steps would draw if every step drew one of each kind in the given order
+  ("random", "gauss" or a (low,high) pair for Integer); Advance(n,*kinds) draws them. Between the two a caller can vectorise a stretch of steps
+  and then take only as many of them as it needs, and the numbers are those that stepping one at a time would have drawn.
+  BlockRandom slices its blocks (refilled in the order stepping would refill them); GlobalRandom steps the random module and, for Peek, puts its state back
+  (keeping the states it passed every few steps, so an Advance after it only draws the steps since the last of them).
+"""
+class GlobalRandom(object):
+  checkpointSteps = 64 # steps between the states a Peek keeps (getstate costs about as much as a dozen draws)
+  peeked = None # (kinds,n,states) of the last Peek: the states after 0,checkpointSteps,2*checkpointSteps... steps (and after all n)
+  def Random(self)->float:
+    return random.random()
+  random = Random
+  def Gauss(self)->float:
+    return random.gauss(0,1)
+  def Integer(self,low:int,high:int)->int:
+    return random.randint(low,high)
+  def Choice(self,items:list)->ClassInitial:
+    return random.choice(items)
+  def Advance(self,n:int,*kinds)->None:
+    peeked,self.peeked = self.peeked,None
+    if peeked is not None and peeked[0] == kinds and peeked[2][0] == random.getstate():
+      states = peeked[2]
+      if n == peeked[1]:
+        random.setstate(states[-1])
+        return
+      done = min(n,peeked[1])//self.checkpointSteps*self.checkpointSteps
+      random.setstate(states[done//self.checkpointSteps])
+      n -= done
+    self.Draws(n,kinds)
+  def Draws(self,n:int,kinds:tuple,states:list|None=None)->list:
+    """
+    n steps of draws, one column per kind; appends the state after every checkpointSteps steps and at the end to states
+    """
+    # the random module's own functions, as Random, Gauss and Integer call them (randint(low,high) is randrange(low,high+1))
+    draws = [random.random if kind == "random" else functools.partial(random.gauss,0,1) if kind == "gauss"
+      else functools.partial(random.randrange,kind[0],kind[1]+1) for kind in kinds]
+    rows = []
+    for start in range(0,n,self.checkpointSteps):
+      rows += [[draw() for draw in draws] for idx in range(min(self.checkpointSteps,n-start))]
+      if states is not None:
+        states.append(random.getstate())
+    columns = zip(*rows) if rows else [()]*len(kinds) # n == 0 has no rows to transpose
+    return [np.array(column,dtype=np.int64 if isinstance(kind,tuple) else float) for column,kind in zip(columns,kinds)]
+  def Peek(self,n:int,*kinds)->list:
+    state = random.getstate()
+    try:
+      states = [state]
+      draws = self.Draws(n,kinds,states)
+      self.peeked = (kinds,n,states)
+      return draws
+    finally:
+      random.setstate(state)
+  def Spawn(self,n:int)->list:
+    """
+    block sources seeded from the random module, so random.seed(...) also reproduces them
+    """
+    return BlockRandom(random.getrandbits(128)).Spawn(n)
+  def Snapshot(self)->tuple:
+    return random.getstate()
+  def Restore(self,snapshot:tuple)->None:
+    random.setstate(snapshot)
+  def Fork(self)->ClassInitial:
+    """
+    a block source seeded from the random module, so the fork does not share the one stream with the original
+    """
+    return BlockRandom(random.getrandbits(128))
+
+defaultRandom = GlobalRandom()
+
+class BlockRandom(object):
+  def __init__(self,seed:ClassInitial=None,blockSize:int=4096)->ClassInitial:
+    """
+    seed is an int, a SeedSequence or None (fresh entropy)
+    """
+    self.seedSequence = seed if isinstance(seed,np.random.SeedSequence) else np.random.SeedSequence(seed)
+    self.generator = np.random.default_rng(self.seedSequence)
+    self.blockSize = blockSize
+    # blocks are reversed lists, so the next number is popped from the end
+    self.uniforms = []
+    self.gaussians = []
+    self.integers = {} # (low,high) -> block
+  def Random(self)->float:
+    if not self.uniforms:
+      self.uniforms = self.generator.random(self.blockSize)[::-1].tolist()
+    return self.uniforms.pop()
+  random = Random
+  def Gauss(self)->float:
+    if not self.gaussians:
+      self.gaussians = self.generator.standard_normal(self.blockSize)[::-1].tolist()
+    return self.gaussians.pop()
+  def Integer(self,low:int,high:int)->int:
+    block = self.integers.get((low,high))
+    if not block:
+      block = self.integers[(low,high)] = self.generator.integers(low,high+1,size=self.blockSize)[::-1].tolist()
+    return block.pop()
+  def Choice(self,items:list)->ClassInitial:
+    return items[self.Integer(0,len(items)-1)]
+  def Block(self,kind:ClassInitial)->list:
+    if kind == "random":
+      return self.uniforms
+    if kind == "gauss":
+      return self.gaussians
+    return self.integers.setdefault(tuple(kind),[])
+  def Fill(self,n:int,kinds:tuple)->list:
+    """
+    refills the blocks of the kinds until each holds n numbers and returns them; the block that stepping would empty first
+    (the shortest, the earlier kind on a tie) is refilled first, so the generator hands out its numbers in the same order
+    """
+    blocks = [self.Block(kind) for kind in kinds]
+    while True:
+      short = [(len(block),order) for order,block in enumerate(blocks) if len(block) < n]
+      if not short:
+        return blocks
+      order = min(short)[1]
+      kind = kinds[order]
+      if kind == "random":
+        fresh = self.generator.random(self.blockSize)
+      elif kind == "gauss":
+        fresh = self.generator.standard_normal(self.blockSize)
+      else:
+        fresh = self.generator.integers(kind[0],kind[1]+1,size=self.blockSize)
+      blocks[order][:0] = fresh[::-1].tolist()
+  def Peek(self,n:int,*kinds)->list:
+    return [np.array(block[len(block)-n:][::-1]) for block in self.Fill(n,kinds)]
+  def Advance(self,n:int,*kinds)->None:
+    for block in self.Fill(n,kinds):
+      del block[len(block)-n:]
+  def Spawn(self,n:int)->list:
+    return [BlockRandom(child,self.blockSize) for child in self.seedSequence.spawn(n)]
+  def Snapshot(self)->tuple:
+    """
+    the state of the generator and copies of the numbers drawn but not yet handed out
+    """
+    return self.generator.bit_generator.state,self.uniforms[:],self.gaussians[:],{key:block[:] for key,block in self.integers.items()}
+  def Restore(self,snapshot:tuple)->None:
+    state,uniforms,gaussians,integers = snapshot
+    self.generator.bit_generator.state = state
+    self.uniforms,self.gaussians = uniforms[:],gaussians[:]
+    self.integers = {key:block[:] for key,block in integers.items()}
+  def Fork(self)->ClassInitial:
+    """
+    a source that draws the same numbers as this one from now on (it shares the seed sequence, so spawn children from only one of them)
+    """
+    clone = object.__new__(BlockRandom)
+    clone.seedSequence,clone.blockSize = self.seedSequence,self.blockSize
+    clone.generator = np.random.Generator(type(self.generator.bit_generator)(self.seedSequence))
+    state,clone.uniforms,clone.gaussians,clone.integers = self.Snapshot() # the snapshot's copies become the clone's blocks
+    clone.generator.bit_generator.state = state
+    return clone
+
+def RandomSource(rng:ClassInitial=None)->ClassInitial:
+  """
+  the source to use for an rng argument: the default source for None, a BlockRandom for an int or a SeedSequence, else rng itself
+  """
+  if rng is None:
+    return defaultRandom
+  if isinstance(rng,(int,np.integer,np.random.SeedSequence)):
+    return BlockRandom(rng)
+  return rng
+
+#UNIT TEST
+# from buying_simulation import PSEnvironment,PSAgent
+# from agent_configuration import Simulate
+# sources = BlockRandom(2024).Spawn(4)
+# for rng in sources:
+#   environment = PSEnvironment(rng=rng)
+#   simulation = Simulate(PSAgent(environment),environment)
+#   simulation.Go(1000)
+#   print(simulation.perception)
@@ -0,0 +1,191 @@
+import numpy as np
+from util_class import ClassInitial,NullInitial
+
+"""
+# Trajectory Recorder
+- Records one row of values per simulation step into typed NumPy buffers, one buffer per column.
+- A column is declared by a dtype, or by a (dtype,shape) pair when each step records an array (e.g. a position or a whole batch).
+- The buffers double in size when they are full, so appending is amortized O(1) and costs a few bytes per value instead of a Python object per value.
+- Column and View return zero-copy views of the recorded rows; a view keeps showing the rows it was taken with, later rows need a new view.
+- Snapshot and Fork freeze the recorded rows into read-only segments shared with the snapshot or the fork (copy-on-write),
+  and each recorder goes on appending to a buffer of its own. A buffer more than half full is handed over as it is;
+  a short tail, or rows a Column or View may still write to, are copied into a segment of their own size.
+- The segments are merged like a binary counter (the last two when the earlier is no longer than the later), so there are
+  O(log n) of them and every row is copied O(log n) times however often the recorder is snapshot.
+  The next Column or View joins the segments into one buffer again (one copy, then zero-copy views as before).
+"""
+def ColumnsFromRow(row:dict)->dict:
+  """
+  returns a column declaration with one column per key of the row, its dtype inferred from the value
+  numbers get float64 columns, since a value that starts as an int may later become a float
+  """
+  columns = {}
+  for name,value in row.items():
+    if isinstance(value,(bool,np.bool_)):
+      columns[name] = np.bool_
+    elif isinstance(value,(int,float,np.integer,np.floating)):
+      columns[name] = np.float64
+    elif isinstance(value,np.ndarray):
+      columns[name] = (value.dtype,value.shape)
+    else:
+      columns[name] = object
+  return columns
+
+class TrajectoryRecorder(object):
+  tailCapacity = 64 # rows of the buffers started after a Freeze, a Restore or a Fork; they double as they fill
+  def __init__(self,columns:dict,capacity:int=1024)->ClassInitial:
+    self.names = list(columns)
+    self.specs = {name:spec if isinstance(spec,tuple) else (spec,()) for name,spec in columns.items()}
+    self.segments = () # frozen rows shared with snapshots and forks: a tuple of (rows,{name:read-only array})
+    self.frozen = 0 # rows in the segments
+    self.Allocate(capacity)
+  def Allocate(self,capacity:int)->None|NullInitial:
+    """
+    starts empty buffers of their own
+    """
+    self.capacity = max(capacity,1)
+    self.length = 0 # rows in the buffers, after the frozen ones
+    self.buffers = {name:np.empty((self.capacity,)+tuple(shape),dtype=dtype) for name,(dtype,shape) in self.specs.items()}
+    self.bufferList = [self.buffers[name] for name in self.names]
+    self.exposed = False # true once Column or View handed out views of the buffers
+  @classmethod
+  def FromRow(cls,row:dict,capacity:int=1024)->ClassInitial:
+    """
+    declares one column per key of the row, with a dtype inferred from its value
+    """
+    return cls(ColumnsFromRow(row),capacity)
+  def __len__(self)->int:
+    return self.frozen+self.length
+  def Grow(self,needed:int)->None|NullInitial:
+    """
+    reallocates every buffer to at least needed rows, doubling the capacity
+    """
+    capacity = max(2*self.capacity,needed)
+    for name in self.names:
+      old = self.buffers[name]
+      new = np.empty((capacity,)+old.shape[1:],dtype=old.dtype)
+      new[:self.length] = old[:self.length]
+      self.buffers[name] = new
+    self.bufferList = [self.buffers[name] for name in self.names]
+    self.capacity = capacity
+    self.exposed = False
+  def Append(self,*values)->None|NullInitial:
+    """
+    appends one row, the values given in column order
+    """
+    if self.length == self.capacity:
+      self.Grow(self.length+1)
+    row = self.length
+    for buffer,value in zip(self.bufferList,values):
+      buffer[row] = value
+    self.length = row+1
+  def AppendRow(self,row:dict)->None|NullInitial:
+    """
+    appends one row given as a dictionary from column name to value
+    """
+    self.Append(*(row[name] for name in self.names))
+  def Extend(self,**columns)->None|NullInitial:
+    """
+    appends many rows at once; every column gets an array with one entry per row
+    """
+    count = len(columns[self.names[0]])
+    if self.length+count > self.capacity:
+      self.Grow(self.length+count)
+    for name in self.names:
+      self.buffers[name][self.length:self.length+count] = columns[name]
+    self.length += count
+  def Column(self,name:str)->np.ndarray:
+    """
+    returns a zero-copy view of the recorded values of a column
+    """
+    if self.segments:
+      self.Join()
+    self.exposed = True
+    return self.buffers[name][:self.length]
+  def View(self)->dict:
+    if self.segments:
+      self.Join()
+    self.exposed = True
+    return {name:self.buffers[name][:self.length] for name in self.names}
+  def Clear(self)->None|NullInitial:
+    self.segments,self.frozen = (),0
+    self.length = 0
+  def NumberOfBytes(self)->int:
+    """
+    returns the memory used by the buffers, including the whole buffers behind the frozen rows shared with snapshots and forks
+    """
+    bases = {id(array.base if array.base is not None else array):array.base if array.base is not None else array
+      for rows,arrays in self.segments for array in arrays.values()}
+    return sum(buffer.nbytes for buffer in self.bufferList)+sum(base.nbytes for base in bases.values())
+  def Freeze(self)->None|NullInitial:
+    """
+    moves the rows of the buffers into a read-only segment
+    a buffer more than half full that no view can write to is handed over, else its rows are copied and the buffer is kept
+    """
+    if not self.length:
+      return
+    length = self.length
+    if 2*length >= self.capacity and not self.exposed:
+      arrays = {name:self.buffers[name][:length] for name in self.names}
+      self.Allocate(min(self.capacity,self.tailCapacity))
+    else:
+      arrays = {name:self.buffers[name][:length].copy() for name in self.names}
+      if self.exposed:
+        self.Allocate(min(self.capacity,self.tailCapacity))
+      self.length = 0
+    for array in arrays.values():
+      array.setflags(write=False)
+    segments = self.segments+((length,arrays),)
+    while len(segments) > 1 and segments[-2][0] <= segments[-1][0]:
+      segments = segments[:-2]+(Merge(segments[-2:],self.names),)
+    self.segments = segments
+    self.frozen += length
+  def Join(self)->None|NullInitial:
+    """
+    copies the segments and the rows after them into one buffer of its own
+    """
+    rows = len(self)
+    parts = [arrays for count,arrays in self.segments]+[{name:self.buffers[name][:self.length] for name in self.names}]
+    self.segments,self.frozen = (),0
+    self.Allocate(2*rows)
+    for name in self.names:
+      np.concatenate([part[name] for part in parts],out=self.buffers[name][:rows])
+    self.length = rows
+  def Snapshot(self)->tuple:
+    self.Freeze()
+    return self.segments,self.frozen
+  def Restore(self,snapshot:tuple)->None|NullInitial:
+    """
+    goes back to the rows of the snapshot; the rows recorded after it are dropped
+    """
+    self.segments,self.frozen = snapshot
+    if self.exposed:
+      self.Allocate(min(self.capacity,self.tailCapacity)) # the views handed out keep their rows
+    self.length = 0
+  def Fork(self)->ClassInitial:
+    """
+    a recorder with the same rows that appends to its own buffers
+    """
+    clone = object.__new__(type(self))
+    clone.names,clone.specs = self.names,self.specs
+    clone.segments,clone.frozen = self.Snapshot()
+    clone.Allocate(min(self.capacity,self.tailCapacity))
+    return clone
+
+def Merge(segments:tuple,names:list)->tuple:
+  """
+  one read-only segment holding the rows of the segments in order
+  """
+  arrays = {name:np.concatenate([part[name] for rows,part in segments]) for name in names}
+  for array in arrays.values():
+    array.setflags(write=False)
+  return sum(rows for rows,part in segments),arrays
+
+#UNIT TEST
+# recorder = TrajectoryRecorder({"stock":np.int64,"price":np.float64})
+# for step in range(5000):
+#   recorder.Append(step%60,234.0+step%7)
+# print(len(recorder),recorder.Column("price")[:10],recorder.NumberOfBytes())
+# positions = TrajectoryRecorder({"position":(np.float64,(2,))})
+# positions.Append((0.0,1.0))
+# print(positions.Column("position"))
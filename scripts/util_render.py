@@ -0,0 +1,154 @@
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from util_class import ClassInitial,NullInitial
+from util_record import TrajectoryRecorder
+
+"""
+# Trace Buffer
+- Simulations record the points they want drawn into a TraceBuffer instead of plotting them step by step.
+- A trace has named series (e.g. "path", "whisker", "crash"); each series is a TrajectoryRecorder with one (x,y) point per row.
+- Snapshot, Restore and Fork act on every series, so a forked trace shares the points recorded so far (see util_record).
+"""
+class TraceBuffer(object):
+  def __init__(self,series:tuple=("path",))->ClassInitial:
+    self.series = {name:TrajectoryRecorder({"point":(np.float64,(2,))}) for name in series}
+  def Add(self,name:str,x:int|float,y:int|float)->None|NullInitial:
+    self.series[name].Append((x,y))
+  def Extend(self,name:str,xS:np.ndarray,yS:np.ndarray)->None|NullInitial:
+    """
+    adds many points at once
+    """
+    self.series[name].Extend(point=np.stack((xS,yS),axis=1))
+  def Array(self,name:str)->np.ndarray:
+    """
+    returns a zero-copy (n,2) view of the points of a series
+    """
+    return self.series[name].Column("point")
+  def Points(self,name:str)->tuple:
+    """
+    returns zero-copy (xS,yS) views of a series
+    """
+    points = self.series[name].Column("point")
+    return points[:,0],points[:,1]
+  def Count(self,name:str)->int:
+    return len(self.series[name])
+  def Snapshot(self)->dict:
+    return {name:series.Snapshot() for name,series in self.series.items()}
+  def Restore(self,snapshot:dict)->None|NullInitial:
+    for name,series in self.series.items():
+      series.Restore(snapshot[name])
+  def Fork(self)->ClassInitial:
+    clone = object.__new__(TraceBuffer)
+    clone.series = {name:series.Fork() for name,series in self.series.items()}
+    return clone
+
+"""
+# Renderers
+- A renderer is told about every simulation step and decides when (if ever) to draw the trace.
+- Renderer draws nothing at all; it is the default, so simulations run at full speed and without a display.
+- FrameRenderer draws on an off-screen Agg canvas every k steps (or only the final frame when every=0), optionally saving each frame or the final image.
+- InteractiveRenderer draws into a pyplot window and pauses after each drawn frame, like the original real-time plotting.
+- Every series is drawn by a single Line2D that is updated with set_data, so a frame costs the same however many steps were recorded.
+"""
+class Renderer(object):
+  stepwise = False # true when the renderer draws during the run, so the simulation must not take several steps at once
+  def Begin(self,trace:ClassInitial,background:ClassInitial=None)->None|NullInitial:
+    """
+    trace is the TraceBuffer being recorded
+    background is called once with the axes to draw the static scene (walls, obstacles, ...)
+    """
+    self.trace = trace
+  def Step(self)->None|NullInitial:
+    """
+    called after every simulation step
+    """
+    pass
+  def Finish(self)->None|NullInitial:
+    """
+    called once the run is over
+    """
+    pass
+
+class FrameRenderer(Renderer):
+  styles = {
+    "path":("go",{}),
+    "whisker":("ro",{}),
+    "crash":("r*",{"markersize":15.0})
+  }
+  def __init__(self,every:int=0,path:str|None=None,framePattern:str|None=None,styles:dict|None=None,figureSize:tuple=(6.4,4.8))->ClassInitial:
+    """
+    every is the number of steps between frames (0 draws only the final frame)
+    path is where the final frame is saved, framePattern (e.g. "frame_{:05d}.png") where the intermediate frames are saved
+    """
+    self.every = every
+    self.stepwise = every > 0
+    self.path = path
+    self.framePattern = framePattern
+    self.styles = dict(self.styles,**(styles or {}))
+    self.figureSize = figureSize
+    self.steps = 0
+    self.frames = 0
+  def NewAxes(self)->ClassInitial:
+    self.figure = Figure(figsize=self.figureSize)
+    self.canvas = FigureCanvasAgg(self.figure)
+    return self.figure.add_subplot()
+  def Begin(self,trace:ClassInitial,background:ClassInitial=None)->None|NullInitial:
+    self.trace = trace
+    self.axes = self.NewAxes()
+    if background is not None:
+      background(self.axes)
+    self.lines = {}
+    for name in trace.series:
+      fmt,options = self.styles.get(name,("o",{}))
+      self.lines[name] = self.axes.plot([],[],fmt,**options)[0]
+    self.Draw()
+  def Draw(self)->None|NullInitial:
+    for name,line in self.lines.items():
+      line.set_data(*self.trace.Points(name))
+    self.axes.relim()
+    self.axes.autoscale_view()
+    self.canvas.draw()
+  def Step(self)->None|NullInitial:
+    self.steps += 1
+    if self.every and self.steps%self.every == 0:
+      self.Draw()
+      if self.framePattern is not None:
+        self.figure.savefig(self.framePattern.format(self.frames))
+      self.frames += 1
+  def Finish(self)->None|NullInitial:
+    self.Draw()
+    if self.path is not None:
+      self.figure.savefig(self.path)
+
+class FinalFrameRenderer(FrameRenderer):
+  def __init__(self,path:str|None=None,styles:dict|None=None,figureSize:tuple=(6.4,4.8))->ClassInitial:
+    FrameRenderer.__init__(self,every=0,path=path,styles=styles,figureSize=figureSize)
+
+class InteractiveRenderer(FrameRenderer):
+  def __init__(self,every:int=1,pause:int|float=0.05,axes:ClassInitial=None,path:str|None=None,styles:dict|None=None)->ClassInitial:
+    """
+    pause is the time between drawn frames; axes is an existing pyplot axes to draw into
+    """
+    FrameRenderer.__init__(self,every=every,path=path,styles=styles)
+    self.pause = pause
+    self.givenAxes = axes
+  def NewAxes(self)->ClassInitial:
+    import matplotlib.pyplot as plt
+    self.plt = plt
+    axes = self.givenAxes if self.givenAxes is not None else plt.figure().add_subplot()
+    self.figure = axes.figure
+    self.canvas = self.figure.canvas
+    return axes
+  def Draw(self)->None|NullInitial:
+    FrameRenderer.Draw(self)
+    self.plt.pause(self.pause)
+
+#UNIT TEST
+# trace = TraceBuffer(("path",))
+# renderer = FrameRenderer(every=100,path="trace.png")
+# renderer.Begin(trace)
+# for step in range(1000):
+#   trace.Add("path",step,step%7)
+#   renderer.Step()
+# renderer.Finish()
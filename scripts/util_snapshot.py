@@ -0,0 +1,61 @@
+import copy
+import numpy as np
+from util_class import ClassInitial,NullInitial
+
+"""
+# Snapshots and Forks
+- Snapshot() captures the live state of an object, Restore(snapshot) puts it back and Fork() returns an independent copy that
+  carries on from the same state; a what-if run branches from step t instead of replaying steps 0..t.
+- A class lists its live state in stateFields (time, stock, price, pose, beliefs, ...). Plain values are kept as they are
+  (dictionaries, lists and arrays are copied shallowly); a part with its own Snapshot/Restore/Fork (a TrajectoryRecorder, a TraceBuffer,
+  a random source, a nested agent or environment) is captured by its own methods.
+- Histories are shared, not copied: a TrajectoryRecorder freezes its rows into read-only segments that the snapshot and the forks share,
+  and each goes on appending to its own tail (copy-on-write), so the cost does not depend on the length of the run.
+- Everything outside stateFields (parameters, walls, caches, models) is shared between an object and its forks.
+"""
+class Forkable(object):
+  stateFields = () # names of the attributes that hold the live state
+  def Snapshot(self)->dict:
+    state = {}
+    for name in self.stateFields:
+      value = getattr(self,name,None)
+      if hasattr(value,"Snapshot"):
+        state[name] = (True,value.Snapshot())
+      else:
+        state[name] = (False,Copy(value))
+    return state
+  def Restore(self,snapshot:dict)->None|NullInitial:
+    for name,(part,value) in snapshot.items():
+      current = getattr(self,name,None)
+      if part and hasattr(current,"Restore"):
+        current.Restore(value)
+      else:
+        setattr(self,name,Copy(value))
+  def Fork(self)->ClassInitial:
+    clone = copy.copy(self)
+    for name in self.stateFields:
+      value = getattr(self,name,None)
+      setattr(clone,name,value.Fork() if hasattr(value,"Fork") else Copy(value))
+    return clone
+
+def Copy(value:ClassInitial)->ClassInitial:
+  """
+  a shallow copy of a mutable container, the value itself otherwise
+  """
+  if isinstance(value,(dict,list,set)):
+    return type(value)(value)
+  if isinstance(value,np.ndarray):
+    return value.copy()
+  return value
+
+#UNIT TEST
+# from util_random import BlockRandom
+# from agent_configuration import Simulate
+# from buying_simulation import PSEnvironment,PSAgent
+# environment = PSEnvironment(rng=BlockRandom(7))
+# simulation = Simulate(PSAgent(environment),environment)
+# simulation.Go(100000)
+# branch = simulation.Fork()
+# simulation.Go(100)
+# branch.Go(100)
+# print(simulation.perception,branch.perception)
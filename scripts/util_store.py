@@ -0,0 +1,136 @@
+import json,os
+import numpy as np
+from util_class import ClassInitial,NullInitial
+from util_record import ColumnsFromRow
+
+"""
+# Trajectory Store
+- A persistent file of fixed-width binary records, one record per simulation step.
+- The file starts with a small header: the magic bytes, the header length and a JSON schema listing every field with its dtype and shape.
+- The records follow the header, padded to a 64-byte boundary, packed as a NumPy structured dtype.
+- TrajectoryWriter appends records in chunks while the simulation runs; OpenTrajectory maps the file with np.memmap,
+  so a run of any length can be sliced, replayed and plotted without loading it into memory.
+- The number of records is given by the file size, so a file that is still being written can be opened at any time.
+"""
+magic = b"TRAJSTOR"
+version = 1
+alignment = 64
+
+def RecordType(fields:dict)->np.dtype:
+  """
+  fields maps a name to a dtype or to a (dtype,shape) pair
+  """
+  descriptor = []
+  for name,spec in fields.items():
+    dtype,shape = spec if isinstance(spec,tuple) else (spec,())
+    dtype = np.dtype(dtype)
+    if dtype.hasobject:
+      raise ValueError(f"[Field cannot be stored]::{name} has dtype {dtype}")
+    descriptor.append((name,dtype,tuple(shape)))
+  return np.dtype(descriptor)
+
+def ReadHeader(path:str)->tuple:
+  """
+  returns (record dtype,offset of the first record)
+  """
+  with open(path,"rb") as handle:
+    start = handle.read(len(magic)+8)
+    if start[:len(magic)] != magic:
+      raise ValueError(f"[Not a trajectory file]::{path}")
+    fileVersion = int.from_bytes(start[len(magic):len(magic)+4],"little")
+    headerLength = int.from_bytes(start[len(magic)+4:],"little")
+    if fileVersion != version:
+      raise ValueError(f"[Unsupported trajectory version]::{fileVersion}")
+    header = json.loads(handle.read(headerLength).decode("utf-8"))
+  fields = {name:(dtype,tuple(shape)) for (name,dtype,shape) in header["fields"]}
+  return RecordType(fields),header["offset"]
+
+def OpenTrajectory(path:str,mode:str="r")->np.memmap:
+  """
+  returns the records as a memory-mapped structured array (zero-copy; slicing reads only the pages needed)
+  """
+  recordType,offset = ReadHeader(path)
+  count = (os.path.getsize(path)-offset)//recordType.itemsize
+  if count == 0:
+    return np.zeros(0,dtype=recordType)
+  return np.memmap(path,dtype=recordType,mode=mode,offset=offset,shape=(count,))
+
+class TrajectoryWriter(object):
+  """
+  appends fixed-width records to a trajectory file
+  records are collected in a chunk of chunkRows rows and written when the chunk is full or on Flush/Close
+  """
+  def __init__(self,path:str,fields:dict,chunkRows:int=65536)->ClassInitial:
+    self.path = path
+    self.recordType = RecordType(fields)
+    self.names = list(self.recordType.names)
+    self.chunk = np.zeros(chunkRows,dtype=self.recordType)
+    self.filled = 0
+    self.written = 0
+    self.handle = open(path,"wb")
+    self.WriteHeader()
+  @classmethod
+  def FromRow(cls,path:str,row:dict,chunkRows:int=65536)->ClassInitial:
+    """
+    declares one field per key of the row, with a dtype inferred from its value
+    """
+    return cls(path,ColumnsFromRow(row),chunkRows)
+  def WriteHeader(self)->None|NullInitial:
+    fields = [
+      [name,self.recordType[name].base.str,list(self.recordType[name].shape)]
+      for name in self.names
+    ]
+    prefix = len(magic)+8
+    # the offset is part of the header, so grow it until the header fits before it
+    offset = alignment
+    while True:
+      header = json.dumps({"fields":fields,"offset":offset}).encode("utf-8")
+      if prefix+len(header) <= offset:
+        break
+      offset += alignment
+    self.handle.write(magic+version.to_bytes(4,"little")+len(header).to_bytes(4,"little"))
+    self.handle.write(header)
+    self.handle.write(b"\0"*(offset-prefix-len(header)))
+  def __len__(self)->int:
+    return self.written+self.filled
+  def Append(self,*values)->None|NullInitial:
+    """
+    appends one record, the values given in field order
+    """
+    self.chunk[self.filled] = values
+    self.filled += 1
+    if self.filled == len(self.chunk):
+      self.Flush()
+  def AppendRow(self,row:dict)->None|NullInitial:
+    """
+    appends one record given as a dictionary from field name to value
+    """
+    self.Append(*(row[name] for name in self.names))
+  def Extend(self,records:np.ndarray)->None|NullInitial:
+    """
+    appends an array of records of the file's dtype
+    """
+    self.Flush()
+    np.asarray(records,dtype=self.recordType).tofile(self.handle)
+    self.written += len(records)
+  def Flush(self)->None|NullInitial:
+    if self.filled:
+      self.chunk[:self.filled].tofile(self.handle)
+      self.written += self.filled
+      self.filled = 0
+    self.handle.flush()
+  def Close(self)->None|NullInitial:
+    if not self.handle.closed:
+      self.Flush()
+      self.handle.close()
+  def __enter__(self)->ClassInitial:
+    return self
+  def __exit__(self,*exception)->None|NullInitial:
+    self.Close()
+
+#UNIT TEST
+# with TrajectoryWriter("run.traj",{"step":np.int64,"xPos":np.float64,"yPos":np.float64}) as writer:
+#   for step in range(1000000):
+#     writer.Append(step,step*0.5,step*0.25)
+# records = OpenTrajectory("run.traj")
+# print(len(records),records["xPos"][500000:500005])
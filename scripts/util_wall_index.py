@@ -0,0 +1,80 @@
+import numpy as np
+from util_class import ClassInitial
+
+"""
+# Wall Index
+- A packed copy of the WallGrid of a WallEnvironment, so many segments can look up their candidate walls at once.
+- The grid cells covering the walls are numbered row-major; indptr/indices list the wall rows of every cell (compressed sparse rows).
+- Candidates expands every segment to the cells of its bounding box and every cell to its walls with np.repeat, so a query
+  of thousands of segments costs a fixed number of NumPy calls.
+- The index is rebuilt whenever the walls change (the environment's version goes up).
+"""
+class WallIndex(object):
+  def __init__(self,environment:ClassInitial)->ClassInitial:
+    self.environment = environment
+    self.version = environment.version
+    grid = environment.grid
+    self.cellSize = grid.cellSize
+    self.margin = grid.margin
+    keys = [key for key,members in grid.cells.items() if members]
+    if not keys:
+      self.empty = True
+      return
+    self.empty = False
+    self.column0 = min(column for (column,row) in keys)
+    self.row0 = min(row for (column,row) in keys)
+    self.columns = max(column for (column,row) in keys)-self.column0+1
+    self.rows = max(row for (column,row) in keys)-self.row0+1
+    counts = np.zeros(self.columns*self.rows+1,dtype=np.int64)
+    members = {}
+    for (column,row) in keys:
+      cell = (column-self.column0)*self.rows+(row-self.row0)
+      members[cell] = sorted(grid.cells[(column,row)])
+      counts[cell+1] = len(members[cell])
+    self.indptr = np.cumsum(counts)
+    self.indices = np.empty(self.indptr[-1],dtype=np.int64)
+    for cell,rows in members.items():
+      self.indices[self.indptr[cell]:self.indptr[cell+1]] = rows
+  def Candidates(self,segments:np.ndarray,reach:int|float=0)->tuple:
+    """
+    segments is an (K,2,2) array; reach enlarges the bounding box of every segment (to find the walls within that distance)
+    returns (segment,wall row) index arrays of the pairs whose grid cells are shared (a pair sharing several cells appears several times)
+    """
+    nothing = np.zeros(0,dtype=np.int64)
+    if self.empty or len(segments) == 0:
+      return nothing,nothing
+    size,margin = self.cellSize,self.margin+reach
+    xS,yS = segments[:,:,0],segments[:,:,1]
+    column0 = np.maximum(np.floor((xS.min(axis=1)-margin)/size).astype(np.int64)-self.column0,0)
+    column1 = np.minimum(np.floor((xS.max(axis=1)+margin)/size).astype(np.int64)-self.column0,self.columns-1)
+    row0 = np.maximum(np.floor((yS.min(axis=1)-margin)/size).astype(np.int64)-self.row0,0)
+    row1 = np.minimum(np.floor((yS.max(axis=1)+margin)/size).astype(np.int64)-self.row0,self.rows-1)
+    width = np.maximum(column1-column0+1,0)
+    height = np.maximum(row1-row0+1,0)
+    counts = width*height
+    # one entry per (segment,cell)
+    segment = np.repeat(np.arange(len(segments)),counts)
+    local = np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts,counts)
+    cellHeight = np.repeat(height,counts)
+    cell = (np.repeat(column0,counts)+local//cellHeight)*self.rows+np.repeat(row0,counts)+local%cellHeight
+    # one entry per (segment,wall)
+    starts = self.indptr[cell]
+    counts = self.indptr[cell+1]-starts
+    segment = np.repeat(segment,counts)
+    walls = self.indices[np.repeat(starts,counts)+np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts,counts)]
+    return segment,walls
+
+def Fresh(index:ClassInitial,environment:ClassInitial)->ClassInitial:
+  """
+  returns the index, rebuilt if the walls of the environment changed since it was built
+  """
+  if index is None or index.version != environment.version:
+    return WallIndex(environment)
+  return index
+
+#UNIT TEST
+# from wall_environment import WallEnvironment
+# from util_geometry import SegmentArray
+# environment = WallEnvironment({((0,0),(100,0)),((100,0),(100,100)),((0,50),(60,50))})
+# index = Fresh(None,environment)
+# print(index.Candidates(SegmentArray([((10,40),(10,60)),((90,-5),(110,5))])))
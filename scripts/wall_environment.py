@@ -1,13 +1,19 @@
 import math,os
+import numpy as np
 from util_class import *
 from util_display import Displayable
 from agent_configuration import Environment
+from util_geometry import SegmentsIntersect,SegmentParameters
+from util_render import TraceBuffer,Renderer,InteractiveRenderer
+from util_store import TrajectoryWriter
+from util_wall_index import Fresh
 import matplotlib.pyplot as plt
 
 """
 It determines if two line segments intersect based on their geometric properties.
 This is done by comparing the slopes and intercepts of the lines to see if there's a point where they cross within the segments' bounds.
 If such a point exists, it means a collision is detected.
+The computation is done by the shared kernel in util_geometry, which also tests one segment against many walls at once.
 """
 def LineSegmentInterception(lineA:tuple,lineB:tuple)->bool:
   """
@@ -15,31 +21,277 @@ def LineSegmentInterception(lineA:tuple,lineB:tuple)->bool:
   a line segment is represented as a pair of points
   a point is represented as a (x,y) pair
   """
-  ((Ax0,Ay0),(Ax1,Ay1)) = lineA
-  ((Bx0,By0),(Bx1,By1)) = lineB
-  dA,dB = Ax1-Ax0,Bx1-Bx0
-  eA,eB = Ay1-Ay0,By1-By0
-  angleSeg = dB*eA-eB*dA
-  if angleSeg == 0:
-    # line segments are parallel
-    return False
-  cB = (dA*(By0-Ay0)-eA*(Bx0-Ax0))/angleSeg # position along line B
-  if cB < 0 or cB > 1:
-    return False
-  cA = (dB*(By0-Ay0)-eB*(Bx0-Ax0))/angleSeg # position along line A
-  return 0 <= cA <= 1
+  return SegmentsIntersect(lineA,lineB)
 
 #UNIT TEST
 #print(LineSegmentInterception(((0,0),(1,1)),((1,0),(0,1))))
 
+"""
+# Wall Grid
+- A uniform grid over the plane used as a spatial index for the walls.
+- Every wall is registered in each cell its segment passes through.
+- A segment query only visits the cells the query segment passes through, so it tests nearby walls instead of every wall.
+- Cell membership is computed against slightly enlarged cells, so the candidates always include every wall the query can touch.
+"""
+class WallGrid(object):
+  def __init__(self,cellSize:int|float=10)->ClassInitial:
+    self.cellSize = cellSize
+    self.margin = cellSize*1e-9 # enlarges every cell so boundary cases are never missed
+    self.cells = {} # (column,row) -> set of wall keys
+  def Cells(self,segment:tuple)->list:
+    """
+    returns the (column,row) keys of the cells that the segment passes through
+    """
+    ((x0,y0),(x1,y1)) = segment
+    size,margin = self.cellSize,self.margin
+    columns = range(math.floor((min(x0,x1)-margin)/size),math.floor((max(x0,x1)+margin)/size)+1)
+    rows = range(math.floor((min(y0,y1)-margin)/size),math.floor((max(y0,y1)+margin)/size)+1)
+    dx,dy = x1-x0,y1-y0
+    if len(columns) == 1 or len(rows) == 1 or dx == 0 or dy == 0:
+      return [(column,row) for column in columns for row in rows]
+    # only keep the cells of the bounding box that the segment actually crosses
+    keys = []
+    for column in columns:
+      left,right = column*size-margin,(column+1)*size+margin
+      tx0,tx1 = (left-x0)/dx,(right-x0)/dx
+      if tx0 > tx1:
+        tx0,tx1 = tx1,tx0
+      for row in rows:
+        bottom,top = row*size-margin,(row+1)*size+margin
+        ty0,ty1 = (bottom-y0)/dy,(top-y0)/dy
+        if ty0 > ty1:
+          ty0,ty1 = ty1,ty0
+        if max(tx0,ty0,0) <= min(tx1,ty1,1):
+          keys.append((column,row))
+    return keys
+  def Insert(self,wall:tuple,key:ClassInitial)->None|NullInitial:
+    """
+    registers the key (the wall itself, or its row in a wall array) in every cell the wall passes through
+    """
+    for cell in self.Cells(wall):
+      self.cells.setdefault(cell,set()).add(key)
+  def Remove(self,wall:tuple,key:ClassInitial)->None|NullInitial:
+    for cell in self.Cells(wall):
+      members = self.cells.get(cell)
+      if members is not None:
+        members.discard(key)
+        if not members:
+          del self.cells[cell]
+  def Candidates(self,segment:tuple)->set:
+    """
+    returns the keys registered in any cell that the segment passes through
+    """
+    candidates = set()
+    for key in self.Cells(segment):
+      cell = self.cells.get(key)
+      if cell is not None:
+        candidates.update(cell)
+    return candidates
+
 """
 # Wall Environment
 - Initializes an environment with predefined walls.
 - Walls are represented as line segments defined by tuples of points (each point being an (x, y) pair).
+- The walls are indexed by a WallGrid that is built once here; use AddWall and RemoveWall to change the walls so the index stays up to date.
+- When no cell size is given, it is chosen so that the extent of the walls is split into about as many cells as there are walls.
 """
 class WallEnvironment(Environment):
-  def __init__(self,walls:dict={})->ClassInitial:
-    self.walls = walls
+  scalarLimit = 16 # up to this many candidate walls are tested in plain Python, more go through the NumPy kernel
+  def __init__(self,walls:dict={},cellSize:int|float|None=None)->ClassInitial:
+    self.walls = set()
+    if cellSize is None:
+      cellSize = self.DefaultCellSize(set(walls))
+    self.grid = WallGrid(cellSize)
+    self.wallRows = {} # wall -> row of wallArray
+    self.wallList = [] # row -> wall, None once removed
+    self.wallArray = np.empty((max(len(walls),16),2,2))
+    self.version = 0 # goes up whenever the walls change, so copies of the index know to rebuild
+    for wall in walls:
+      self.AddWall(wall)
+  def Fork(self)->ClassInitial:
+    return self # the walls are shared by the forks of the bodies that move among them
+  @staticmethod
+  def DefaultCellSize(walls:set)->int|float:
+    if not walls:
+      return 10
+    xS = [x for ((x0,y0),(x1,y1)) in walls for x in (x0,x1)]
+    yS = [y for ((x0,y0),(x1,y1)) in walls for y in (y0,y1)]
+    extent = max(max(xS)-min(xS),max(yS)-min(yS))
+    return max(extent/math.ceil(math.sqrt(len(walls))),1)
+  def AddWall(self,wall:tuple)->None|NullInitial:
+    if wall in self.walls:
+      return
+    row = len(self.wallList)
+    if row == len(self.wallArray):
+      self.wallArray = np.concatenate([self.wallArray,np.empty_like(self.wallArray)])
+    self.wallArray[row] = wall
+    self.wallList.append(wall)
+    self.wallRows[wall] = row
+    self.walls.add(wall)
+    self.grid.Insert(wall,row)
+    self.version += 1
+  def RemoveWall(self,wall:tuple)->None|NullInitial:
+    if wall not in self.walls:
+      return
+    row = self.wallRows.pop(wall)
+    self.wallList[row] = None
+    self.walls.remove(wall)
+    self.grid.Remove(wall,row)
+    self.version += 1
+  def Intersects(self,segment:tuple)->bool:
+    """
+    returns true if the segment intersects any wall
+    gives the same answer as testing every wall with LineSegmentInterception
+    """
+    rows = self.grid.Candidates(segment)
+    if self.profiler is not None and self.profiler.timing:
+      self.profiler.Count("walls.tests",self.profiler.every)
+      self.profiler.Count("walls.tested",len(rows)*self.profiler.every)
+    if len(rows) <= self.scalarLimit:
+      wallList = self.wallList
+      return any(SegmentsIntersect(segment,wallList[row]) for row in rows)
+    hit,_ = SegmentParameters(np.asarray(segment,dtype=float),self.wallArray[list(rows)])
+    return bool(hit.any())
+  def FirstHit(self,segment:tuple)->tuple:
+    """
+    returns (wall,distance) for the wall hit first when travelling along the segment
+    returns (None,inf) when no wall is hit
+    """
+    rows = list(self.grid.Candidates(segment))
+    if self.profiler is not None and self.profiler.timing:
+      self.profiler.Count("walls.tests",self.profiler.every)
+      self.profiler.Count("walls.tested",len(rows)*self.profiler.every)
+    if not rows:
+      return None,math.inf
+    _,position = SegmentParameters(np.asarray(segment,dtype=float),self.wallArray[rows])
+    index = int(np.argmin(position))
+    if math.isinf(position[index]):
+      return None,math.inf
+    ((x0,y0),(x1,y1)) = segment
+    return self.wallList[rows[index]],float(position[index])*math.hypot(x1-x0,y1-y0)
+
+"""
+# Lidar
+- K rays spread evenly over a field of view centred on the heading, each up to maxRange long.
+- Scan returns the distance to the nearest wall along every ray (inf when a ray hits nothing) as a NumPy array.
+- A ray hits a wall at distance r when p+r*d = A+u*e for 0 <= r <= maxRange and 0 <= u <= 1. r and u are linear in the position p,
+  so for every (ray,wall) pair the four margins r, maxRange-r, u and 1-u are one (3,4P) matrix applied to (1,-x,y),
+  a pair hits when its smallest margin is not negative, and the nearest hit of each ray is a minimum over its pairs (np.minimum.reduceat).
+- The nearby walls are those within maxRange of some point of the robot's cell, looked up in the grid around it.
+  A ray from somewhere in the cell can only meet a wall in the arc of directions spanned by the vectors from the corners of the cell
+  to the ends of the wall (every direction when the wall surrounds the cell), so the walls are filed by the one degree sectors
+  their arc covers. Both are worked out once per cell and kept until the walls change.
+- Each ray is only paired with the walls of its sector, a few walls instead of every wall around, so a scan costs about the same
+  however many walls there are. A ray parallel to a wall never hits it: its pair's margins are all negative.
+- The pairs and their matrix are kept per (cell,heading); the body turns in steps of turningAngle, so a robot sees few headings.
+"""
+class Lidar(object):
+  sectors = 360 # sectors of the full turn the walls around a cell are filed by
+  def __init__(self,rays:int=64,fieldOfView:int|float=180,maxRange:int|float=30)->ClassInitial:
+    if rays < 1:
+      raise ValueError(f"[Lidar needs at least one ray]::{rays}")
+    self.rays = rays
+    self.fieldOfView = fieldOfView
+    self.maxRange = maxRange
+    self.offsets = np.linspace(-fieldOfView/2,fieldOfView/2,rays) if rays > 1 else np.zeros(1) # degrees from the heading
+    self.index = None
+    self.version = None
+    self.nearby = {} # cell -> ((4,W) wall starts and vectors,where the walls of every sector begin in the next,the walls by sector)
+    self.factors = {} # (cell,heading) -> (the (3,4P) matrix of the pairs,the rays that have pairs,where their pairs begin)
+    self.maxFactors = 512 # entries kept in factors before it is emptied
+  def Nearby(self,environment:ClassInitial,cell:tuple)->tuple:
+    walls = self.nearby.get(cell)
+    if walls is None:
+      column,row = cell
+      size = environment.grid.cellSize
+      box = np.array([[(column*size-self.maxRange,row*size-self.maxRange),((column+1)*size+self.maxRange,(row+1)*size+self.maxRange)]])
+      _,rows = self.index.Candidates(box)
+      segments = environment.wallArray[np.unique(rows)]
+      centre = ((column+0.5)*size,(row+0.5)*size)
+      vectors = segments[:,1]-segments[:,0]
+      along = np.clip(((centre-segments[:,0])*vectors).sum(axis=1)/np.maximum((vectors*vectors).sum(axis=1),1e-300),0,1)
+      closest = np.hypot(*(segments[:,0]+along[:,None]*vectors-centre).T) # from the centre of the cell to the wall
+      segments = segments[closest <= self.maxRange+size*math.sqrt(0.5)] # the others are out of reach from anywhere in the cell
+      corners = np.array([(column,row),(column+1,row),(column,row+1),(column+1,row+1)],dtype=float)*size
+      toWall = (segments[:,:,None,:]-corners).reshape(len(segments),8,2) # from every corner to both ends
+      middle = segments.mean(axis=1)-centre
+      reference = np.degrees(np.arctan2(middle[:,1],middle[:,0]))
+      turns = (np.degrees(np.arctan2(toWall[:,:,1],toWall[:,:,0]))-reference[:,None]+180)%360-180
+      width = 360/self.sectors
+      first = np.floor((reference+turns.min(axis=1,initial=0))/width-1e-9).astype(np.int64)
+      last = np.floor((reference+turns.max(axis=1,initial=0))/width+1e-9).astype(np.int64)
+      around = last-first >= self.sectors//2 # the wall surrounds the cell, or meets it
+      first[around],last[around] = 0,self.sectors-1
+      counts = last-first+1
+      sectors = (np.repeat(first-np.cumsum(counts)+counts,counts)+np.arange(counts.sum()))%self.sectors # each wall's sectors in a row
+      order = np.argsort(sectors,kind="stable")
+      begins = np.concatenate([[0],np.cumsum(np.bincount(sectors,minlength=self.sectors))])
+      table = np.concatenate([segments[:,0],segments[:,1]-segments[:,0]],axis=1).T.copy() # rows: start x and y, vector x and y
+      walls = self.nearby[cell] = (table,begins,np.repeat(np.arange(len(segments)),counts)[order])
+    return walls
+  def Pairs(self,environment:ClassInitial,cell:tuple,direction:int|float)->tuple:
+    """
+    the (ray,wall) pairs, sorted by ray, of the rays of the heading and the nearby walls filed in their sectors
+    returns the rays and the walls of the pairs and the number of pairs of every ray
+    """
+    begins,sectorWalls = self.Nearby(environment,cell)[1:]
+    sectors = np.floor((direction+self.offsets)*self.sectors/360).astype(np.int64)%self.sectors
+    firsts,counts = begins[sectors],begins[sectors+1]-begins[sectors]
+    walls = sectorWalls[np.repeat(firsts-np.cumsum(counts)+counts,counts)+np.arange(counts.sum())]
+    return np.repeat(np.arange(self.rays),counts),walls,counts
+  def Factors(self,environment:ClassInitial,cell:tuple,direction:int|float)->tuple:
+    """
+    for the pairs of the cell and the heading: (the (3,4P) matrix,the rays that have pairs,where their pairs begin)
+    """
+    key = (cell,direction)
+    factors = self.factors.get(key)
+    if factors is None:
+      if len(self.factors) >= self.maxFactors:
+        self.factors = {}
+      rays,walls,counts = self.Pairs(environment,cell,direction)
+      aX,aY,eX,eY = np.take(self.Nearby(environment,cell)[0],walls,axis=1)
+      angles = np.radians(direction+self.offsets)
+      dX,dY = np.cos(angles)[rays],np.sin(angles)[rays]
+      cross = dX*eY-dY*eX # d x e, 0 for a ray parallel to the wall, which never hits it
+      parallel = cross == 0
+      cross[parallel] = 1
+      # r = (q x e)/(d x e) and u = (q x d)/(d x e) for q = A-p, each as c+cX*(-x)+cY*y
+      matrix = np.empty((3,4,len(rays)))
+      np.divide(eY,cross,out=matrix[1,0])
+      np.divide(eX,cross,out=matrix[2,0])
+      np.divide(dY,cross,out=matrix[1,2])
+      np.divide(dX,cross,out=matrix[2,2])
+      matrix[0,0] = aX*matrix[1,0]-aY*matrix[2,0]
+      matrix[0,2] = aX*matrix[1,2]-aY*matrix[2,2]
+      np.negative(matrix[:,0],out=matrix[:,1])
+      np.negative(matrix[:,2],out=matrix[:,3])
+      matrix[0,1] += self.maxRange
+      matrix[0,3] += 1
+      matrix[:,:,parallel] = -1 # every margin negative: no hit
+      having = np.flatnonzero(counts)
+      factors = self.factors[key] = (matrix.reshape(3,-1),having,(np.cumsum(counts)-counts)[having])
+    return factors
+  def Scan(self,environment:ClassInitial,x:int|float,y:int|float,direction:int|float)->np.ndarray:
+    """
+    returns the (K,) distances to the nearest wall along each ray, inf where there is none within maxRange
+    """
+    if self.version != environment.version:
+      self.index = Fresh(self.index,environment)
+      self.version = environment.version
+      self.nearby,self.factors = {},{}
+    size = environment.grid.cellSize
+    matrix,rays,begins = self.Factors(environment,(math.floor(x/size),math.floor(y/size)),direction)
+    nearest = np.full(self.rays,np.inf)
+    if len(rays) == 0:
+      return nearest
+    margins = (np.array((1.0,-x,y))@matrix).reshape(4,-1) # r, maxRange-r, u and 1-u of every pair
+    nearest[rays] = np.minimum.reduceat(np.where(margins.min(axis=0) >= 0,margins[0],np.inf),begins)
+    return nearest
+
+#UNIT TEST
+# run with python -W error::RuntimeWarning: the middle ray is parallel to the first wall and must not warn
+# environment = WallEnvironment({((0,5),(20,5)),((10,-10),(10,-2))})
+# print(Lidar(rays=3,fieldOfView=90).Scan(environment,0,0,0)) # [14.14 inf 7.07]
 
 """
 # Body Environment
@@ -48,19 +300,67 @@ class WallEnvironment(Environment):
 - Implements a "whisker" sensor simulation to detect collisions with walls.
 - The Whisker method simulates this sensor by extending a line segment (the whisker) from the agent in the direction it's facing minus the whisker angle. It then checks for intersections with any wall using the LineSegmentInterception function.
 - The Do method updates the agent's position based on steering actions ('left', 'right', 'straight') and checks for collisions.
+- Positions, whisker hits and crashes are recorded in a TraceBuffer; drawing is left to the renderer (none by default).
+- With a storePath every step's perception is also appended to a trajectory file (see util_store); call store.Close() at the end of the run.
+- Coast(steps) takes many straight steps in one update, for a caller that has checked that none of them crashes or turns the whisker on.
+- With a Lidar (lidar=Lidar(rays,fieldOfView,maxRange)) the perception also holds "lidar", the array of the distances seen by its rays.
+- Snapshot/Restore/Fork carry the pose, the crash, the step count and the trace (see util_snapshot); the walls are shared.
+  A fork draws nothing and writes no store; a restored body keeps the store records of the steps it went back over.
 """
 class BodyEnvironment(Environment):
-  def __init__(self,environment:ClassInitial,initPosition:tuple=(0,0,90))->ClassInitial:
+  stateFields = ("xPos","yPos","direction","crashed","steps","trace")
+  storeFields = {
+    "step":np.int64,
+    "xPos":np.float64,
+    "yPos":np.float64,
+    "direction":np.float64,
+    "whisker":np.bool_,
+    "crashed":np.bool_
+  }
+  def __init__(self,environment:ClassInitial,initPosition:tuple=(0,0,90),renderer:ClassInitial=None,storePath:str|None=None,lidar:ClassInitial=None)->ClassInitial:
     self.environment = environment
+    self.lidar = lidar
     self.xPos,self.yPos,self.direction = initPosition
     self.turningAngle = 18 # degrees that a left makes
     self.whiskerLength = 6 # length of the whisker
     self.whiskerAngle = 30 # angle of whisker relative to robot
     self.crashed = False
-    self.plotting = True # whether the trace is being plotted
     self.sleepTime = 0.05 # time between actions (for real-time plotting)
-    self.history = [(self.xPos,self.yPos)] # history of (x,y) positions
-    self.wallHistory = []
+    self.trace = TraceBuffer(("path","whisker","crash"))
+    self.trace.Add("path",self.xPos,self.yPos)
+    self.SetRenderer(renderer if renderer is not None else Renderer())
+    self.steps = 0
+    self.store = None
+    if storePath is not None:
+      fields = dict(self.storeFields)
+      if lidar is not None:
+        fields["lidar"] = (np.float64,(lidar.rays,))
+      self.store = TrajectoryWriter(storePath,fields)
+      self.store.Append(0,self.xPos,self.yPos,self.direction,False,self.crashed,*self.LidarValues())
+  @property
+  def history(self)->np.ndarray:
+    """
+    history of (x,y) positions, as a zero-copy (n,2) view
+    """
+    return self.trace.Array("path")
+  @property
+  def wallHistory(self)->np.ndarray:
+    """
+    (x,y) positions where the whisker was on, as a zero-copy (n,2) view
+    """
+    return self.trace.Array("whisker")
+  def SetRenderer(self,renderer:ClassInitial)->None|NullInitial:
+    self.renderer = renderer
+    self.renderer.Begin(self.trace,self.DrawWalls)
+  def DrawWalls(self,axes:ClassInitial)->None|NullInitial:
+    """
+    draws all the walls as a single line broken by NaN gaps
+    """
+    xS,yS = [],[]
+    for ((x0,y0),(x1,y1)) in self.environment.walls:
+      xS += [x0,x1,math.nan]
+      yS += [y0,y1,math.nan]
+    axes.plot(xS,yS,"-k",linewidth=3)
   def Whisker(self)->bool:
     """
     returns true whenever the whisker sensor intersects with a wall
@@ -71,27 +371,49 @@ class BodyEnvironment(Environment):
     Wx = self.xPos + self.whiskerLength*math.cos(angleWorld)
     Wy = self.yPos + self.whiskerLength*math.sin(angleWorld)
     lineWhisker = ((self.xPos,self.yPos),(Wx,Wy))
-    hit = any(LineSegmentInterception(lineWhisker,wall) for wall in self.environment.walls)
+    hit = self.environment.Intersects(lineWhisker)
     if hit:
-      self.wallHistory.append((self.xPos,self.yPos))
-      if self.plotting:
-        plt.plot([self.xPos],[self.yPos],"ro")
-        plt.draw()
+      self.trace.Add("whisker",self.xPos,self.yPos)
+      if self.profiler is not None and self.profiler.timing:
+        self.profiler.Count("body.whiskerHits",self.profiler.every)
+    return hit
   def Perception(self)->dict:
-    return {
+    perception = {
       "xPos":self.xPos,
       "yPos":self.yPos,
       "direction":self.direction,
       "whisker":self.Whisker(),
       "crashed":self.crashed
     }
+    if self.lidar is not None:
+      perception["lidar"] = self.lidar.Scan(self.environment,self.xPos,self.yPos,self.direction)
+    return perception
+  def LidarValues(self)->tuple:
+    """
+    the lidar distances for a stored record (nothing without a lidar)
+    """
+    if self.lidar is None:
+      return ()
+    return (self.lidar.Scan(self.environment,self.xPos,self.yPos,self.direction),)
   InitialPerception = Perception # use percept function for initial percept too
   def Do(self,action)->ClassInitial:
     """
     action is {'steer':direction}
     """
+    self.steps += 1
+    profiler = self.profiler
+    timed = False
+    if profiler is not None:
+      every = profiler.every
+      timed = profiler.timing = self.steps%every == 0
+      if timed:
+        profiler.Count("body.steps",every)
+        start = profiler.clock()
     if self.crashed:
-      return self.Perception()
+      perception = self.StoredPerception()
+      if timed:
+        profiler.timing = False
+      return perception
     # direction is 'left', 'right' or 'straight'
     directionSteer = action["steer"]
     compassDerivation = {"left":1,"straight":0,"right":-1}[directionSteer]*self.turningAngle
@@ -99,19 +421,73 @@ class BodyEnvironment(Environment):
     xPosNew = self.xPos+math.cos(self.direction*math.pi/180)
     yPosNew = self.yPos+math.sin(self.direction*math.pi/180)
     path = ((self.xPos,self.yPos),(xPosNew,yPosNew))
-    if any(LineSegmentInterception(path,wall) for wall in self.environment.walls):
+    if timed:
+      start = profiler.Add("body.move",start,every)
+    if self.environment.Intersects(path):
       self.crashed = True
-      if self.plotting:
-        plt.plot([self.xPos],[self.yPos],"r*",markersize=15.0)
-        plt.draw()
+      self.trace.Add("crash",self.xPos,self.yPos)
+    if timed:
+      start = profiler.Add("body.collision",start,every)
     self.xPos,self.yPos = xPosNew,yPosNew
-    self.history.append((self.xPos,self.yPos))
-    if self.plotting and not self.crashed:
-      plt.plot([self.xPos],[self.yPos],"go")
-      plt.draw()
-      plt.pause(self.sleepTime)
-    return self.Perception()
-  
+    self.trace.Add("path",self.xPos,self.yPos)
+    self.renderer.Step()
+    if timed:
+      start = profiler.Add("body.render",start,every)
+    perception = self.StoredPerception()
+    if timed:
+      profiler.Add("body.perception",start,every)
+      profiler.timing = False
+    return perception
+  def CanCoast(self)->bool:
+    """
+    true when straight steps can be taken at once: not crashed, nothing drawn step by step, and a heading that straight steps leave unchanged
+    """
+    if self.lidar is not None and self.store is not None:
+      return False # the stored records would need the lidar of every coasted step
+    return not self.crashed and not self.renderer.stepwise and (self.direction+360)%360 == self.direction
+  def Coast(self,steps:int)->dict:
+    """
+    does what steps calls of Do({'steer':'straight'}) would do, with the same positions, trace and stored records
+    the caller makes sure that no step crashes and that the whisker is off after every step but the last one
+    returns the perception after the last step
+    """
+    cosine,sine = math.cos(self.direction*math.pi/180),math.sin(self.direction*math.pi/180)
+    # cumulative sums add the moves one by one, as Do does
+    moves = np.empty(steps+1)
+    moves[0],moves[1:] = self.xPos,cosine
+    xS = np.cumsum(moves)[1:]
+    moves[0],moves[1:] = self.yPos,sine
+    yS = np.cumsum(moves)[1:]
+    self.xPos,self.yPos = xS[-1].item(),yS[-1].item()
+    self.trace.Extend("path",xS,yS)
+    for idx in range(steps):
+      self.renderer.Step()
+    first = self.steps+1
+    self.steps += steps
+    if self.profiler is not None:
+      self.profiler.Count("body.coastSteps",steps)
+    perception = self.Perception()
+    if self.store is not None:
+      records = np.zeros(steps,dtype=self.store.recordType)
+      records["step"] = np.arange(first,self.steps+1)
+      records["xPos"],records["yPos"],records["direction"] = xS,yS,self.direction
+      records["whisker"][-1] = bool(perception["whisker"])
+      self.store.Extend(records)
+    return perception
+  def StoredPerception(self)->dict:
+    """
+    returns the perception, appending it to the trajectory file when there is one
+    """
+    perception = self.Perception()
+    if self.store is not None:
+      self.store.Append(self.steps,self.xPos,self.yPos,self.direction,bool(perception["whisker"]),self.crashed,*([perception["lidar"]] if self.lidar is not None else []))
+    return perception
+  def Fork(self)->ClassInitial:
+    clone = Environment.Fork(self)
+    clone.store = None
+    clone.SetRenderer(Renderer())
+    return clone
+
 
 """
 # Middle Layer
@@ -121,14 +497,23 @@ class BodyEnvironment(Environment):
 - It calculates steering directions to navigate towards a target position without colliding with walls.
 - Utilizes the Whisker sensor information to avoid obstacles.
 - The Steer method decides on the steering action based on the target location and whisker detection.
+- Macro steps (macroStep, on by default): while the robot heads straight at the target, SafeSteps works out how many steps surely stay
+  straight, away from the target, with the whisker off and without a crash, by casting the strip swept by the body and its whisker against the walls.
+  The body then coasts over them in one update (BodyEnvironment.Coast); the positions, history and outcome are the same as stepping one at a time.
+  The bounds keep a margin, so any step close to an event (arrival, whisker contact, crash or heading correction) is still taken on its own.
 """
 class MiddleEnvironment(Environment):
+  stateFields = ("environment","perception")
   def __init__(self,environment)->ClassInitial:
     self.environment = environment
     self.perception = environment.InitialPerception()
     self.straightAngle = 11 # angle that is close enough to straight ahead
     self.closeThreshold = 2 # distance that is close enough to arrived
     self.closeThresholdSquared = self.closeThreshold**2 # just compute it once
+    self.macroStep = True # coast over the steps that surely go straight (see SafeSteps)
+    self.maxCoast = 4096 # most steps taken in one update
+    self.margin = 1e-6 # how close to an event a coasted step may come (in steps, degrees and squared distance)
+    self.index = None # WallIndex of the walls, rebuilt when they change
   def InitialPerception(self)->dict:
     return {}
   def IsCloseEnough(self,targetPosition)->bool:
@@ -154,9 +539,15 @@ class MiddleEnvironment(Environment):
       return "right"
     else:
       return "straight"
-  def Steer(self,targetPosition)->str:
+  def Steer(self,targetPosition,verbose:bool|None=None)->str:
+    """
+    verbose is Displaying(3), hoisted by a caller that steers in a loop
+    """
     if self.perception["whisker"]:
-      self.display(3,"whisker on",self.perception)
+      if verbose is None:
+        verbose = self.Displaying(3)
+      if verbose:
+        self.display(3,"whisker on",self.perception)
       return "left"
     else:
       return self.HeadTowards(targetPosition)
@@ -175,35 +566,191 @@ class MiddleEnvironment(Environment):
       remaining = -1 # will never reach 0
     targetPosition = action["go_to"]
     arrived = self.IsCloseEnough(targetPosition)
+    profiler = self.profiler
+    every = profiler.every if profiler is not None else 0
+    verbose = self.Displaying(3)
+    count = 0
     while not arrived and remaining != 0:
-      self.perception = self.environment.Do({"steer":self.Steer(targetPosition)})
+      if self.macroStep and remaining != 1:
+        steps = self.SafeSteps(targetPosition,remaining if remaining > 0 else self.maxCoast)
+        if steps > 1:
+          self.perception = self.environment.Coast(steps)
+          count += steps
+          remaining -= steps
+          arrived = self.IsCloseEnough(targetPosition)
+          continue
+      timed = every and count%every == 0
+      if timed:
+        start = profiler.clock()
+      steer = self.Steer(targetPosition,verbose)
+      if timed:
+        start = profiler.Add("middle.steer",start,every)
+      self.perception = self.environment.Do({"steer":steer})
+      if timed:
+        profiler.Add("middle.body",start,every)
+      count += 1
       remaining -= 1
       arrived = self.IsCloseEnough(targetPosition)
+    if profiler is not None:
+      profiler.Count("middle.steps",count)
     return {"arrived":arrived}
+  def SafeSteps(self,targetPosition:tuple,limit:int)->int:
+    """
+    the number of straight steps from now (at most limit) that surely do not arrive, turn the whisker on or crash,
+    and after each of which but the last one HeadTowards surely says "straight"; 0 when coasting does not apply
+    """
+    perception = self.perception
+    body = self.environment
+    if perception["whisker"] or perception["crashed"] or not hasattr(body,"Coast") or not body.CanCoast():
+      return 0
+    if self.HeadTowards(targetPosition) != "straight":
+      return 0
+    Gx,Gy = targetPosition
+    x0,y0,direction = perception["xPos"],perception["yPos"],perception["direction"]
+    # past the target the heading has to turn, so there is no need to look further
+    horizon = min(limit,self.maxCoast,int(math.hypot(Gx-x0,Gy-y0))+2)
+    if horizon < 2:
+      return 0
+    cosine,sine = math.cos(direction*math.pi/180),math.sin(direction*math.pi/180)
+    moves = np.empty(horizon+1)
+    moves[0],moves[1:] = x0,cosine
+    xS = np.cumsum(moves)[1:]
+    moves[0],moves[1:] = y0,sine
+    yS = np.cumsum(moves)[1:]
+    steps = horizon
+    # arrival after step j stops before j
+    near = np.flatnonzero((Gx-xS)**2+(Gy-yS)**2 <= self.closeThresholdSquared+self.margin)
+    if len(near):
+      steps = min(steps,int(near[0]))
+    # a heading correction after step j stops at j
+    dX,dY = Gx-xS,Gy-yS
+    with np.errstate(invalid="ignore",divide="ignore"):
+      goal = np.degrees(np.arccos(dX/np.sqrt(dX*dX+dY*dY)))
+    goal = np.where(yS > Gy,-goal,goal)
+    goalFrom = (goal-direction+540)%360-180
+    turning = np.flatnonzero(~(np.abs(goalFrom) <= self.straightAngle-self.margin))
+    if len(turning):
+      steps = min(steps,int(turning[0])+1)
+    if steps < 2:
+      return 0
+    return min(steps,self.ClearSteps(x0,y0,direction,steps))
+  def ClearSteps(self,x0:float,y0:float,direction:float,steps:int)->int:
+    """
+    the number of straight steps (at most steps) before any wall comes near the path or the whisker
+    the whisker sweeps the strip p0+s*u+t*w (u the unit heading, w the whisker, 0<=t<=1), and the path is its edge t=0;
+    the step j path and whisker reach s=j, so the steps before the smallest s of any wall inside the strip are clear
+    """
+    body = self.environment
+    walls = body.environment
+    self.index = Fresh(self.index,walls)
+    angle = (direction-body.whiskerAngle)*math.pi/180
+    uX,uY = math.cos(direction*math.pi/180),math.sin(direction*math.pi/180)
+    wX,wY = body.whiskerLength*math.cos(angle),body.whiskerLength*math.sin(angle)
+    determinant = uX*wY-wX*uY
+    if abs(determinant) < 1e-9:
+      return 0
+    end = (x0+steps*uX,y0+steps*uY)
+    _,rows = self.index.Candidates(np.array([[(x0,y0),end]]),body.whiskerLength+1)
+    if len(rows) == 0:
+      return steps
+    segments = walls.wallArray[np.unique(rows)]
+    # wall ends in strip coordinates (s,t)
+    pX,pY = segments[...,0]-x0,segments[...,1]-y0
+    s = (pX*wY-wX*pY)/determinant
+    t = (uX*pY-pX*uY)/determinant
+    # clip every wall to the band -margin <= t <= 1+margin
+    low,high = -self.margin,1+self.margin
+    dT = t[:,1]-t[:,0]
+    with np.errstate(invalid="ignore",divide="ignore"):
+      enter = np.where(dT != 0,(np.where(dT > 0,low,high)-t[:,0])/dT,-np.inf)
+      leave = np.where(dT != 0,(np.where(dT > 0,high,low)-t[:,0])/dT,np.inf)
+    flat = (dT == 0)&((t[:,0] < low)|(t[:,0] > high))
+    enter,leave = np.maximum(enter,0),np.minimum(leave,1)
+    inside = (enter <= leave)&~flat
+    if not inside.any():
+      return steps
+    dS = s[:,1]-s[:,0]
+    sEnter,sLeave = s[:,0]+enter*dS,s[:,0]+leave*dS
+    nearest,farthest = np.minimum(sEnter,sLeave)[inside],np.maximum(sEnter,sLeave)[inside]
+    ahead = farthest >= -self.margin
+    if not ahead.any():
+      return steps
+    return max(0,min(steps,math.ceil(nearest[ahead].min()-self.margin)-1))
 
 """
 # Top Layer
 - The top layer treats the middle layer as its environment. Note that the top layer is an environment for us to tell it what to visit.
 - Defines higher-level navigation tasks, such as visiting specific locations within the environment.
 - It interacts with the MiddleEnvironment to execute these tasks by steering the agent towards the designated positions.
+- With a RoutePlanner (see route_planner) each location is reached through the waypoints of a path around the walls,
+  each waypoint with its own timeout, and {'optimize':True} in the plan reorders the visits into a short tour.
 """
 class TopEnvironment(Environment):
+  stateFields = ("middle","at")
   def __init__(self,middle:ClassInitial,timeout:int=200,locations:dict={
     "mail":(-5,10),
     "o103":(50,100),
     "o109":(100,10),
     "storage":(101,51)
-  }):
+  },planner:ClassInitial=None):
     self.middle = middle
     self.timeout = timeout
     self.locations = locations
+    self.planner = planner
+    self.at = None # the location last arrived at
   def Do(self,plan):
+    """
+    plan is {'visit':[location,...]} with an optional 'optimize':True
+    returns {'visited':the locations in the order they were visited,'arrived':whether each was reached}
+    """
     toDo = plan["visit"]
+    profiler = self.profiler
+    if profiler is not None:
+      start = profiler.clock()
+    if self.planner is not None and plan.get("optimize",False):
+      order = self.planner.Order(self.Here(),[self.locations[loc] for loc in toDo])
+      toDo = [toDo[idx] for idx in order]
+      if profiler is not None:
+        start = profiler.Add("top.order",start)
+    reached = []
     for loc in toDo:
       position = self.locations[loc]
-      arrived = self.middle.Do({"go_to":position,"timeout":self.timeout})
+      if self.planner is None:
+        arrived = self.middle.Do({"go_to":position,"timeout":self.timeout})
+      else:
+        arrived = self.FollowRoute(position)
+      self.at = position if arrived["arrived"] else None
+      reached.append(arrived["arrived"])
+      if profiler is not None:
+        start = profiler.Add("top.visit",start)
+        profiler.Count("top.arrivals" if arrived["arrived"] else "top.timeouts")
       self.display(1,"Arrived at",loc,arrived)
+    if profiler is not None:
+      self.display(1,profiler.Report())
+    return {"visited":list(toDo),"arrived":reached}
+  def Here(self)->tuple:
+    """
+    the location the robot is at, or its position; paths from a location are memoized by the location
+    """
+    if self.at is not None and self.middle.IsCloseEnough(self.at):
+      return self.at
+    return (self.middle.perception["xPos"],self.middle.perception["yPos"])
+  def FollowRoute(self,position:tuple)->dict:
+    if self.profiler is not None:
+      start = self.profiler.clock()
+    length,waypoints = self.planner.Path(self.Here(),position)
+    if self.profiler is not None:
+      self.profiler.Add("top.path",start)
+    for waypoint in waypoints:
+      arrived = self.middle.Do({"go_to":waypoint,"timeout":self.timeout})
+      if not arrived["arrived"]:
+        break
+    return arrived
 
+"""
+# Plot Simulation
+- Draws the walls and the locations in a pyplot window and plots the body's run into it in real time.
+"""
 class PlotSimulation(Displayable):
   def __init__(self,body:ClassInitial,top:ClassInitial)->ClassInitial:
     self.body = body
@@ -214,23 +761,19 @@ class PlotSimulation(Displayable):
     plt.savefig(os.path.join(os.getcwd(),"wall_simulation.png"))
   def ReDraw(self):
     plt.clf()
-    for wall in body.environment.walls:
-      ((x0,y0),(x1,y1)) = wall
-      plt.plot([x0,x1],[y0,y1],"-k",linewidth=3)
-    for loc in top.locations:
-      (x,y) = top.locations[loc]
+    for loc in self.top.locations:
+      (x,y) = self.top.locations[loc]
       plt.plot([x],[y],"k<")
       plt.text(x+1.0,y+0.5,loc)
-    plt.plot([body.xPos],[body.yPos],"go")
-    plt.gca().figure.canvas.draw()
-    if self.body.history or self.body.wallHistory:
-      self.PlotRun()
+    plt.plot([self.body.xPos],[self.body.yPos],"go")
+    # the renderer draws the walls and the run so far, then follows the body step by step
+    self.body.SetRenderer(InteractiveRenderer(pause=self.body.sleepTime,axes=plt.gca()))
   def PlotRun(self):
-    if self.body.history:
-      xS,yS = zip(*self.body.history)
+    if len(self.body.history):
+      xS,yS = self.body.trace.Points("path")
       plt.plot(xS,yS,"go")
-    if self.body.wallHistory:
-      wxS,wyS = zip(*self.body.wallHistory)
+    if len(self.body.wallHistory):
+      wxS,wyS = self.body.trace.Points("whisker")
       plt.plot(wxS,wyS,"ro")
 
 #UNIT TEST -I
@@ -296,17 +839,27 @@ class PlotFollow(PlotSimulation):
   def OnRelease(self,event):
     self.display(2,"^",end="")
     if self.pressloc is not None: #and event.inaxes == self.pressevent.inaxes:
+      self.Forget(self.pressloc)
       self.top.locations[self.pressloc] = (event.xdata,event.ydata)
       self.display(1,f"Place: {self.pressloc} at ({event.xdata,event.ydata})")
     self.pressloc = None
     self.pressevent = None
   def OnMove(self,event):
+    verbose = self.Displaying(2)
     if self.pressloc is not None: # and event.inaxes == self.pressevent.inaxes:
-      self.display(2,"-",end="")
+      if verbose:
+        self.display(2,"-",end="")
+      self.Forget(self.pressloc)
       self.top.locations[self.pressloc] = (event.xdata,event.ydata)
       self.ReDraw()
-    else:
+    elif verbose:
       self.display(2,".",end="")
+  def Forget(self,loc):
+    """
+    drops the memoized paths of a location that is being moved
+    """
+    if getattr(self.top,"planner",None) is not None:
+      self.top.planner.Invalidate(self.top.locations[loc])
 
 #UNIT TEST
 # environment = WallEnvironment(